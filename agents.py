@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, Callable, Awaitable
 from pydantic import BaseModel, Field
 import game_master
 import log
@@ -18,7 +18,7 @@ Always be specific about which cards you're referring to, especially when multip
 class NaiveAgent(game_master.AgentInterface):
     generation_settings: dict
 
-    async def take_action(self,history:list[game_master.HistoryStep],visible_information: str, available_actions:str, rules_violation_feedback:Optional[str]=None) -> str:
+    async def take_action(self,history:list[game_master.HistoryStep],visible_information: str, available_actions:str, rules_violation_feedback:Optional[str]=None, on_text:Optional[Callable[[str], Awaitable[None]]]=None) -> str:
         system ="You are an expert Magic: The Gathering player. Your job is to win a game played over natural language with a text interface, talking to an expert judge who validates your actions and provides observations of the game state.\nHere are some of your notes to keep in mind:" + agent_advice
         messages = [
             {"role":"user", "content":f"""
@@ -41,6 +41,7 @@ Please describe your action precisely, including how you pay costs and what you
         response = await log.llm_generate(
             messages=messages,
             system=system,
+            on_text=on_text,
             **self.generation_settings
         )
         action = response['content'][0]['text']
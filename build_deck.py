@@ -8,7 +8,7 @@ import trio
 import os
 import prompting
 import anyio
-from typing import Callable
+from typing import Callable, Optional
 from pydantic import BaseModel
 
 
@@ -111,6 +111,7 @@ async def generate_deck_from_request(request: str, review_rounds: int = 3) -> di
             system=system_message,
             temperature=1,
             max_tokens=4000,
+            priority="deckbuild",
             **build_deck_tools
         )
         print(json.dumps(response, indent=2))
@@ -153,8 +154,18 @@ async def generate_deck_from_request(request: str, review_rounds: int = 3) -> di
 def truncate_string(s:str, max_length:int) -> str:
     return (s[:max_length//2-20]+"...output was over 20k characters, truncated..." + s[max_length//2-20:]) if len(s) > max_length else s
 
+# whether rendered card text was found on disk, None until the first get_all_cards_prompt call looks
+card_text_cache_loaded: Optional[bool] = None
+
 def get_all_cards_prompt():
-    return "\n".join([prompting.format_card_full(card) for card in game_state.card_database['data'].keys()])
+    global card_text_cache_loaded
+    if card_text_cache_loaded is None:
+        card_text_cache_loaded = prompting.load_card_text_cache() > 0
+    prompt = "\n".join([prompting.format_card_full(card) for card in game_state.card_database['data'].keys()])
+    if not card_text_cache_loaded:
+        prompting.save_card_text_cache()
+        card_text_cache_loaded = True
+    return prompt
     
 
 async def filter_cards_model(cards:list[str], query:str, model='claude-sonnet-4-20250514') -> list[str]:
@@ -164,7 +175,7 @@ async def filter_cards_model(cards:list[str], query:str, model='claude-sonnet-4-
         {"role": "user", "content": f"Filter the following cards to only include cards that match the query: {query}\n\n{cards_prompt}\n\nPlease respond in json like {{thinking:string, cards:[string]}}, step by step thoughts followed by a list of only card names that match the query in order shown. Respond only in json with no surrounding text."}
     ]
     print(conversation[0]['content'])
-    response = await log.llm_generate(model=model, messages=conversation)
+    response = await log.llm_generate(model=model, messages=conversation, priority="deckbuild")
     print(response['content'][0]['text'])
     return json.loads(response['content'][0]['text'])['cards']
 
@@ -248,6 +259,7 @@ Note: only suggest specific cards if they are well known to be strong, otherwise
     response = await log.llm_generate(
         model="claude-sonnet-4-20250514",
         messages=conversation,
+        priority="deckbuild",
     )
     print("Review Decklist Response:")
     print(response['content'][0]['text'])
@@ -0,0 +1,213 @@
+"""Compact binary card database, written by process_assets.py next to AtomicCardsGameplay.json and read lazily through mmap,
+so importing game_state doesn't parse the whole json and every process shares the same pages.
+
+Layout, all integers little endian:
+    header: magic, version, field count, string count, card count
+    string end offsets: (string count) uint32, into the string blob
+    card name string ids: (card count) uint32, sorted by name
+    card record end offsets: (card count) uint32, into the record blob
+    string blob: utf-8 strings. Field names come first, every other string is stored once
+    record blob: per card, entries of (field id uint8, kind uint8, value)"""
+import json
+import mmap
+import os
+import struct
+from collections.abc import Iterator, Mapping, MutableMapping
+from typing import Any, Optional
+
+magic = b"MTGCARDS"
+version = 1
+header_format = "<8sIIII"
+
+kind_none, kind_int, kind_float, kind_str, kind_str_list, kind_bool, kind_json = range(7)
+
+def _encode_value(value: Any, intern) -> tuple[int, bytes]:
+    if value is None:
+        return kind_none, b""
+    if isinstance(value, bool):
+        return kind_bool, struct.pack("<B", value)
+    if isinstance(value, int) and -2**31 <= value < 2**31:
+        return kind_int, struct.pack("<i", value)
+    if isinstance(value, float):
+        return kind_float, struct.pack("<d", value)
+    if isinstance(value, str):
+        return kind_str, struct.pack("<I", intern(value))
+    if isinstance(value, list) and len(value) < 2**16 and all(isinstance(item, str) for item in value):
+        return kind_str_list, struct.pack(f"<H{len(value)}I", len(value), *(intern(item) for item in value))
+    return kind_json, struct.pack("<I", intern(json.dumps(value)))
+
+def write_card_store(cards: Mapping[str, dict], path: str):
+    fields: list[str] = sorted({field for card in cards.values() for field in card})
+    assert len(fields) < 256, "field ids are one byte"
+    strings: list[str] = list(fields)
+    string_ids: dict[str, int] = {field: i for i, field in enumerate(fields)}
+    def intern(string: str) -> int:
+        if string not in string_ids:
+            string_ids[string] = len(strings)
+            strings.append(string)
+        return string_ids[string]
+
+    names = sorted(cards)
+    name_ids = [intern(name) for name in names]
+    records = bytearray()
+    record_ends = []
+    for name in names:
+        for field, value in cards[name].items():
+            kind, payload = _encode_value(value, intern)
+            records += struct.pack("<BB", string_ids[field], kind) + payload
+        record_ends.append(len(records))
+
+    encoded_strings = [string.encode() for string in strings]
+    string_ends = []
+    total = 0
+    for encoded in encoded_strings:
+        total += len(encoded)
+        string_ends.append(total)
+
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(struct.pack(header_format, magic, version, len(fields), len(strings), len(names)))
+        f.write(struct.pack(f"<{len(string_ends)}I", *string_ends))
+        f.write(struct.pack(f"<{len(name_ids)}I", *name_ids))
+        f.write(struct.pack(f"<{len(record_ends)}I", *record_ends))
+        f.write(b"".join(encoded_strings))
+        f.write(records)
+    os.replace(temporary_path, path)
+
+class CardStore(Mapping[str, dict]):
+    "Read only card infos by name from a file written by write_card_store. The file is opened on first use."
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mmap: Optional[mmap.mmap] = None
+
+    def _open(self) -> mmap.mmap:
+        if self._mmap is None:
+            with open(self.path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            file_magic, file_version, self._n_fields, self._n_strings, self._n_cards = struct.unpack_from(header_format, self._mmap)
+            if file_magic != magic or file_version != version:
+                raise ValueError(f"{self.path} is not a version {version} card store, rerun process_assets.py")
+            self._string_ends_offset = struct.calcsize(header_format)
+            self._name_ids_offset = self._string_ends_offset + 4 * self._n_strings
+            self._record_ends_offset = self._name_ids_offset + 4 * self._n_cards
+            self._strings_offset = self._record_ends_offset + 4 * self._n_cards
+            self._records_offset = self._strings_offset + (self._uint32(self._string_ends_offset, self._n_strings - 1) if self._n_strings else 0)
+        return self._mmap
+
+    def _uint32(self, array_offset: int, index: int) -> int:
+        return struct.unpack_from("<I", self._mmap, array_offset + 4 * index)[0]
+
+    def _string(self, string_id: int) -> str:
+        start = self._uint32(self._string_ends_offset, string_id - 1) if string_id else 0
+        end = self._uint32(self._string_ends_offset, string_id)
+        return self._mmap[self._strings_offset + start:self._strings_offset + end].decode()
+
+    def _name(self, index: int) -> str:
+        return self._string(self._uint32(self._name_ids_offset, index))
+
+    def _find(self, name: str) -> Optional[int]:
+        self._open()
+        low, high = 0, self._n_cards
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(middle) < name:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._n_cards and self._name(low) == name:
+            return low
+        return None
+
+    def _record(self, index: int) -> dict:
+        mm = self._mmap
+        position = self._records_offset + (self._uint32(self._record_ends_offset, index - 1) if index else 0)
+        end = self._records_offset + self._uint32(self._record_ends_offset, index)
+        card: dict[str, Any] = {}
+        while position < end:
+            field_id, kind = struct.unpack_from("<BB", mm, position)
+            position += 2
+            if kind == kind_none:
+                value = None
+            elif kind == kind_int:
+                value = struct.unpack_from("<i", mm, position)[0]
+                position += 4
+            elif kind == kind_float:
+                value = struct.unpack_from("<d", mm, position)[0]
+                position += 8
+            elif kind == kind_bool:
+                value = bool(mm[position])
+                position += 1
+            elif kind == kind_str_list:
+                count = struct.unpack_from("<H", mm, position)[0]
+                value = [self._string(string_id) for string_id in struct.unpack_from(f"<{count}I", mm, position + 2)]
+                position += 2 + 4 * count
+            else:
+                value = self._string(struct.unpack_from("<I", mm, position)[0])
+                position += 4
+                if kind == kind_json:
+                    value = json.loads(value)
+            card[self._string(field_id)] = value
+        return card
+
+    def __getitem__(self, name: str) -> dict:
+        index = self._find(name)
+        if index is None:
+            raise KeyError(name)
+        return self._record(index)
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and self._find(name) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        self._open()
+        return (self._name(index) for index in range(self._n_cards))
+
+    def __len__(self) -> int:
+        self._open()
+        return self._n_cards
+
+class CardDatabase(MutableMapping[str, dict]):
+    "Cards from a CardStore plus cards added at runtime, eg tokens, which take precedence."
+
+    def __init__(self, store: Mapping[str, dict]):
+        self.store = store
+        self.added: dict[str, dict] = {}
+        self.removed: set[str] = set()
+
+    def __getitem__(self, name: str) -> dict:
+        if name in self.added:
+            return self.added[name]
+        if name in self.removed:
+            raise KeyError(name)
+        return self.store[name]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.added or (name not in self.removed and name in self.store)
+
+    def __setitem__(self, name: str, info: dict):
+        self.added[name] = info
+        self.removed.discard(name)
+
+    def __delitem__(self, name: str):
+        if name not in self:
+            raise KeyError(name)
+        self.added.pop(name, None)
+        if name in self.store:
+            self.removed.add(name)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.added
+        for name in self.store:
+            if name not in self.added and name not in self.removed:
+                yield name
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+def load_card_database(json_path: str, store_path: str) -> dict[str, Any]:
+    "The card database in the json's shape, `{'data': {name: card info}}`, from the binary store unless it's missing or older than the json."
+    if os.path.exists(store_path) and (not os.path.exists(json_path) or os.path.getmtime(store_path) >= os.path.getmtime(json_path)):
+        return {"data": CardDatabase(CardStore(store_path))}
+    with open(json_path) as f:
+        return json.load(f)
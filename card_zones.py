@@ -0,0 +1,416 @@
+"""Card storage behind game_state: the card database, dense card ids, and the zone and battlefield containers that
+index cards by type. Judge code sees game_state.py, which re-exports what it and the rest of the code use from here."""
+from pydantic import BaseModel
+from pydantic_core import core_schema
+from typing import Optional, Any, Iterable, Iterator
+from enum import IntFlag, auto
+import copy
+import re
+from array import array
+from collections.abc import MutableMapping
+import card_store
+
+Card = str  # Type alias
+
+def card_fill_missing_fields(card_info: dict) -> dict:
+    if not card_info.get('manaValue'):
+        card_info['manaValue'] = 0
+    if not card_info.get('manaCost'):
+        card_info['manaCost'] = ""
+    if not card_info.get('text'):
+        card_info['text'] = ""
+    return card_info
+
+# process_assets.py writes the compact store, the json is only parsed if the store is missing or out of date
+card_database_json_path = "assets/AtomicCardsGameplay.json"
+card_store_path = "assets/AtomicCardsGameplay.cards"
+card_database: dict[str, MutableMapping[str, dict]] = card_store.load_card_database(card_database_json_path, card_store_path)
+registered_tokens: dict[str, dict] = {}
+
+class CardType(IntFlag):
+    LAND = auto()
+    CREATURE = auto()
+    ARTIFACT = auto()
+    ENCHANTMENT = auto()
+    PLANESWALKER = auto()
+    INSTANT = auto()
+    SORCERY = auto()
+    BATTLE = auto()
+    KINDRED = auto()
+    BASIC = auto()  # supertype, set on basic lands
+
+reminder_text_pattern = re.compile(r'\([^)]*\)')
+
+class CardRecord:
+    "Immutable normalized card info with what sorting, type checks and keyword checks need precomputed."
+    __slots__ = ("card_id", "name", "info", "type_flags", "sort_key", "token_info", "rules_text")
+
+    def __init__(self, card_id: int, name: str, info: dict, token_info: Optional[dict]):
+        type_flags = CardType(0)
+        for type_name in info.get("types", []):
+            type_flags |= CardType.__members__.get(type_name.upper(), CardType(0))
+        if "Basic" in (info.get("supertypes") or []):
+            type_flags |= CardType.BASIC
+        # within each mana value: basic lands, other lands, noncreature spells, then creatures
+        type_priority = 4 if CardType.BASIC in type_flags else (3 if CardType.LAND in type_flags else (1 if CardType.CREATURE in type_flags else 2))
+        for slot, value in (("card_id", card_id), ("name", name), ("info", info), ("type_flags", type_flags),
+                            ("sort_key", (info["manaValue"], -type_priority)), ("token_info", token_info),
+                            ("rules_text", reminder_text_pattern.sub('', info["text"]).strip())):
+            object.__setattr__(self, slot, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CardRecord is immutable")
+
+class CardRegistry:
+    """Dense integer ids for card names, and their CardRecords. Ids are only meaningful in this process, states are
+    serialized and sent between processes with names."""
+
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+        self.names: list[str] = []
+        self._records: list[Optional[CardRecord]] = []
+
+    def id_of(self, name: str) -> int:
+        card_id = self.ids.get(name)
+        if card_id is None:
+            card_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self._records.append(None)
+        return card_id
+
+    def record(self, card_id: int) -> CardRecord:
+        "Raises KeyError for names that aren't in card_database."
+        record = self._records[card_id]
+        # tokens can be registered again with different info, eg by another game in the same worker
+        if record is None or record.token_info is not registered_tokens.get(record.name):
+            name = self.names[card_id]
+            record = self._records[card_id] = CardRecord(card_id, name, card_fill_missing_fields(dict(card_database['data'][name])), registered_tokens.get(name))
+        return record
+
+    def sort_key(self, card_id: int) -> tuple:
+        return self.record(card_id).sort_key
+
+card_registry = CardRegistry()
+
+# Battlefield indexes these fields. Setting them directly instead of through PlayerBoard methods makes the
+# battlefield holding the card rebuild its indexes the next time they're used
+indexed_battlefield_card_fields = frozenset({"card", "owner", "tapped"})
+
+def card_id_type_flags(card_id: int) -> CardType:
+    "Types of a card by registry id, CardType(0) for names that aren't in the card database."
+    try:
+        return card_registry.record(card_id).type_flags
+    except KeyError:
+        return CardType(0)
+
+def card_type_flags(card: Card) -> CardType:
+    "Types of a card, CardType(0) for names that aren't in the card database."
+    return card_id_type_flags(card_registry.id_of(card))
+
+class Battlefield(MutableMapping):
+    """Permanents a player controls, by battlefield id. Used like a dict by judge code. Keeps indexes of ids by card type,
+    owner and tapped state, built on first use and then updated as permanents are added, removed, tapped and untapped.
+    Each card tells the one battlefield it belongs to when its indexed fields are set. A battlefield holding cards that
+    belong to another, eg a shallow copy, can't be told and rebuilds its indexes on every query instead."""
+    __slots__ = ("cards", "_by_type", "_by_owner", "_tapped", "_indexed", "_borrowed")
+
+    def __init__(self, cards: Optional[dict[int, "BattlefieldCard"]] = None):
+        self.cards: dict[int, "BattlefieldCard"] = dict(cards or {})
+        self._by_type: dict[CardType, set[int]] = {}
+        self._by_owner: dict[int, set[int]] = {}
+        self._tapped: set[int] = set()
+        # whether the indexes are up to date. Cards are attached to this battlefield when they're first indexed
+        self._indexed = False
+        # whether some cards belong to another battlefield, so changes to them don't reset _indexed
+        self._borrowed = False
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: Any, handler: Any) -> core_schema.CoreSchema:
+        # game_state defines the card model and builds PlayerBoard's schema after importing this module
+        from game_state import BattlefieldCard
+        cards_schema = handler.generate_schema(dict[int, BattlefieldCard])
+        from_dict = core_schema.no_info_after_validator_function(cls, cards_schema)
+        return core_schema.json_or_python_schema(
+            json_schema=from_dict,
+            python_schema=core_schema.union_schema([core_schema.is_instance_schema(cls), from_dict]),
+            serialization=core_schema.plain_serializer_function_ser_schema(lambda battlefield: battlefield.cards, return_schema=cards_schema),
+        )
+
+    def _index_card(self, battlefield_id: int, battlefield_card: "BattlefieldCard"):
+        for card_type in card_type_flags(battlefield_card.card):
+            self._by_type.setdefault(card_type, set()).add(battlefield_id)
+        self._by_owner.setdefault(battlefield_card.owner, set()).add(battlefield_id)
+        if battlefield_card.tapped:
+            self._tapped.add(battlefield_id)
+
+    def _unindex_card(self, battlefield_id: int):
+        for ids in self._by_type.values():
+            ids.discard(battlefield_id)
+        for ids in self._by_owner.values():
+            ids.discard(battlefield_id)
+        self._tapped.discard(battlefield_id)
+
+    def _attach(self, battlefield_card: "BattlefieldCard") -> bool:
+        "Make this the battlefield `battlefield_card` tells about changes, unless another one that still holds it is. Returns whether it is."
+        owner = getattr(battlefield_card, "_battlefield", None)
+        if owner is not None and owner is not self and any(card is battlefield_card for card in owner.cards.values()):
+            return False
+        object.__setattr__(battlefield_card, "_battlefield", self)
+        return True
+
+    def _indexes(self) -> "Battlefield":
+        if not self._indexed or self._borrowed:
+            self._by_type, self._by_owner, self._tapped = {}, {}, set()
+            self._borrowed = False
+            for battlefield_id, battlefield_card in self.cards.items():
+                if getattr(battlefield_card, "_battlefield", None) is not self and not self._attach(battlefield_card):
+                    self._borrowed = True
+                self._index_card(battlefield_id, battlefield_card)
+            self._indexed = True
+        return self
+
+    def ids_of_type(self, card_type: CardType) -> set[int]:
+        "Ids of permanents with all the types in `card_type`, every permanent for CardType(0). Don't modify the result."
+        indexes = self._indexes()
+        types = list(card_type)
+        if not types:
+            return set(self.cards)
+        if len(types) == 1:
+            return indexes._by_type.get(types[0], set())
+        return set.intersection(*(indexes._by_type.get(single_type, set()) for single_type in types))
+
+    def ids_owned_by(self, player_index: int) -> set[int]:
+        return self._indexes()._by_owner.get(player_index, set())
+
+    def tapped_ids(self) -> set[int]:
+        return self._indexes()._tapped
+
+    def set_tapped(self, battlefield_ids: Iterable[int], tapped: bool):
+        "Tap or untap permanents, keeping the indexes up to date without a rebuild."
+        indexed = self._indexed and not self._borrowed
+        for battlefield_id in battlefield_ids:
+            self.cards[battlefield_id].tapped = tapped
+            if tapped:
+                self._tapped.add(battlefield_id)
+            else:
+                self._tapped.discard(battlefield_id)
+        # setting tapped marked the indexes out of date, but they've been updated here
+        self._indexed = indexed
+
+    def __getitem__(self, battlefield_id: int) -> "BattlefieldCard":
+        return self.cards[battlefield_id]
+
+    def __setitem__(self, battlefield_id: int, battlefield_card: "BattlefieldCard"):
+        if battlefield_id in self.cards:
+            del self[battlefield_id]
+        self.cards[battlefield_id] = battlefield_card
+        if not self._attach(battlefield_card):
+            self._borrowed = True
+        if self._indexed:
+            self._index_card(battlefield_id, battlefield_card)
+
+    def __delitem__(self, battlefield_id: int):
+        battlefield_card = self.cards.pop(battlefield_id)
+        if getattr(battlefield_card, "_battlefield", None) is self:
+            object.__setattr__(battlefield_card, "_battlefield", None)
+        if self._indexed:
+            self._unindex_card(battlefield_id)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.cards)
+
+    def __len__(self) -> int:
+        return len(self.cards)
+
+    def __contains__(self, battlefield_id: object) -> bool:
+        return battlefield_id in self.cards
+
+    def keys(self):
+        return self.cards.keys()
+
+    def values(self):
+        return self.cards.values()
+
+    def items(self):
+        return self.cards.items()
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Battlefield):
+            return self.cards == other.cards
+        if isinstance(other, dict):
+            return self.cards == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(self.cards)
+
+    def __reduce__(self):
+        return (Battlefield, (self.cards,))
+
+    def __copy__(self) -> "Battlefield":
+        return Battlefield(self.cards)
+
+    def __deepcopy__(self, memo) -> "Battlefield":
+        return Battlefield({battlefield_id: copy.deepcopy(battlefield_card, memo) for battlefield_id, battlefield_card in self.cards.items()})
+
+    copy = __copy__
+
+def sort_key(card: Card):
+    return card_registry.record(card_registry.id_of(card)).sort_key
+
+class CardZone(list):
+    """List of card names. Judge code uses it like any other list, eg with `+`, `*` or json.dumps. Keeps a count of cards
+    by their types, built on first use and then updated as cards are added and removed, eg by draw_cards, and the cards'
+    registry ids for hashing, built on first use and dropped when the zone changes."""
+    __slots__ = ("_ids", "_type_counts")
+
+    def __init__(self, cards: Iterable[Card] = ()):
+        super().__init__(cards)
+        self._ids: Optional[array] = None
+        # number of cards by their full type flags, None until first used
+        self._type_counts: Optional[dict[CardType, int]] = None
+
+    @classmethod
+    def from_ids(cls, ids: Iterable[int]) -> "CardZone":
+        return cls(card_registry.names[card_id] for card_id in ids)
+
+    @property
+    def ids(self) -> array:
+        "Registry ids of the cards, in order. Don't modify the result."
+        if self._ids is None:
+            self._ids = array("I", [card_registry.id_of(card) for card in self])
+        return self._ids
+
+    def _count(self, card: Card, change: int):
+        self._ids = None
+        if self._type_counts is not None:
+            type_flags = card_type_flags(card)
+            self._type_counts[type_flags] = self._type_counts.get(type_flags, 0) + change
+
+    def _reset(self):
+        self._ids = None
+        self._type_counts = None
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: Any, handler: Any) -> core_schema.CoreSchema:
+        from_names = core_schema.no_info_after_validator_function(cls, core_schema.list_schema(core_schema.str_schema()))
+        return core_schema.json_or_python_schema(
+            json_schema=from_names,
+            python_schema=core_schema.union_schema([core_schema.is_instance_schema(cls), from_names]),
+            serialization=core_schema.plain_serializer_function_ser_schema(list, return_schema=core_schema.list_schema(core_schema.str_schema())),
+        )
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            super().__setitem__(index, list(value))
+            self._reset()
+        else:
+            self._count(self[index], -1)
+            super().__setitem__(index, value)
+            self._count(value, 1)
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            self._reset()
+        else:
+            self._count(self[index], -1)
+        super().__delitem__(index)
+
+    def __iadd__(self, cards: Iterable[Card]) -> "CardZone":
+        self.extend(cards)
+        return self
+
+    def __imul__(self, times: int) -> "CardZone":
+        super().__imul__(times)
+        self._reset()
+        return self
+
+    # list's own versions already return plain lists, spelled out since judge code relies on them
+    def __add__(self, cards: Iterable[Card]) -> list[Card]:
+        return list(self) + list(cards)
+
+    def __radd__(self, cards: Iterable[Card]) -> list[Card]:
+        return list(cards) + list(self)
+
+    def __mul__(self, times: int) -> list[Card]:
+        return list(self) * times
+
+    __rmul__ = __mul__
+
+    def __reduce__(self):
+        return (CardZone, (list(self),))
+
+    def __copy__(self) -> "CardZone":
+        return CardZone(self)
+
+    def __deepcopy__(self, memo) -> "CardZone":
+        return CardZone(self)
+
+    copy = __copy__
+
+    def insert(self, index: int, card: Card):
+        super().insert(index, card)
+        self._count(card, 1)
+
+    def append(self, card: Card):
+        super().append(card)
+        self._count(card, 1)
+
+    def extend(self, cards: Iterable[Card]):
+        for card in list(cards):
+            self.append(card)
+
+    def pop(self, index: int = -1) -> Card:
+        card = super().pop(index)
+        self._count(card, -1)
+        return card
+
+    def remove(self, card: Card):
+        super().remove(card)
+        self._count(card, -1)
+
+    def clear(self):
+        super().clear()
+        self._reset()
+
+    def reverse(self):
+        super().reverse()
+        self._ids = None
+
+    def sort(self, key=None, reverse: bool = False):
+        super().sort(key=key, reverse=reverse)
+        self._ids = None
+
+    def count_of_type(self, card_type: CardType) -> int:
+        "Number of cards with all the types in `card_type`, every card for CardType(0)."
+        if self._type_counts is None:
+            self._type_counts = {}
+            for card_id in self.ids:
+                type_flags = card_id_type_flags(card_id)
+                self._type_counts[type_flags] = self._type_counts.get(type_flags, 0) + 1
+        return sum(count for type_flags, count in self._type_counts.items() if card_type in type_flags)
+
+    def sorted_by_sort_key(self) -> list[Card]:
+        return [card_registry.names[card_id] for card_id in sorted(self.ids, key=card_registry.sort_key)]
+
+def shared_copy(value, previous=None):
+    """Copy `value`, reusing parts of `previous` (an older copy that is never mutated) wherever they are equal.
+    Unchanged zones and permanents are shared instead of copied, so a chain of copies grows with the size of each change."""
+    if previous is not None and type(previous) is type(value) and previous == value:
+        return previous
+    if isinstance(value, CardZone):
+        return value.copy()
+    if isinstance(value, Battlefield):
+        return Battlefield(shared_copy(value.cards, previous.cards if isinstance(previous, Battlefield) else None))
+    if isinstance(value, BaseModel):
+        fields = {name: shared_copy(getattr(value, name), getattr(previous, name, None)) for name in type(value).model_fields}
+        return type(value).model_construct(_fields_set=value.model_fields_set, **fields)
+    if isinstance(value, dict):
+        previous = previous if isinstance(previous, dict) else {}
+        return {key: shared_copy(item, previous.get(key)) for key, item in value.items()}
+    if isinstance(value, list):
+        previous = previous if isinstance(previous, list) else []
+        return [shared_copy(item, previous[i] if i < len(previous) else None) for i, item in enumerate(value)]
+    return value
@@ -7,6 +7,9 @@ from dotenv import load_dotenv
 import json
 from pathlib import Path
 import anyio
+import functools
+import journal
+import sys
 
 import uuid
 load_dotenv()
@@ -25,23 +28,30 @@ if __name__ == "__main__":
         boros_energy_deck = DeckList.model_validate_json(f.read())
     game_state = GameState.init_mirror(boros_energy_deck)
     agents = [NaiveAgent(generation_settings=generation_settings_1), NaiveAgent(generation_settings=generation_settings_2)]
-    game_masters = [GameMaster(game_id=str(uuid.uuid4()), game_state=game_state, agents=agents, generation_settings=generation_settings_1) for _ in range(n_runs)]
+    game_masters = [GameMaster(game_id=str(uuid.uuid4()), game_state=game_state, agents=agents, generation_settings=generation_settings_1, metadata={"source": "eval_agents"}) for _ in range(n_runs)]
+    games = [game_master.game_loop for game_master in game_masters]
+    if "--resume" in sys.argv:
+        # continue eval games interrupted by a crash instead of starting new ones
+        # games another eval_agents is still playing are left to it
+        resumed_game_ids = [game_id for game_id in journal.ongoing_game_ids() if journal.read_start_record(game_id)["game_master"]["metadata"].get("source") == "eval_agents" and not journal.is_locked(game_id)]
+        games = [functools.partial(GameMaster.resume, game_id) for game_id in resumed_game_ids]
+        print(f"Resuming {len(games)} games")
     
     async def run_games():
         results = []
         async with anyio.create_task_group() as task_group:
-            async def collect_result(game_master):
-                result = await game_master.game_loop()
+            async def collect_result(play_game):
+                result = await play_game()
                 results.append(result)
             
-            for game_master in game_masters:
-                task_group.start_soon(collect_result, game_master)
+            for play_game in games:
+                task_group.start_soon(collect_result, play_game)
         return results
         
     winners = anyio.run(run_games)
     print(f"Winners: {winners}")
     
-    finished_games = Path("database/finished_games").glob("*.json")
+    finished_games = journal.finished_games_dir.glob("*.json")
     wins_by_model = defaultdict(int)
     wins_by_player_index = defaultdict(int)
     
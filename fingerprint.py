@@ -0,0 +1,99 @@
+"""Canonical fingerprints of game states, stable across processes. States that are equal in game terms get the same
+fingerprint regardless of dict insertion order or the order of hand, graveyard, exile, effects and lasting effects.
+Unordered collections are combined by adding their items' digests modulo 2**128, so their order doesn't matter."""
+import hashlib
+import game_state
+
+digest_modulus = 2**128
+
+# fields each model's fingerprint covers. Checked at import so a new field can't be silently left out of fingerprints
+fingerprinted_fields = {
+    game_state.GameState: {"player_decklists", "player_boards", "stack", "next_battlefield_id", "active_player_index", "turn_step", "turn_number", "starting_player_index", "random_state", "lasting_effects"},
+    game_state.PlayerBoard: {"library", "hand", "graveyard", "exile", "life", "counters", "battlefield"},
+    game_state.BattlefieldCard: {"battlefield_id", "card", "owner", "counters", "tapped", "effects", "attached_to", "marked_damage", "entered_battlefield_this_turn", "judge_private_notes", "judge_public_notes"},
+    game_state.DeckList: {"mainboard", "sideboard"},
+}
+for model, fields in fingerprinted_fields.items():
+    assert set(model.model_fields) == fields, f"Update fingerprint.py for the fields of {model.__name__}"
+
+def digest_bytes(text: str) -> bytes:
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+def digest(text: str) -> int:
+    return int.from_bytes(digest_bytes(text), "little")
+
+def unordered_digest(texts) -> int:
+    "Digest of a multiset of strings."
+    return sum(digest(text) for text in texts) % digest_modulus
+
+# digests of card names by card registry id. Ids differ between processes but the names, and so the digests, don't
+card_name_digests: list[bytes] = []
+card_name_int_digests: list[int] = []
+
+def _card_digest_tables() -> tuple[list[bytes], list[int]]:
+    names = game_state.card_registry.names
+    for name in names[len(card_name_digests):]:
+        card_name_digests.append(digest_bytes(name))
+        card_name_int_digests.append(int.from_bytes(card_name_digests[-1], "little"))
+    return card_name_digests, card_name_int_digests
+
+def zone_digest(zone: game_state.CardZone, ordered: bool) -> int:
+    if not isinstance(zone, game_state.CardZone):
+        zone = game_state.CardZone(zone)
+    # ids first, building them can register names the digest tables don't have yet
+    ids = zone.ids
+    byte_digests, int_digests = _card_digest_tables()
+    if ordered:
+        return int.from_bytes(hashlib.blake2b(b"".join(map(byte_digests.__getitem__, ids)), digest_size=16).digest(), "little")
+    return sum(map(int_digests.__getitem__, ids)) % digest_modulus
+
+def permanent_digest(battlefield_card: game_state.BattlefieldCard, ignore_judge_notes: bool = False) -> int:
+    fields = (
+        battlefield_card.battlefield_id,
+        battlefield_card.card,
+        battlefield_card.owner,
+        sorted(battlefield_card.counters.items()) if battlefield_card.counters else (),
+        battlefield_card.tapped,
+        sorted(battlefield_card.effects) if battlefield_card.effects else (),
+        battlefield_card.attached_to,
+        battlefield_card.marked_damage,
+        battlefield_card.entered_battlefield_this_turn,
+    )
+    if not ignore_judge_notes:
+        fields += (battlefield_card.judge_private_notes, battlefield_card.judge_public_notes)
+    return digest(repr(fields))
+
+def battlefield_digest(battlefield, ignore_judge_notes: bool = False) -> int:
+    return sum(permanent_digest(battlefield_card, ignore_judge_notes) for battlefield_card in battlefield.values()) % digest_modulus
+
+def board_digest(board: game_state.PlayerBoard, ignore_judge_notes: bool = False) -> int:
+    fields = (
+        board.life,
+        sorted(board.counters.items()),
+        # library order is part of the game, the other zones are compared as multisets
+        zone_digest(board.library, ordered=True),
+        zone_digest(board.hand, ordered=False),
+        zone_digest(board.graveyard, ordered=False),
+        zone_digest(board.exile, ordered=False),
+        battlefield_digest(board.battlefield, ignore_judge_notes),
+    )
+    return digest(repr(fields))
+
+def state_fingerprint(state: game_state.GameState, ignore_judge_notes: bool = False, ignore_random_state: bool = False) -> str:
+    """Hex fingerprint of `state`. Pass ignore_random_state to group states that only differ in the RNG draw, eg when
+    voting between judge samples. ignore_judge_notes also groups states that only differ in the judge's free text notes,
+    which can hold game information, so only use it where that doesn't matter."""
+    fields = (
+        [(sorted(decklist.mainboard.items()), sorted(decklist.sideboard.items())) for decklist in state.player_decklists],
+        [board_digest(board, ignore_judge_notes) for board in state.player_boards],
+        state.stack,
+        state.next_battlefield_id,
+        state.active_player_index,
+        # judge code can assign a plain string
+        getattr(state.turn_step, "value", state.turn_step),
+        state.turn_number,
+        state.starting_player_index,
+        None if ignore_random_state else state.random_state,
+        sorted(state.lasting_effects),
+    )
+    return f"{digest(repr(fields)):032x}"
@@ -0,0 +1,134 @@
+import game_state
+import sandbox
+import fingerprint
+import ast
+import builtins
+import hashlib
+import re
+from collections import OrderedDict
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import ClassVar, Optional
+
+# judge code that uses any of these may not give the same result when replayed
+nondeterministic_code_pattern = re.compile(r"\b(random|import|__import__|time|datetime|uuid|os|open|input)\b")
+
+class HistoryReplayError(Exception):
+    pass
+
+def state_fingerprint(state: game_state.GameState) -> str:
+    return fingerprint.state_fingerprint(state)
+
+def matches_fingerprint(state: game_state.GameState, recorded: str) -> bool:
+    # histories recorded before canonical fingerprints hold sha256 hashes of the state json
+    if len(recorded) == 64:
+        return hashlib.sha256(state.model_dump_json().encode()).hexdigest() == recorded
+    return state_fingerprint(state) == recorded
+
+def free_names(code: str) -> set[str]:
+    "Names `code` reads or deletes without binding them anywhere in itself."
+    tree = ast.parse(code)
+    # `x += 1` reads x before storing it
+    augmented = {node.target for node in ast.walk(tree) if isinstance(node, ast.AugAssign) and isinstance(node.target, ast.Name)}
+    read, bound = set(), set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            (bound if isinstance(node.ctx, ast.Store) and node not in augmented else read).add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, ast.alias):
+            bound.add((node.asname or node.name).split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+    return read - bound
+
+def is_replayable(code: str) -> bool:
+    "Whether running `code` again on the same state gives the same state: it's deterministic and doesn't read variables kept by earlier code."
+    if nondeterministic_code_pattern.search(code):
+        return False
+    try:
+        names = free_names(code)
+    except SyntaxError:
+        return False
+    return names <= set(sandbox.judge_globals()) | set(dir(builtins)) | {"game_state"}
+
+class GameHistory(BaseModel):
+    """Game states from before each step. Only every `keyframe_interval`th state is stored in full. Other states are
+    rebuilt on demand by replaying the judge code recorded in GameMaster.used_python_code from the nearest keyframe, in the
+    code sandbox like any other judge code. Use `get` and `get_range` to read states. Returned states are shared, never modify them."""
+    keyframe_interval: int = Field(default=8)
+    keyframes: dict[int, game_state.GameState] = Field(default_factory=dict)
+    code_indices: list[int] = Field(default_factory=list, description="len(used_python_code) when each state was recorded")
+    fingerprints: list[str] = Field(default_factory=list)
+
+    cache_size: ClassVar[int] = 8
+    _codes: list[str] = PrivateAttr(default_factory=list)
+    _cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+
+    def bind_code(self, codes: list[str]):
+        "Use `codes` (the game's used_python_code, which is only ever appended to) for replay."
+        self._codes = codes
+
+    def copy_for(self, codes: list[str]) -> "GameHistory":
+        "Copy that can be appended to without changing this history, replaying with `codes`. Stored states are shared."
+        history = GameHistory(keyframe_interval=self.keyframe_interval, keyframes=dict(self.keyframes), code_indices=list(self.code_indices), fingerprints=list(self.fingerprints))
+        history.bind_code(codes)
+        history._cache = OrderedDict(self._cache)
+        return history
+
+    def append(self, state: game_state.GameState, code_index: int, replayable: bool = True):
+        """Record `state`, the state after running the first `code_index` entries of used_python_code.
+        States after code that isn't replayable are kept in full, replayable=False does the same whatever the code."""
+        index = len(self.code_indices)
+        previous = self._cache.get(index - 1) or self.keyframes.get(index - 1)
+        snapshot = state.snapshot(previous)
+        step_codes = self._codes[self.code_indices[-1]:code_index] if self.code_indices else []
+        if index % self.keyframe_interval == 0 or not replayable or not all(is_replayable(code) for code in step_codes):
+            self.keyframes[index] = snapshot
+        self.code_indices.append(code_index)
+        self.fingerprints.append(state_fingerprint(state))
+        self._remember(index, snapshot)
+
+    def _remember(self, index: int, state: game_state.GameState):
+        self._cache[index] = state
+        self._cache.move_to_end(index)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def get(self, index: int) -> game_state.GameState:
+        "The state recorded at `index`, negative indices count from the end. States that aren't stored are replayed in the code sandbox."
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index]
+        if index in self.keyframes:
+            return self.keyframes[index]
+        # start from the closest earlier state we already have
+        start = max([i for i in self.keyframes if i < index] + [i for i in self._cache if i < index])
+        base = self._cache[start] if start in self._cache else self.keyframes[start]
+        state = base
+        for step in range(start + 1, index + 1):
+            for code in self._codes[self.code_indices[step - 1]:self.code_indices[step]]:
+                success, output, new_state, _ = await sandbox.default_sandbox.run(code, state, {})
+                if not success:
+                    raise HistoryReplayError(f"Replaying step {step} failed:\n{output}")
+                state = new_state
+            if not matches_fingerprint(state, self.fingerprints[step]):
+                raise HistoryReplayError(f"Replaying step {step} did not reproduce the recorded state")
+        snapshot = state.snapshot(base)
+        self._remember(index, snapshot)
+        return snapshot
+
+    async def get_range(self, start: int, stop: Optional[int] = None) -> list[game_state.GameState]:
+        "States from `start` up to `stop` like a slice, eg get_range(-5) for the last five."
+        return [await self.get(index) for index in range(*slice(start, stop).indices(len(self)))]
+
+    def __len__(self) -> int:
+        return len(self.code_indices)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
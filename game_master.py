@@ -1,15 +1,23 @@
 import game_state
+import card_zones
+import game_history
 import prompts
 import prompting
-from pydantic import BaseModel, Field
-from typing import Optional, Callable, Any
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Optional, Callable, Awaitable, Any
 import json
-import io
-from contextlib import redirect_stdout
-from copy import deepcopy
-import traceback
+import importlib
+import inspect
+from pathlib import Path
 import log
+import journal
+import sandbox
+import llm_backends
+import local_rules
+import metrics
+import fingerprint
 import trio
+import anyio
 import uuid
 
 class HistoryStep(BaseModel):
@@ -26,27 +34,236 @@ class AgentInterface(BaseModel):
         }
     }
     
-    async def take_action(self, history:list["HistoryStep"], visible_information: str, available_actions:str, rules_violation_feedback:Optional[str]=None) -> str:
+    async def take_action(self, history:list["HistoryStep"], visible_information: str, available_actions:str, rules_violation_feedback:Optional[str]=None, on_text:Optional[Callable[[str], Awaitable[None]]]=None) -> str:
         pass
         return ""
         
+class JudgeCandidate(BaseModel):
+    "One sampled judge tool call, along with the result of evaluating it. `vote` is None if the candidate failed and can't be counted."
+    choice: dict
+    vote: Optional[str] = None
+    output: str = ""
+    state: Optional[game_state.GameState] = None
+    variables: dict[str, Any] = Field(default_factory=dict)
+
+class CascadeStats(BaseModel):
+    "How often a judge phase had to escalate from the cascade model, and what it cost."
+    calls: int = 0
+    escalations: int = 0
+    cascade_cost: float = 0.0
+    escalated_cost: float = 0.0
+    
+    def summary(self) -> str:
+        text = f"escalated {self.escalations}/{self.calls} ({self.escalations / max(self.calls, 1):.0%}), cascade model cost ${self.cascade_cost:.3f}"
+        if self.escalations:
+            # calls that didn't escalate would have cost about as much as the ones that did
+            saved = (self.calls - self.escalations) * self.escalated_cost / self.escalations - self.cascade_cost
+            text += f", estimated savings ${saved:.3f}"
+        return text
+
+def escalation_reason(candidates: list[JudgeCandidate]) -> Optional[str]:
+    "Why judge candidates from the cascade model can't be trusted, or None if they can."
+    if not candidates:
+        return "no candidates"
+    if any(candidate.vote is None for candidate in candidates):
+        return "candidate code raised an error"
+    votes = {candidate.vote for candidate in candidates}
+    if "invalid" in votes and len(votes) > 1:
+        return "validity votes split"
+    if len(votes) > 1:
+        return "resulting states disagree"
+    return None
+
+def state_vote_key(state: game_state.GameState) -> str:
+    """Judge samples that only differ in how they drew from the RNG vote for the same state. Judge notes are kept,
+    they can hold game information, eg what a face down card is."""
+    return fingerprint.state_fingerprint(state, ignore_random_state=True)
+
+def vote_key(obj: Any) -> Any:
+    "Game states vote by fingerprint, anything else by itself."
+    return state_vote_key(obj) if isinstance(obj, game_state.GameState) else obj
+
 def game_state_consistency(game_states: list[game_state.GameState]) -> tuple[Any, int]:
-    jsons = [state.model_dump_json() for state in game_states]
-    state_counts = {}
-    for state_json in jsons:
-        state_counts[state_json] = state_counts.get(state_json, 0) + 1
-    max_value = max(state_counts.items(), key=lambda x: x[1])[0]
-    return game_states[jsons.index(max_value)], jsons.index(max_value)
+    return consistency(game_states)
     
-def consistency(objects: list)->tuple[Any, int]:
+def accepts_keyword(function: Callable, name: str) -> bool:
+    parameters = inspect.signature(function).parameters.values()
+    return any(parameter.kind == parameter.VAR_KEYWORD or (parameter.name == name and parameter.kind != parameter.POSITIONAL_ONLY) for parameter in parameters)
+
+def consistency(objects: list, key: Callable[[Any], Any] = vote_key)->tuple[Any, int]:
+    "The most common of `objects` by `key` and its index. Ties go to the one that appears first."
+    keys = [key(obj) for obj in objects]
     counts = {}
-    for obj in objects:
-        counts[obj] = counts.get(obj, 0) + 1
-    max_value =  max(counts.items(), key=lambda x: x[1])[0]
-    return max_value, objects.index(max_value)
+    for obj_key in keys:
+        counts[obj_key] = counts.get(obj_key, 0) + 1
+    max_key = max(counts.items(), key=lambda x: x[1])[0]
+    index = keys.index(max_key)
+    return objects[index], index
     
-python_tool_description = """Python code to execute to update game state. This code will execute in a context with variable `game_state` defined and game_state.py imported. This code should modify game_state in place. Before and after code is executed, game state is backed up. If code raises an exception, game state will be restored to its previous state. This code will only be executed once on the exact game state you can see, so you only need to check conditions in complex situations or when you need to read information that's hidden by default like players' libraries. You will see the printed output of this code, which you can use to eg look at cards in players' libraries."""
+# list fields of GameMaster that only ever grow, journaled as the newly added items each step
+journal_appended_fields = ("used_python_code", "error_messages", "global_action_history")
+# fields of GameMaster journaled in full each step
+journal_step_fields = {"game_state", "priority_player", "player_action", "invalid_action_feedback", "winner", "priority_player_revealed_information", "priority_player_available_actions", "code_local_vars", "wasted_speculation_cost"}
+# fields game_master_step changes, copied from a speculative fork when its speculation is used
+speculated_fields = ("game_state", "invalid_action_feedback", "winner", "priority_player", "priority_player_available_actions", "priority_player_revealed_information")
+
+python_tool_description = """Python code to execute to update game state. This code will execute in a context with variable `game_state` defined and game_state.py imported. This code should modify game_state in place. Before and after code is executed, game state is backed up. If code raises an exception, game state will be restored to its previous state. This code will only be executed once on the exact game state you can see, so you only need to check conditions in complex situations or when you need to read information that's hidden by default like players' libraries. You will see the printed output of this code, which you can use to eg look at cards in players' libraries. Variables your code defines are discarded once it has run. Declare a variable `global` to keep it for code you run later."""
+
+
+execute_action_tool = {
+    "name": "execute_action",
+    "description": "Advance the game state according to the rules of Magic: The Gathering. First validate that the last player action was legal. If it was, execute the action and update the game state. If it was not, return an explanation of why it was illegal.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "reasoning": {
+                "type": "string",
+                "description": "Reasoning about whether the last player action was valid according to game rules. Think about whether the action was legal, whether it was played correctly, whether the player had enough mana to pay for the action, etc."
+            },
+            "is_action_valid": {
+                "type": "boolean",
+                "description": "Whether the last player action was valid according to game rules"
+            },
+            "invalid_action_feedback": {
+                "type": "string", 
+                "description": "If action was invalid, explanation of why"
+            },
+            "python_code": {
+                "type": "string",
+                "description": python_tool_description
+            },
+        },
+        "required": ["reasoning", "is_action_valid", "python_code"]
+    }
+}
+
+advance_state_tool = {
+    "name": "advance_game_state",
+    "description": "Advance the game state according to the rules of Magic: The Gathering to the next time a player will get priority and be able to take an action.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "reasoning": {
+                "type": "string",
+                "description": "Reasoning about when any player will next be able to take an action and what needs to be executed to advance the game state to that point."
+            },
+            "priority_player": {
+                "type": "integer",
+                "description": "Index of player who currently has priority"
+            },
+            "python_code": {
+                "type": "string",
+                "description": "Python code to execute to update game state. This code will execute in a context with `game_state` defined. This code should modify game_state in place. Before and after code is executed, game state is backed up. If code raises an exception, game state will be restored to its previous state. You will see the printed output of this code, which you can use to eg look at cards in players' libraries. Variables your code defines are discarded once it has run. Declare a variable `global` to keep it for code you run later."
+            },
+        },
+        "required": ["reasoning", "priority_player", "python_code"]
+    }
+}
+
+analyze_state_tool = {
+    "name": "extract_state_info",
+    "description": "Extract key information about the current game state",
+    "input_schema": {
+        "type": "object", 
+        "properties": {
+            "reasoning": {
+                "type": "string",
+                "description": "Reasoning about the current game state. Think about who can legally take and pay for which actions, whether any win conditions are met, etc."
+            },
+            "priority_player": {
+                "type": "integer",
+                "description": "Index of player who currently has priority"
+            },
+            "priority_player_revealed_information": {
+                "type": "string",
+                "description": "Special available information revealed to priority player. For example, revealed cards from scrying or cards revealed during spell or ability resolution."
+            },
+            "priority_player_available_mana": {
+                "type": "string",
+                "description": "Mana available to priority player, including generic and colored mana."
+            },
+            "priority_player_available_actions": {
+                "type": "string",
+                "description": "List of legal actions available to priority player. Only include actions that the priority player can pay for."
+            },
+            "winner": {
+                "type": ["integer", "null"],
+                "description": "Index of winning player if game is over. None if game ongoing."
+            }
+        },
+        "required": ["reasoning", "priority_player", "priority_player_revealed_information", "priority_player_available_mana", "priority_player_available_actions", "winner"]
+    }
+}
+
+judge_system_prompt = f"""You are an expert Magic: The Gathering judge. Your job is to enforce the rules of a Magic: The Gathering game played by two players who interact through natural language text. You track the state of the game using a Python API.
+
+Game Phase reminder:
+{prompts.game_phase_guide}
+
+Here are the python classes that hold the game state:
+{Path(game_state.__file__).read_text()}
+
+CardZone is used like a list of card names and Battlefield like a dict of BattlefieldCard by battlefield id. Card types to use with the methods above:
+{inspect.getsource(card_zones.CardType)}"""
+judge_system = [{"type": "text", "text": judge_system_prompt, "cache_control": {"type": "ephemeral"}}]
+
+advance_and_analyze_tool = {
+    "name": "advance_and_analyze",
+    "description": "Advance the game state according to the rules of Magic: The Gathering to the next time a player will get priority and be able to take an action, and report the state of the game at that point. All reported information must describe the game as it will be after your python code has run.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            **advance_state_tool["input_schema"]["properties"],
+            **{name: schema for name, schema in analyze_state_tool["input_schema"]["properties"].items() if name not in ("reasoning", "priority_player")},
+        },
+        "required": ["reasoning", "priority_player", "python_code", "priority_player_revealed_information", "priority_player_available_mana", "priority_player_available_actions", "winner"]
+    }
+}
+
+analysis_required_fields = ["reasoning", "priority_player", "priority_player_revealed_information", "priority_player_available_mana", "priority_player_available_actions", "winner"]
+
+# every judge call sends all judge tools with the same tool_choice, because changing tool_choice invalidates the cached
+# prefix. The system prompt, tools and transcript form one cacheable prefix shared by all phases, and the last user
+# message names the tool to call
+judge_tools = [execute_action_tool, advance_state_tool, analyze_state_tool, advance_and_analyze_tool]
+judge_tool_settings = {"tools": judge_tools, "tool_choice": {"type": "any"}}
 
+def judge_request(text: str, tool_name: str) -> dict:
+    return {"role": "user", "content": f"{text}\n{llm_backends.tool_request(tool_name)}"}
+
+def tool_inputs(response: dict, tool_name: str) -> list[dict]:
+    "Inputs of the response's calls to `tool_name`. Calls to other judge tools are ignored."
+    return [block['input'] for block in response['content'] if block['type'] == 'tool_use' and block.get('name') == tool_name]
+
+def analysis_matches_state(analysis: dict, state: game_state.GameState) -> bool:
+    "Sanity check an analysis written before its code ran against the state the code actually produced."
+    n_players = len(state.player_boards)
+    if not 0 <= analysis.get("priority_player", -1) < n_players:
+        return False
+    if not analysis.get("priority_player_available_actions"):
+        return False
+    losing_players = [i for i, board in enumerate(state.player_boards) if board.life <= 0 or board.counters.get("poison", 0) >= 10]
+    winner = analysis.get("winner")
+    if winner is None:
+        return not losing_players
+    return 0 <= winner < n_players and winner not in losing_players and bool(losing_players or any(not board.library for board in state.player_boards))
+
+
+def step_key(state: game_state.GameState) -> tuple:
+    "Identifies the current step of the current turn."
+    return state.turn_number, state.active_player_index, state.turn_step
+
+def json_safe_vars(local_vars: dict[str, Any]) -> dict[str, Any]:
+    "Judge variables that can be saved as json. The others are left out of saved games, with a warning, so one odd variable can't stop a game from being saved."
+    result = {}
+    for name, value in local_vars.items():
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            print(f"Not saving judge variable {name} of type {type(value).__name__}, it can't be stored as json")
+            continue
+        result[name] = value
+    return result
 
 class GameMaster(BaseModel):
     model_config = {
@@ -58,7 +275,7 @@ class GameMaster(BaseModel):
     game_state: game_state.GameState
     agents: list["AgentInterface"] = Field(default_factory=list)
     generation_settings: dict
-    past_game_states: list[game_state.GameState] = Field(default_factory=list)
+    past_game_states: game_history.GameHistory = Field(default_factory=game_history.GameHistory)
     player_observation_histories: list[list[HistoryStep]] = Field(default_factory=list)
     
     priority_player: int = Field(default=0)
@@ -71,37 +288,241 @@ class GameMaster(BaseModel):
     used_python_code: list[str] = Field(default_factory=list)
     error_messages: list[str] = Field(default_factory=list)
     global_action_history: list[dict[str, int | str]] = Field(default_factory=list)
-    code_local_vars: dict[str, Any] = Field(default_factory=dict)
+    code_local_vars: dict[str, Any] = Field(default_factory=dict, description="Variables judge code declared global, which later judge code can read.")
     
     metadata: dict = Field(default_factory=dict)
+    consistency_n: int = Field(default=1, description="Number of judge samples to draw concurrently per judge call. The resulting states are majority voted.")
+    judge_context_token_budget: Optional[int] = Field(default=30_000, description="Approximate token budget for actions and code history in judge prompts. Older history is dropped past this. None keeps everything.")
+    compaction_chunk_tokens: int = Field(default=5_000)
+    combined_advance_analysis: bool = Field(default=False, description="Advance the game and analyze the resulting state in one judge call, falling back to a separate analysis call if they disagree.")
+    local_rules_fast_path: bool = Field(default=True, description="Resolve simple actions like passing with nothing on the stack or playing a basic land, and list available actions on simple boards, with local_rules instead of the LLM judge.")
+    speculation: bool = Field(default=False, description="While a player who is likely to pass decides on their action, run the judge for 'Pass' at the same time and use the result if they do pass.")
+    speculation_budget: float = Field(default=0.5, description="Dollars per game that may be spent on speculation that gets thrown away. Speculation stops once this is used up.")
+    wasted_speculation_cost: float = Field(default=0.0)
+    verbose: bool = Field(default=False, description="Print the whole board and the priority player's action after every step. Either way they're recorded on the step's trace span.")
+    llm_priority: str = Field(default="eval", description="Scheduler priority class of this game's LLM calls, see scheduler.priority_classes.")
+    cascade_generation_settings: Optional[dict] = Field(default=None, description="Overrides of generation_settings, eg a cheaper model, that judge calls try first. A call escalates to generation_settings when the cascade model's candidates raise errors or disagree.")
+    cascade_consistency_n: int = Field(default=3, description="Samples drawn from the cascade model, so disagreement can be detected.")
+    cascade_stats: dict[str, CascadeStats] = Field(default_factory=dict)
     n_retries: int = Field(default=5)
     max_turns: int = Field(default=15)
     max_errors: int = Field(default=10)
     max_steps: int = Field(default=40)
     
+    _journal: Optional[journal.GameJournal] = PrivateAttr(default=None)
+    _journaled_lengths: dict[str, int] = PrivateAttr(default_factory=dict)
+    _awaiting_player_action: bool = PrivateAttr(default=False)
+    _speculation: Optional["GameMaster"] = PrivateAttr(default=None)
+    _event_handler: Optional[Callable[[dict], Awaitable[None]]] = PrivateAttr(default=None)
+    # step_key of the state the last valid action was taken in, () before the first action. None if unknown, eg after resuming
+    _last_action_step: Optional[tuple] = PrivateAttr(default=None)
+    _is_fork: bool = PrivateAttr(default=False)
+    
     def model_post_init(self, *args, **kwargs):
-        self.player_observation_histories = [[] for _ in self.agents]
+        if not self.player_observation_histories:
+            self.player_observation_histories = [[] for _ in self.agents]
+        self.past_game_states.bind_code(self.used_python_code)
+        prompting.prewarm_card_text(self.game_state.player_decklists)
         
-    def truncated_json(self, **kwargs) -> str:
-        game_master_copy = deepcopy(self)
-        game_master_copy.past_game_states = game_master_copy.past_game_states[-5:]
-        for history in game_master_copy.player_observation_histories:
-            history[:] = history[-5:]
-        return game_master_copy.model_dump_json(**kwargs)
+    async def truncated_json(self, **kwargs) -> str:
+        data = self.model_dump(mode="json", exclude={"past_game_states", "player_observation_histories"})
+        data["past_game_states"] = [state.model_dump(mode="json") for state in await self.past_game_states.get_range(-5)]
+        data["player_observation_histories"] = [[step.model_dump(mode="json") for step in history[-5:]] for history in self.player_observation_histories]
+        return json.dumps(data, **kwargs)
         
     async def step(self):
-        self.past_game_states.append(deepcopy(self.game_state))
-        await self.game_master_step(self.player_action)
+        with metrics.span("step", game_id=self.game_id, step=len(self.global_action_history)) as step_span:
+            log.current_game_id.set(self.game_id)
+            log.current_priority.set(self.llm_priority)
+            self.get_journal()
+            if self._awaiting_player_action:
+                await self.take_player_action()
+            code_index = len(self.used_python_code)
+            self.past_game_states.append(self.game_state, code_index)
+            if self._speculation is not None:
+                self.commit_speculation(self._speculation)
+            else:
+                await self.game_master_step(self.player_action)
+            try:
+                self.journal_step(code_index)
+                if self._journal.sync_due:
+                    # fsync waits for the disk, so it runs off the event loop
+                    await anyio.to_thread.run_sync(self._journal.sync)
+            except Exception as e:
+                print(f"Failed to save step {len(self.past_game_states) - 1} of game {self.game_id}: {e!r}")
+            if self.winner is None:
+                await self.take_player_action_speculatively()
+                step_span.attributes.update(priority_player=self.priority_player, action=self.player_action)
+                if self.verbose:
+                    print(prompting.format_omniscient_view(self.game_state))
+                    print(f"Player {self.priority_player} action: {self.player_action}")
+        if self.winner is not None:
+            # once the step's span has closed, so the saved trace includes it
+            self.finish()
+            return self.winner
+        
+    async def take_player_action(self):
+        self.player_action = await self.get_player_action(self.priority_player, self.priority_player_available_actions, self.priority_player_revealed_information,self.invalid_action_feedback)
+        self._awaiting_player_action = False
         try:
-            log.save_game(self.game_id, self)
+            self.journal_action(self.priority_player)
         except Exception:
-            print("Failed to save game")
+            print("Failed to save player action")
+        
+    def set_event_handler(self, handler: Optional[Callable[[dict], Awaitable[None]]]):
+        "`handler` is called with progress events while a step runs: judge phases and agent text as it's generated."
+        self._event_handler = handler
+        
+    async def emit_event(self, event_type: str, **data):
+        if self._event_handler is None:
+            return
+        try:
+            await self._event_handler({"type": event_type, **data})
+        except Exception as e:
+            print(f"Event handler failed: {e}")
+        
+    def should_speculate(self) -> bool:
+        return (self.speculation and self.wasted_speculation_cost < self.speculation_budget
+                and local_rules.likely_to_pass(self.game_state, self.priority_player))
+        
+    def fork(self) -> "GameMaster":
+        "Copy that game_master_step can run on without changing this game. Forks never write the game's journal."
+        used_python_code = list(self.used_python_code)
+        fork = self.model_copy(update={
+            "used_python_code": used_python_code,
+            "past_game_states": self.past_game_states.copy_for(used_python_code),
+            "player_observation_histories": [list(history) for history in self.player_observation_histories],
+            "error_messages": list(self.error_messages),
+            "global_action_history": list(self.global_action_history),
+            "code_local_vars": dict(self.code_local_vars),
+        })
+        # speculative work isn't shown to viewers. cascade_stats stays shared, speculative judge calls count towards it too
+        fork._event_handler = None
+        fork._journal = None
+        fork._is_fork = True
+        return fork
+        
+    async def take_player_action_speculatively(self):
+        """Take the player's action while a fork of the game runs the judge for "Pass", if the player is likely to pass.
+        The fork is kept for the next step if they did pass, otherwise it's cancelled and what it spent counts against speculation_budget.
+        Calls the cancellation cuts off count with their estimated cost, see log.estimate_call_cost."""
+        if not self.should_speculate():
+            await self.take_player_action()
+            return
+        fork = self.fork()
+        meter = log.CostMeter()
+        speculation_succeeded = False
+        async def speculate():
+            nonlocal speculation_succeeded
+            log.current_cost_meter.set(meter)
+            try:
+                await fork.game_master_step("Pass")
+                speculation_succeeded = True
+            except Exception as e:
+                print(f"Speculation failed: {e}")
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(speculate)
+            await self.take_player_action()
+            if not local_rules.is_pass_action(self.player_action):
+                task_group.cancel_scope.cancel()
+        if speculation_succeeded and local_rules.is_pass_action(self.player_action):
+            self._speculation = fork
+        else:
+            self.wasted_speculation_cost += meter.cost
+            
+    def commit_speculation(self, fork: "GameMaster"):
+        "Take over the result of running game_master_step on `fork`. Lists are extended in place because past_game_states holds on to used_python_code."
+        for name in ("used_python_code", "error_messages", "global_action_history"):
+            getattr(self, name).extend(getattr(fork, name)[len(getattr(self, name)):])
+        self.code_local_vars = fork.code_local_vars
+        for name in speculated_fields:
+            setattr(self, name, getattr(fork, name))
+        self._last_action_step = fork._last_action_step
+        # record how the player actually worded their pass
+        if self.global_action_history and self.global_action_history[-1]["action"] == "Pass":
+            self.global_action_history[-1] = {**self.global_action_history[-1], "action": self.player_action}
+        self._speculation = None
+        
+    def get_journal(self) -> journal.GameJournal:
+        assert not self._is_fork, "speculative forks must not write the game's journal"
+        if self._journal is None:
+            is_new = not journal.journal_path(self.game_id).exists()
+            self._journal = journal.GameJournal(self.game_id)
+            if is_new:
+                self._journal.append({
+                    "type": "start",
+                    "game_master": self.model_dump(mode="json", exclude={"agents", "past_game_states", "player_observation_histories"}),
+                    "agents": [{"module": type(agent).__module__, "class": type(agent).__name__, "config": agent.model_dump(mode="json")} for agent in self.agents],
+                })
+                self._journaled_lengths = {name: len(getattr(self, name)) for name in journal_appended_fields}
+        return self._journal
+        
+    def close_journal(self):
+        "Stop writing the journal of an unfinished game, releasing its lock so the game can be resumed, eg by another process."
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def journal_step(self, code_index: int):
+        game_journal = self.get_journal()
+        record = {
+            "type": "step",
+            "history": {"code_index": code_index},
+            "appended": {name: getattr(self, name)[self._journaled_lengths.get(name, 0):] for name in journal_appended_fields},
+            **self.model_dump(mode="json", include=journal_step_fields - {"code_local_vars"}),
+            "code_local_vars": json_safe_vars(self.code_local_vars),
+        }
+        game_journal.append(record)
+        self._journaled_lengths = {name: len(getattr(self, name)) for name in journal_appended_fields}
+        
+    def journal_action(self, player_index: int):
+        self.get_journal().append({
+            "type": "action",
+            "player_index": player_index,
+            "player_action": self.player_action,
+            "history_step": self.player_observation_histories[player_index][-1].model_dump(mode="json"),
+        })
+        
+    def finish(self):
+        game_data = self.model_dump(mode="json", exclude={"code_local_vars"})
+        game_data["code_local_vars"] = json_safe_vars(self.code_local_vars)
+        journal.finish(self.game_id, game_data, self._journal)
+        self._journal = None
+        metrics.write_chrome_trace(self.game_id)
+        
+    @classmethod
+    def from_journal(cls, game_id: str, agents: Optional[list["AgentInterface"]] = None) -> "GameMaster":
+        "Rebuild a game from its journal, as of the last complete record. Agents are recreated from the journal unless given."
+        records = journal.read_records(game_id)
+        start = records[0]
+        if agents is None:
+            agents = [getattr(importlib.import_module(agent["module"]), agent["class"]).model_validate(agent["config"]) for agent in start["agents"]]
+        self = cls.model_validate({**start["game_master"], "agents": agents})
+        for record in records[1:]:
+            if record["type"] == "step":
+                # journals written before replayability was decided from the code record it for each step
+                self.past_game_states.append(self.game_state, record["history"]["code_index"], replayable=record["history"].get("replayable", True))
+                for name, items in record["appended"].items():
+                    getattr(self, name).extend(items)
+                for name in journal_step_fields - {"game_state"}:
+                    setattr(self, name, record[name])
+                self.game_state = game_state.GameState.model_validate(record["game_state"])
+                self._awaiting_player_action = True
+            elif record["type"] == "action":
+                self.player_observation_histories[record["player_index"]].append(HistoryStep.model_validate(record["history_step"]))
+                self.player_action = record["player_action"]
+                self._awaiting_player_action = False
+        self._journaled_lengths = {name: len(getattr(self, name)) for name in journal_appended_fields}
+        return self
+        
+    @classmethod
+    async def resume(cls, game_id: str, agents: Optional[list["AgentInterface"]] = None):
+        "Rebuild a game from its journal after a crash and continue playing it."
+        self = cls.from_journal(game_id, agents)
         if self.winner is not None:
-            log.finish_game(self.game_id)
+            self.finish()
             return self.winner
-        self.player_action = await self.get_player_action(self.priority_player, self.priority_player_available_actions, self.priority_player_revealed_information,self.invalid_action_feedback)
-        print(prompting.format_omniscient_view(self.game_state))
-        print(f"Player {self.priority_player} action: {self.player_action}")
+        return await self.game_loop()
         
     async def game_loop(self):
         while self.winner is None:
@@ -115,244 +536,328 @@ class GameMaster(BaseModel):
             if len(self.global_action_history) > self.max_steps:
                 print(f"Game timed out after {len(self.global_action_history)} steps")
                 break
+        metrics.write_chrome_trace(self.game_id)
+        self.close_journal()
         return self.winner
             
     async def get_player_action(self, player_index: int, available_actions: str, revealed_information: str, invalid_action_feedback: Optional[str]=None):
         player_view = prompting.format_player_view(self.game_state, player_index, revealed_information)
-        player_action = await self.agents[player_index].take_action(self.player_observation_histories[player_index],player_view, available_actions, invalid_action_feedback)
+        await self.emit_event("agent_thinking", player_index=player_index)
+        async def on_text(text: str):
+            await self.emit_event("agent_text", player_index=player_index, text=text)
+        agent = self.agents[player_index]
+        # agents written before streaming don't take on_text
+        streaming = {"on_text": on_text} if accepts_keyword(agent.take_action, "on_text") else {}
+        with metrics.span("take_action", player_index=player_index):
+            player_action = await agent.take_action(self.player_observation_histories[player_index],player_view, available_actions, invalid_action_feedback, **streaming)
         self.player_observation_histories[player_index].append(HistoryStep(visible_information=player_view, action=player_action, available_actions=available_actions))
         return player_action
         
-    async def execute_action(self, action: str, consistency_n = 8):
+    @metrics.traced("execute_action")
+    async def execute_action(self, action: str, consistency_n: Optional[int] = None):
+        consistency_n = consistency_n or self.consistency_n
+        await self.emit_event("judge_phase", phase="validating_action", player_index=self.priority_player, action=action)
         execute_action_messages, system_content = self.get_base_messages()
-        execute_action_messages.append({"role":"user", "content":f"Player validate whether the action player {self.priority_player} wants to take is valid. If it is, advance the game state according to the action.\nAction: {action}"})
-        execute_action_tools = {
-            "tools": [{
-                "name": "advance_game_state",
-                "description": "Advance the game state according to the rules of Magic: The Gathering. First validate that the last player action was legal. If it was, execute the action and update the game state. If it was not, return an explanation of why it was illegal.",
-                "input_schema": {
-                    "type": "object",
-                    "properties": {
-                        "reasoning": {
-                            "type": "string",
-                            "description": "Reasoning about whether the last player action was valid according to game rules. Think about whether the action was legal, whether it was played correctly, whether the player had enough mana to pay for the action, etc."
-                        },
-                        "is_action_valid": {
-                            "type": "boolean",
-                            "description": "Whether the last player action was valid according to game rules"
-                        },
-                        "invalid_action_feedback": {
-                            "type": "string", 
-                            "description": "If action was invalid, explanation of why"
-                        },
-                        "python_code": {
-                            "type": "string",
-                            "description": python_tool_description
-                        },
-                    },
-                    "required": ["reasoning", "is_action_valid", "python_code"]
-                }
-            }],
-            "tool_choice": {"type": "tool", "name": "advance_game_state"}
-        }
-        for _ in range(self.n_retries):
-            response = await log.llm_generate(
-                messages=execute_action_messages,
-                system=system_content,
-                **self.generation_settings,
-                **execute_action_tools
-            )
-            choice_jsons = [tool_use['input'] for tool_use in response['content'] if tool_use['type'] == 'tool_use']
-            majority_valid = consistency([choice["is_action_valid"] for choice in choice_jsons])[0]
-            if not majority_valid:
-                return False, next(c["invalid_action_feedback"] for c in choice_jsons if c["invalid_action_feedback"])
-            valid_codes = [choice["python_code"] for choice in choice_jsons if choice["is_action_valid"]]
-            evaluation_results = [await self.execute_code_with_game_state(code, apply_changes=False) for code in valid_codes]
-            if not any([result[0] for result in evaluation_results]):
-                execute_action_messages.append({"role":"user", "content":f"The code to execute to advance the game state raised an exception. State was restored to before the action was executed. Please fix the code and try again.\nException: {evaluation_results[0][1]}"})
+        execute_action_messages.append(judge_request(f"Player validate whether the action player {self.priority_player} wants to take is valid. If it is, advance the game state according to the action.\nAction: {action}", "execute_action"))
+        state_json = self.game_state.model_dump_json()
+        async def evaluate(choice: dict) -> JudgeCandidate:
+            if not choice["is_action_valid"]:
+                return JudgeCandidate(choice=choice, vote="invalid")
+            success, output, new_state, variables = await self.execute_code_with_game_state(choice["python_code"], apply_changes=False, state_json=state_json)
+            if not success:
+                return JudgeCandidate(choice=choice, output=output)
+            return JudgeCandidate(choice=choice, vote=state_vote_key(new_state), output=output, state=new_state, variables=variables)
+
+        for attempt in range(self.n_retries):
+            if attempt:
+                metrics.add(retries=1)
+            candidates = await self.sample_judge_candidates_cascaded("execute_action", execute_action_messages, system_content, evaluate, consistency_n)
+            invalid_candidates = [c for c in candidates if not c.choice["is_action_valid"]]
+            if len(invalid_candidates) > len(candidates) - len(invalid_candidates):
+                return False, next((c.choice["invalid_action_feedback"] for c in invalid_candidates if c.choice.get("invalid_action_feedback")), "")
+            succeeded = [c for c in candidates if c.state is not None]
+            if not succeeded:
+                failed_output = next((c.output for c in candidates if c.choice["is_action_valid"]), "")
+                execute_action_messages.append(judge_request(f"The code to execute to advance the game state raised an exception. State was restored to before the action was executed. Please fix the code and try again.\nException: {failed_output}", "execute_action"))
                 continue
-            
-            valid_states = [x[2] for x in evaluation_results if x[0]]
-            valid_state_codes = [choice_jsons[i]["python_code"] for i, x in enumerate(evaluation_results) if x[0]]
-            chosen_state, chosen_index = game_state_consistency(valid_states)
+
+            chosen_state, chosen_index = game_state_consistency([c.state for c in succeeded])
             self.game_state = chosen_state
-            self.used_python_code.append(valid_state_codes[chosen_index])
+            self.code_local_vars = succeeded[chosen_index].variables
+            self.used_python_code.append(succeeded[chosen_index].choice["python_code"])
             return True, ""
                 
-    async def advance_game_to_next_priority(self, consistency_n = 8):
+    @metrics.traced("advance_game_to_next_priority")
+    async def advance_game_to_next_priority(self, consistency_n: Optional[int] = None, with_analysis: bool = False) -> Optional[dict]:
+        """Advance to the next time a player gets priority and return the chosen judge tool call.
+        With `with_analysis`, the same call also reports what analyze_state_at_priority would, saving a round trip."""
+        consistency_n = consistency_n or self.consistency_n
+        await self.emit_event("judge_phase", phase="advancing_to_priority")
         advance_game_state_messages, system_content = self.get_base_messages()
     
-        advance_state_tools = {
-            "tools": [{
-                "name": "advance_game_state",
-                "description": "Advance the game state according to the rules of Magic: The Gathering to the next time a player will get priority and be able to take an action.",
-                "input_schema": {
-                    "type": "object",
-                    "properties": {
-                        "reasoning": {
-                            "type": "string",
-                            "description": "Reasoning about when any player will next be able to take an action and what needs to be executed to advance the game state to that point."
-                        },
-                        "priority_player": {
-                            "type": "integer",
-                            "description": "Index of player who currently has priority"
-                        },
-                        "python_code": {
-                            "type": "string",
-                            "description": "Python code to execute to update game state. This code will execute in a context with `game_state` defined. This code should modify game_state in place. Before and after code is executed, game state is backed up. If code raises an exception, game state will be restored to its previous state. You will see the printed output of this code, which you can use to eg look at cards in players' libraries."
-                        },
-                    },
-                    "required": ["reasoning", "priority_player", "python_code"]
-                }
-            }],
-            "tool_choice": {"type": "tool", "name": "advance_game_state"}
-        }
-        
-        advance_game_state_messages.append({"role":"user", "content":"Please identify the next time an player will get priority and be able to take an action, and advance the game to that point. Advancing the game state involves setting the active_player and turn_step properties of game_state, as well as untapping permanents, drawing cards, clearing damage, resolving any triggered abilities that do not involve player choices, etc. Please skip over multiple steps if no players will have available actions, eg executing untap, upkeep, and draw steps and skipping to main phase if no player has instant speed actions available."})
-        for _ in range(self.n_retries):
-            response = await log.llm_generate(
-                messages=advance_game_state_messages,
-                system=system_content,
-                **self.generation_settings,
-                **advance_state_tools
-            )
-            
-            choice_jsons = [tool_use['input'] for tool_use in response['content'] if tool_use['type'] == 'tool_use']
-                
-            evaluation_results = [await self.execute_code_with_game_state(choice["python_code"], apply_changes=False) for choice in choice_jsons]
-            if not any([result[0] for result in evaluation_results]):
-                advance_game_state_messages.append({"role":"user", "content":f"The code to execute to advance the game state raised an exception. State was restored to before the action was executed. Please fix the code and try again.\nException: {evaluation_results[0][1]}"})
+        tool_name = "advance_and_analyze" if with_analysis else "advance_game_state"
+        advance_request = "Please identify the next time an player will get priority and be able to take an action, and advance the game to that point. Advancing the game state involves setting the active_player and turn_step properties of game_state, as well as untapping permanents, drawing cards, clearing damage, resolving any triggered abilities that do not involve player choices, etc. Please skip over multiple steps if no players will have available actions, eg executing untap, upkeep, and draw steps and skipping to main phase if no player has instant speed actions available."
+        if with_analysis:
+            advance_request += "\nThen describe the game at that point: who has priority, what actions are available to them, and whether anyone has won."
+        advance_game_state_messages.append(judge_request(advance_request, tool_name))
+        state_json = self.game_state.model_dump_json()
+        async def evaluate(choice: dict) -> JudgeCandidate:
+            success, output, new_state, variables = await self.execute_code_with_game_state(choice["python_code"], apply_changes=False, state_json=state_json)
+            if not success:
+                return JudgeCandidate(choice=choice, output=output)
+            return JudgeCandidate(choice=choice, vote=state_vote_key(new_state), output=output, state=new_state, variables=variables)
+
+        for attempt in range(self.n_retries):
+            if attempt:
+                metrics.add(retries=1)
+            candidates = await self.sample_judge_candidates_cascaded(tool_name, advance_game_state_messages, system_content, evaluate, consistency_n)
+            succeeded = [c for c in candidates if c.state is not None]
+            if not succeeded:
+                advance_game_state_messages.append(judge_request(f"The code to execute to advance the game state raised an exception. State was restored to before the action was executed. Please fix the code and try again.\nException: {candidates[0].output if candidates else ''}", tool_name))
                 continue
-            
-            valid_states = [x[2] for x in evaluation_results if x[0]]
-            valid_state_codes = [choice_jsons[i]["python_code"] for i, x in enumerate(evaluation_results) if x[0]]
-            chosen_state, chosen_index = game_state_consistency(valid_states)
+
+            chosen_state, chosen_index = game_state_consistency([c.state for c in succeeded])
             self.game_state = chosen_state
-            self.used_python_code.append(valid_state_codes[chosen_index])
-            self.priority_player = choice_jsons[chosen_index]["priority_player"]
-            return
+            self.code_local_vars = succeeded[chosen_index].variables
+            self.used_python_code.append(succeeded[chosen_index].choice["python_code"])
+            self.priority_player = succeeded[chosen_index].choice["priority_player"]
+            return succeeded[chosen_index].choice
+        
+    def cascade_settings(self) -> Optional[dict]:
+        if self.cascade_generation_settings is None:
+            return None
+        return {**self.generation_settings, **self.cascade_generation_settings}
         
+    async def metered(self, call: Callable[[], Awaitable[Any]]) -> tuple[Any, float]:
+        "Run `call` and return its result along with the cost of the LLM calls it made."
+        meter = log.CostMeter(parent=log.current_cost_meter.get())
+        token = log.current_cost_meter.set(meter)
+        try:
+            return await call(), meter.cost
+        finally:
+            log.current_cost_meter.reset(token)
+        
+    def record_cascade(self, phase: str, escalated: bool, cascade_cost: float, escalated_cost: float = 0.0):
+        stats = self.cascade_stats.setdefault(phase, CascadeStats())
+        stats.calls += 1
+        stats.escalations += escalated
+        stats.cascade_cost += cascade_cost
+        stats.escalated_cost += escalated_cost
+        if escalated:
+            print(f"Cascade {phase}: {stats.summary()}")
+        
+    async def sample_judge_candidates_cascaded(self, phase: str, messages: list[dict], system: list[dict], evaluate: Callable, consistency_n: int) -> list[JudgeCandidate]:
+        "sample_judge_candidates on the cascade model first if there is one, escalating to generation_settings if its candidates can't be trusted."
+        cascade_settings = self.cascade_settings()
+        if cascade_settings is None:
+            return await self.sample_judge_candidates(phase, messages, system, evaluate, consistency_n)
+        n_errors = len(self.error_messages)
+        candidates, cascade_cost = await self.metered(lambda: self.sample_judge_candidates(phase, messages, system, evaluate, self.cascade_consistency_n, cascade_settings))
+        reason = escalation_reason(candidates)
+        if reason is None:
+            self.record_cascade(phase, False, cascade_cost)
+            return candidates
+        # escalating handles the cascade model's failures, they don't count towards max_errors
+        del self.error_messages[n_errors:]
+        print(f"Escalating {phase} to {self.generation_settings.get('model')}: {reason}")
+        candidates, escalated_cost = await self.metered(lambda: self.sample_judge_candidates(phase, messages, system, evaluate, consistency_n))
+        self.record_cascade(phase, True, cascade_cost, escalated_cost)
+        return candidates
+        
+    async def sample_judge_candidates(self, tool_name: str, messages: list[dict], system: list[dict], evaluate: Callable, consistency_n: int, generation_settings: Optional[dict] = None) -> list[JudgeCandidate]:
+        """Request `consistency_n` judge samples at once and evaluate each one's call to `tool_name` as soon as it arrives.
+        Remaining samples are cancelled as soon as one vote has a strict majority of `consistency_n`."""
+        generation_settings = generation_settings or self.generation_settings
+        candidates: list[JudgeCandidate] = []
+        vote_counts: dict[str, int] = {}
+        async with anyio.create_task_group() as task_group:
+            async def sample(sample_index: int):
+                response = await log.llm_generate(
+                    messages=messages,
+                    system=system,
+                    sample_index=sample_index,
+                    **generation_settings,
+                    **judge_tool_settings
+                )
+                for choice in tool_inputs(response, tool_name):
+                    candidate = await evaluate(choice)
+                    candidates.append(candidate)
+                    if candidate.vote is None:
+                        continue
+                    vote_counts[candidate.vote] = vote_counts.get(candidate.vote, 0) + 1
+                    if vote_counts[candidate.vote] > consistency_n // 2:
+                        task_group.cancel_scope.cancel()
+                        return
+
+            for sample_index in range(consistency_n):
+                task_group.start_soon(sample, sample_index)
+        return candidates
+        
+    @metrics.traced("analyze_state_at_priority")
     async def analyze_state_at_priority(self):
+        if self.local_rules_fast_path:
+            local_analysis = local_rules.analyze_state(self.game_state, self.priority_player, self.at_step_start())
+            if local_analysis is not None:
+                return local_analysis
+        await self.emit_event("judge_phase", phase="analyzing_state")
         analyze_state_messages, system_content = self.get_base_messages()
-        analyze_state_messages.append({"role":"user", "content":"Please analyze the current game state and describe what actions are available to the player who currently has priority."})
-
-        analyze_state_tools = {
-            "tools": [{
-                "name": "extract_state_info",
-                "description": "Extract key information about the current game state",
-                "input_schema": {
-                    "type": "object", 
-                    "properties": {
-                        "reasoning": {
-                            "type": "string",
-                            "description": "Reasoning about the current game state. Think about who can legally take and pay for which actions, whether any win conditions are met, etc."
-                        },
-                        "priority_player": {
-                            "type": "integer",
-                            "description": "Index of player who currently has priority"
-                        },
-                        "priority_player_revealed_information": {
-                            "type": "string",
-                            "description": "Special available information revealed to priority player. For example, revealed cards from scrying or cards revealed during spell or ability resolution."
-                        },
-                        "priority_player_available_mana": {
-                            "type": "string",
-                            "description": "Mana available to priority player, including generic and colored mana."
-                        },
-                        "priority_player_available_actions": {
-                            "type": "string",
-                            "description": "List of legal actions available to priority player. Only include actions that the priority player can pay for."
-                        },
-                        "winner": {
-                            "type": ["integer", "null"],
-                            "description": "Index of winning player if game is over. None if game ongoing."
-                        }
-                    },
-                    "required": ["reasoning", "priority_player", "priority_player_revealed_information", "priority_player_available_mana", "priority_player_available_actions", "winner"]
-                }
-            }],
-            "tool_choice": {"type": "tool", "name": "extract_state_info"}
-        }
-        for _ in range(self.n_retries):
+        analyze_state_messages.append(judge_request("Please analyze the current game state and describe what actions are available to the player who currently has priority.", "extract_state_info"))
+        def is_complete(result: dict) -> bool:
+            return all(field in result for field in analysis_required_fields) and result["priority_player"] in range(len(self.game_state.player_boards))
+        cascade_settings = self.cascade_settings()
+        if cascade_settings is not None:
+            response, cascade_cost = await self.metered(lambda: log.llm_generate(messages=analyze_state_messages, system=system_content, **cascade_settings, **judge_tool_settings))
+            result = next(iter(tool_inputs(response, "extract_state_info")), {})
+            if is_complete(result):
+                self.record_cascade("extract_state_info", False, cascade_cost)
+                return result
+            print(f"Escalating extract_state_info to {self.generation_settings.get('model')}: incomplete analysis")
+        result, escalated_cost = await self.metered(lambda: self.analyze_state_with_retries(analyze_state_messages, system_content, is_complete))
+        if cascade_settings is not None:
+            self.record_cascade("extract_state_info", True, cascade_cost, escalated_cost)
+        return result
+        
+    async def analyze_state_with_retries(self, analyze_state_messages: list[dict], system_content: list[dict], is_complete: Callable[[dict], bool]) -> Optional[dict]:
+        for attempt in range(self.n_retries):
+            if attempt:
+                metrics.add(retries=1)
             response = await log.llm_generate(
                 messages=analyze_state_messages,
                 system=system_content,
                 **self.generation_settings,
-                **analyze_state_tools
+                **judge_tool_settings
             )
             
-            result = response['content'][0]['input']
-            required_fields = ["reasoning", "priority_player", "priority_player_revealed_information", "priority_player_available_mana", "priority_player_available_actions", "winner"]
-            if not all(field in result for field in required_fields):
-                analyze_state_messages.append({"role":"user", "content":f"The response is missing required fields. Please include all of: {required_fields}"})
+            result = next(iter(tool_inputs(response, "extract_state_info")), {})
+            if not is_complete(result):
+                analyze_state_messages.append(judge_request(f"The response is missing required fields, names a player who doesn't exist or calls the wrong tool. Please include all of: {analysis_required_fields}", "extract_state_info"))
                 continue
             return result
         
+    def at_step_start(self) -> bool:
+        "Whether no action has been taken in the current step yet, eg no attackers have been declared. False when unknown, which only makes local_rules more cautious."
+        return self._last_action_step is not None and step_key(self.game_state) != self._last_action_step
+        
+    def resolve_action_locally(self, action: str) -> bool:
+        "Perform `action` and advance to the next priority without the LLM judge if local_rules can. The code is recorded like judge code so replay and the judge transcript see it."
+        if not self.local_rules_fast_path:
+            return False
+        resolution = local_rules.resolve_action(self.game_state, self.priority_player, action, self.at_step_start())
+        if resolution is None:
+            return False
+        new_game_state = self.game_state.model_copy(deep=True)
+        with metrics.span("execute_code", local_rules=True) as code_span:
+            success, output = sandbox.run_code(resolution.code, new_game_state, {})
+            if not success:
+                code_span.add(errors=1)
+        if not success:
+            self.error_messages.append(f"Local rules code failed\nCode:\n{resolution.code}\n\nError:\n{output}")
+            return False
+        self.used_python_code.append(f"# resolved by local rules\n{resolution.code}")
+        self.game_state = new_game_state
+        self.priority_player = resolution.priority_player
+        return True
+        
     async def game_master_step(self, action: str):
-        if action != "":
-            is_action_valid, invalid_action_feedback = await self.execute_action(action)
-            if not is_action_valid:
-                self.invalid_action_feedback = invalid_action_feedback
-                self.error_messages.append(f"Player {self.priority_player} action was invalid: \n\n{action} \n\nInvalid reason: {invalid_action_feedback}")
-                return
+        resolved_locally = False
+        step_before_action = step_key(self.game_state)
+        if action == "":
+            self._last_action_step = ()
+        else:
+            code_index = len(self.used_python_code)
+            resolved_locally = self.resolve_action_locally(action)
+            if not resolved_locally:
+                is_action_valid, invalid_action_feedback = await self.execute_action(action)
+                if not is_action_valid:
+                    self.invalid_action_feedback = invalid_action_feedback
+                    self.error_messages.append(f"Player {self.priority_player} action was invalid: \n\n{action} \n\nInvalid reason: {invalid_action_feedback}")
+                    return
             self.global_action_history.append(
                 {
                     "player_index": self.priority_player,
-                    "action": action
+                    "action": action,
+                    "code_index": code_index
                 }
             )
-        await self.advance_game_to_next_priority()
-        analyzed_state = await self.analyze_state_at_priority()
+            self._last_action_step = step_before_action
+        if resolved_locally:
+            analyzed_state = await self.analyze_state_at_priority()
+        elif self.combined_advance_analysis:
+            analyzed_state = await self.advance_game_to_next_priority(with_analysis=True)
+            if analyzed_state is None or not analysis_matches_state(analyzed_state, self.game_state):
+                print("Combined advance and analysis disagreed with the resulting state, analyzing separately")
+                analyzed_state = await self.analyze_state_at_priority()
+        else:
+            await self.advance_game_to_next_priority()
+            analyzed_state = await self.analyze_state_at_priority()
         if analyzed_state.get("winner") is not None:
             self.winner = analyzed_state["winner"]
         self.priority_player = analyzed_state["priority_player"]
         self.priority_player_available_actions = analyzed_state["priority_player_available_actions"]
         self.priority_player_revealed_information = analyzed_state["priority_player_revealed_information"]
         
-    def get_base_messages(self):
-        omniscient_view = prompting.format_omniscient_view(self.game_state)
-        game_state_code = open("game_state.py").read()
-        global_action_history = "\n".join([f"Player {action['player_index']}: {action['action']}" for action in self.global_action_history])
-        used_python_code = "\n".join(self.used_python_code)
+    def get_judge_transcript(self) -> list[dict]:
+        "Actions and judge code in the order they happened, one content block each. Only ever grows at the end, so earlier blocks stay a cacheable prefix."
+        blocks = []
+        action_index = 0
+        for code_index, code in enumerate(self.used_python_code + [None]):
+            while action_index < len(self.global_action_history) and self.global_action_history[action_index].get("code_index", len(self.used_python_code)) <= code_index:
+                action = self.global_action_history[action_index]
+                blocks.append({"type": "text", "text": f"Player {action['player_index']}: {action['action']}"})
+                action_index += 1
+            if code is not None:
+                blocks.append({"type": "text", "text": f"Python code:\n{code}"})
+        header = {"type": "text", "text": "Here are all the actions agents have taken in this game and all the python code that you have used to execute actions and advance game state so far, in order:"}
+        return [header] + self.compact_judge_transcript(blocks)
         
-        system_content = f"""You are an expert Magic: The Gathering judge. Your job is to enforce the rules of a Magic: The Gathering game played by two players who interact through natural language text. You track the state of the game using a Python API.
-
-Game Phase reminder:
-{prompts.game_phase_guide}
-
-Here are the python classes that hold the game state:
-{game_state_code}"""
+    def compact_judge_transcript(self, blocks: list[dict]) -> list[dict]:
+        """Drop the oldest transcript blocks so the rest fits in judge_context_token_budget. Their effects are already in the current state.
+        Blocks are dropped in whole chunks of about compaction_chunk_tokens, grouped from the start of the game, so the kept prefix
+        stays the same (and cached) until the next chunk has to go."""
+        if self.judge_context_token_budget is None:
+            return blocks
+        block_tokens = [llm_backends.estimate_tokens(block["text"]) for block in blocks]
+        remaining_tokens = sum(block_tokens)
+        cut = 0
+        chunk_tokens = 0
+        for i, tokens in enumerate(block_tokens):
+            if remaining_tokens <= self.judge_context_token_budget:
+                break
+            chunk_tokens += tokens
+            if chunk_tokens >= self.compaction_chunk_tokens:
+                remaining_tokens -= chunk_tokens
+                chunk_tokens = 0
+                cut = i + 1
+        if cut == 0:
+            return blocks
+        n_actions = sum(1 for block in blocks[:cut] if not block["text"].startswith("Python code:"))
+        summary = {"type": "text", "text": f"[{n_actions} earlier actions and {cut - n_actions} earlier code blocks were omitted to save space. Their effects are already reflected in the current game state. Effects and delayed triggers that still matter are recorded in game_state.lasting_effects and on permanents.]"}
+        return [summary] + blocks[cut:]
         
+    def get_base_messages(self):
+        "Judge prompt ordered from most to least stable: static system prompt, append-only transcript, then the current state."
+        transcript = self.get_judge_transcript()
+        transcript[-1] = {**transcript[-1], "cache_control": {"type": "ephemeral"}}
         messages = [
+            {"role":"user", "content":transcript},
             {"role":"user", "content":f"""
 Current Game State:
-{omniscient_view}"""},
-            {"role":"user", "content":f"""
-Here are all the actions agents have taken in this game:
-{global_action_history}
-"""},
-            {"role":"user", "content":f"""
-Here is all the python code that you have used to execute actions and advance game state so far:
-{used_python_code}
-"""},
+{prompting.format_omniscient_view(self.game_state)}"""},
         ]
-        return messages, system_content
-
-    async def execute_code_with_game_state(self, code: str, apply_changes: bool = True) -> tuple[bool, str, game_state.GameState]:
+        return messages, judge_system
 
-        f = io.StringIO()
-        new_game_state = deepcopy(self.game_state)
-        global_vars = {name: getattr(game_state, name) for name in dir(game_state) if not name.startswith('_')}
-        self.code_local_vars['game_state'] = new_game_state
-        
-        try:
-            with redirect_stdout(f):
-                exec(code, global_vars, self.code_local_vars)
-            if apply_changes:
-                self.used_python_code.append(code)
-                self.game_state = new_game_state
-            return True, f.getvalue(), new_game_state
-        except Exception:
-            error_trace = traceback.format_exc()
-            self.error_messages.append(f"Code execution failed\nCode:\n{code}\n\nError:\n{error_trace}")
-            return False, error_trace, new_game_state
\ No newline at end of file
+    async def execute_code_with_game_state(self, code: str, apply_changes: bool = True, state_json: Optional[str] = None) -> tuple[bool, str, game_state.GameState, dict[str, Any]]:
+        """Run judge code on a copy of the current state and return (success, output, new state, the judge variables kept after it).
+        Pass `state_json` when evaluating many candidates against the same state so it's only serialized once."""
+        with metrics.span("execute_code") as code_span:
+            success, output, new_game_state, new_local_vars = await sandbox.default_sandbox.run(code, self.game_state, self.code_local_vars, state_json=state_json)
+            if not success:
+                code_span.add(errors=1)
+        if not success:
+            self.error_messages.append(f"Code execution failed\nCode:\n{code}\n\nError:\n{output}")
+            return False, output, self.game_state, self.code_local_vars
+        if apply_changes:
+            self.used_python_code.append(code)
+            self.game_state = new_game_state
+            self.code_local_vars = new_local_vars
+        return True, output, new_game_state, new_local_vars
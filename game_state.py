@@ -5,6 +5,9 @@ from enum import Enum, auto
 import json
 from pathlib import Path
 import copy
+# the card database and the card containers' internals, re-exported for judge code and the rest of the code base
+from card_zones import (card_database, registered_tokens, card_fill_missing_fields, CardType, CardRecord, CardRegistry, card_registry, card_id_type_flags,
+                        card_type_flags, sort_key, indexed_battlefield_card_fields, Battlefield, CardZone, shared_copy)
 
 Card = str  # Type alias
 
@@ -34,23 +37,12 @@ class CardInfo(TypedDict, total=False):
     number: str
     legalities:Optional[list[str]] # list of lowercase format names
     
-def card_fill_missing_fields(card_info:CardInfo):
-    if not card_info.get('manaValue'):
-        card_info['manaValue'] = 0
-    if not card_info.get('manaCost'):
-        card_info['manaCost'] = ""
-    if not card_info.get('text'):
-        card_info['text'] = ""
-    return card_info
-
 def get_card_info(name:str) -> CardInfo:
-    return card_fill_missing_fields(card_database['data'][name])
-
-card_database: dict[str, CardInfo] = json.load(Path("assets/AtomicCardsGameplay.json").open())
+    "Normalized info of a card. Shared between calls, don't modify it."
+    return card_registry.record(card_registry.id_of(name)).info
 
 def register_token_card_info(name:str, types:List[str], subtypes:list[str], power:Optional[int]=None, toughness:Optional[int]=None, text:str='') -> Card:
     """Token names don't contain 'Token', eg name is 'Goblin' not 'Goblin Token'"""
-    assert name not in card_database['data'], f"Card {name} already exists"
     new_card_info: CardInfo = {
         "name": name,
         "manaCost": "",
@@ -62,7 +54,10 @@ def register_token_card_info(name:str, types:List[str], subtypes:list[str], powe
         "text": text,
         "isToken": True
     }
+    # registering an identical token again is harmless, eg when replaying history
+    assert name not in card_database['data'] or card_database['data'][name] == new_card_info, f"Card {name} already exists"
     card_database['data'][name] = new_card_info
+    registered_tokens[name] = new_card_info
     return name
 
 
@@ -89,6 +84,9 @@ class DeckList(BaseModel):
     
 class BattlefieldCard(BaseModel):
     "A card on the battlefield. Has an ID which other cards can reference."
+    # the Battlefield whose indexes include this card. A slot rather than a private attribute, so copies, pickles and
+    # equality leave it out
+    __slots__ = ("_battlefield",)
     battlefield_id: int
     card: CardOrToken
     owner: int
@@ -102,6 +100,13 @@ class BattlefieldCard(BaseModel):
     judge_public_notes: str = Field(default="", description="Public notes from the game judge relating to this card, such as cards it is linked to in some way, eg the Soulbond mechanic or Dauntless Bodyguard. The judge must keep this up to date manually.")
     
     
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in indexed_battlefield_card_fields:
+            battlefield = getattr(self, "_battlefield", None)
+            if battlefield is not None:
+                battlefield._indexed = False
+    
     @classmethod
     def from_card(cls, card: CardOrToken, owner: int, battlefield_id: int) -> "BattlefieldCard":
         assert card in card_database['data'], f"Card {card} not found in card database. Use create_token_card_info to create a new token."
@@ -117,33 +122,33 @@ class BattlefieldCard(BaseModel):
             entered_battlefield_this_turn=True
         )
 
-def sort_key(card: Card):
-    info = get_card_info(card)
-    mana_value = info.get("manaValue", 0)
-    types = info.get("types", [])
-    
-    # Priority within each mana value (higher = first)
-    type_priority = 4 if 'Basic' in info.get('supertypes', []) else( 3 if "Land" in types else (1 if "Creature" in types else 2))
-    
-    return (mana_value, -type_priority)
+    def can_attack(self) -> bool:
+        "Untapped creature without defender that has haste or has been under its controller's control since the turn began. Ignores other effects."
+        record = card_registry.record(card_registry.id_of(self.card))
+        if CardType.CREATURE not in record.type_flags or self.tapped:
+            return False
+        text = record.rules_text.lower()
+        return "defender" not in text and (not self.entered_battlefield_this_turn or "haste" in text)
 
 class PlayerBoard(BaseModel):
     "The entire state of a player, including their hand, battlefield, counters and tokens, graveyard, etc."
-    library: list[Card]
-    hand: list[Card] = Field(default_factory=list, description="Cards in hand. Note that cards are displayed in mana value order but stored unsorted.")
+    # so judge code assigning a plain list to a zone still gets a CardZone
+    model_config = {"validate_assignment": True}
+    
+    library: CardZone
+    hand: CardZone = Field(default_factory=CardZone, description="Cards in hand. Note that cards are displayed in mana value order but stored unsorted.")
     
     def get_hand_sorted(self) -> list[Card]:
-        return sorted(self.hand, key=sort_key)
+        return self.hand.sorted_by_sort_key()
         
-    graveyard: list[Card] = Field(default_factory=list)
-    exile: list[Card] = Field(default_factory=list)
+    graveyard: CardZone = Field(default_factory=CardZone)
+    exile: CardZone = Field(default_factory=CardZone)
     life: int = Field(default=20)
     counters: dict[str, int] = Field(default_factory=dict)
-    battlefield: dict[int, BattlefieldCard] = Field(default_factory=dict)
+    battlefield: Battlefield = Field(default_factory=Battlefield)
     
     def untap_all(self):
-        for battlefield_card in self.battlefield.values():
-            battlefield_card.tapped = False
+        self.battlefield.set_tapped(list(self.battlefield.tapped_ids()), False)
             
     def battlefield_to_graveyard(self, battlefield_ids: list[int]):
         for battlefield_id in battlefield_ids:
@@ -158,8 +163,32 @@ class PlayerBoard(BaseModel):
             del self.battlefield[battlefield_id]
             
     def tap_permanents(self, battlefield_ids: list[int]):
-        for battlefield_id in battlefield_ids:
-            self.battlefield[battlefield_id].tapped = True
+        self.battlefield.set_tapped(battlefield_ids, True)
+        
+    def permanents_of_type(self, card_type: CardType) -> list[BattlefieldCard]:
+        "Permanents with all the types in `card_type`, eg CardType.LAND or CardType.ARTIFACT | CardType.CREATURE, in battlefield id order."
+        return [self.battlefield[battlefield_id] for battlefield_id in sorted(self.battlefield.ids_of_type(card_type))]
+        
+    def count_of_type(self, card_type: CardType) -> int:
+        return len(self.battlefield.ids_of_type(card_type))
+        
+    def untapped_permanents(self) -> list[BattlefieldCard]:
+        tapped = self.battlefield.tapped_ids()
+        return [battlefield_card for battlefield_id, battlefield_card in self.battlefield.items() if battlefield_id not in tapped]
+        
+    def untapped_lands(self) -> list[BattlefieldCard]:
+        tapped = self.battlefield.tapped_ids()
+        return [self.battlefield[battlefield_id] for battlefield_id in sorted(self.battlefield.ids_of_type(CardType.LAND) - tapped)]
+        
+    def creatures_able_to_attack(self) -> list[BattlefieldCard]:
+        "Creatures for which BattlefieldCard.can_attack is true, in battlefield id order."
+        tapped = self.battlefield.tapped_ids()
+        creatures = (self.battlefield[battlefield_id] for battlefield_id in sorted(self.battlefield.ids_of_type(CardType.CREATURE) - tapped))
+        return [battlefield_card for battlefield_card in creatures if battlefield_card.can_attack()]
+        
+    def permanents_owned_by(self, player_index: int) -> list[BattlefieldCard]:
+        "Permanents this player controls that `player_index` owns, eg to find stolen permanents."
+        return [self.battlefield[battlefield_id] for battlefield_id in sorted(self.battlefield.ids_owned_by(player_index))]
             
     def cleanup_damage(self):
         for battlefield_card in self.battlefield.values():
@@ -188,12 +217,12 @@ class PlayerBoard(BaseModel):
         """implement approximate MTG Arena augmented hand drawing algorithm:
         resample any hands that have an unusual number of lands for the deck
         This is not for competitive play, only for training and demonstration"""
-        land_count = sum(1 for card in library if "Land" in get_card_info(card)["types"])
+        land_count = CardZone(library).count_of_type(CardType.LAND)
         expected_land_count = land_count / len(library) * 7
         while True:
             random.shuffle(library)
             hand, remaining_library = library[:7], library[7:]
-            hand_land_count = sum(1 for card in hand if "Land" in get_card_info(card)["types"])
+            hand_land_count = sum(1 for card in hand if CardType.LAND in card_type_flags(card))
             if abs(hand_land_count - expected_land_count) <=1:
                 return remaining_library, hand
         
@@ -213,7 +242,12 @@ class GameState(BaseModel):
     turn_number: int = Field(default=1, description="The number of the current turn, starting from 1. Each player taking a turn is 1 turn.")
     starting_player_index: int = Field(default=0)
     random_state: int = Field(default_factory=lambda: random.randint(0, 2**32-1), description="Random state used to make the game state deterministic for a given player.")
+    lasting_effects: list[str] = Field(default_factory=list, description="Effects and delayed triggers not tied to a single permanent that must be remembered, eg 'until end of turn' effects, 'at the beginning of the next end step' triggers, or emblems. The judge must keep this up to date manually, because older judge code is dropped from the judge's context.")
+    
     
+    def snapshot(self, previous: Optional["GameState"] = None) -> "GameState":
+        "Read only copy of the game state for history, sharing unchanged parts with the previous snapshot. Never modify a snapshot."
+        return shared_copy(self, previous)
     
     def cleanup_damage(self):
         for player_board in self.player_boards:
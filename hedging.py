@@ -0,0 +1,131 @@
+import anyio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+# hedging is opt in, globally here or per call with llm_generate(hedge=True)
+hedging_enabled = False
+
+class LatencyHistogram:
+    """Latencies of the most recent `max_samples` calls. A censored sample is a lower bound, eg a call that lost a hedge race
+    and was cancelled after that many seconds. Percentiles use the Kaplan-Meier estimate, so losers don't bias them low."""
+
+    def __init__(self, max_samples: int = 200):
+        # (seconds, censored)
+        self.samples: deque[tuple[float, bool]] = deque(maxlen=max_samples)
+
+    def record(self, seconds: float, censored: bool = False):
+        self.samples.append((seconds, censored))
+
+    def percentile(self, fraction: float) -> float:
+        # observed latencies sort before censored ones at the same time, the censored call was still running then
+        ordered = sorted(self.samples)
+        at_risk = len(ordered)
+        surviving = 1.0
+        longest_observed = 0.0
+        for seconds, censored in ordered:
+            if not censored:
+                surviving *= 1 - 1 / at_risk
+                longest_observed = seconds
+                if 1 - surviving >= fraction:
+                    return seconds
+            at_risk -= 1
+        # the percentile lies beyond every observed latency
+        return max(longest_observed, ordered[-1][0])
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {"samples": 0}
+        return {"samples": len(self.samples), **{f"p{int(q * 100)}": self.percentile(q) for q in (0.5, 0.9, 0.95, 0.99)}}
+
+def prompt_size_bucket(input_tokens: int) -> int:
+    "Upper bound of the power of two bucket `input_tokens` falls in, so similar sized prompts share a histogram."
+    return 1 << max(10, (max(input_tokens, 1) - 1).bit_length())
+
+class HedgePolicy:
+    """Sends a duplicate of a call that hasn't finished after the `percentile` latency of recent calls for the same model
+    and prompt size. The first response wins and the other call is cancelled. At most `budget_fraction` of calls are hedged."""
+
+    def __init__(self, percentile: float = 0.95, min_samples: int = 20, budget_fraction: float = 0.1):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget_fraction = budget_fraction
+        self.histograms: dict[tuple[str, int], LatencyHistogram] = {}
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def histogram(self, model: str, input_tokens: int) -> LatencyHistogram:
+        key = (model, prompt_size_bucket(input_tokens))
+        if key not in self.histograms:
+            self.histograms[key] = LatencyHistogram()
+        return self.histograms[key]
+
+    def hedge_delay(self, histogram: LatencyHistogram) -> Optional[float]:
+        if len(histogram.samples) < self.min_samples or self.hedges + 1 > self.budget_fraction * self.calls:
+            return None
+        return histogram.percentile(self.percentile)
+
+    async def call(self, model: str, input_tokens: int, call: Callable[[bool], Awaitable[T]], hedge: bool) -> T:
+        """`call(is_hedge)` makes one attempt. The hedged attempt should reserve its own capacity and account for its own
+        usage, it's cancelled if the first attempt wins and may finish too late to be returned."""
+        histogram = self.histogram(model, input_tokens)
+        self.calls += 1
+        delay = self.hedge_delay(histogram) if hedge else None
+        if delay is None:
+            start = time.monotonic()
+            result = await call(False)
+            histogram.record(time.monotonic() - start)
+            return result
+
+        results: list[T] = []
+        errors: list[BaseException] = []
+        finished = anyio.Event()
+        running = 0
+        async def attempt(is_hedge: bool):
+            nonlocal running
+            running += 1
+            start = time.monotonic()
+            won = failed = False
+            try:
+                result = await call(is_hedge)
+            except Exception as e:
+                failed = True
+                errors.append(e)
+            else:
+                if not results:
+                    results.append(result)
+                    won = True
+                    histogram.record(time.monotonic() - start)
+                    self.hedge_wins += is_hedge
+            finally:
+                if not won and not failed:
+                    # lost the race, so its latency is only known to be at least this long
+                    histogram.record(time.monotonic() - start, censored=True)
+                running -= 1
+                if results or running == 0:
+                    finished.set()
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(attempt, False)
+            with anyio.move_on_after(delay):
+                await finished.wait()
+            if not finished.is_set():
+                self.hedges += 1
+                task_group.start_soon(attempt, True)
+            await finished.wait()
+            task_group.cancel_scope.cancel()
+        if results:
+            return results[0]
+        raise errors[0]
+
+    def metrics(self) -> dict:
+        return {
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "latency": {f"{model}/<={bucket}_tokens": histogram.summary() for (model, bucket), histogram in self.histograms.items()},
+        }
+
+default_policy = HedgePolicy()
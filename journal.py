@@ -0,0 +1,125 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, where journals aren't locked
+    fcntl = None
+
+ongoing_games_dir = Path("database/ongoing_games")
+finished_games_dir = Path("database/finished_games")
+os.makedirs(ongoing_games_dir, exist_ok=True)
+os.makedirs(finished_games_dir, exist_ok=True)
+
+# Records are flushed to the OS immediately, so a crash of this process loses nothing.
+# fsync is batched, so an OS crash loses at most this many records / seconds of work. Callers on an event loop run it in a
+# worker thread, see GameJournal.sync_due.
+fsync_every_records = 8
+fsync_interval_seconds = 5.0
+
+def journal_path(game_id: str) -> Path:
+    return ongoing_games_dir / f"{game_id}.jsonl"
+
+def finished_path(game_id: str) -> Path:
+    return finished_games_dir / f"{game_id}.json"
+
+def ongoing_game_ids() -> list[str]:
+    return [path.stem for path in ongoing_games_dir.glob("*.jsonl")]
+
+def read_start_record(game_id: str) -> dict:
+    "The first record of a journal, without reading the rest."
+    with open(journal_path(game_id)) as f:
+        return json.loads(f.readline())
+
+def is_locked(game_id: str) -> bool:
+    "Whether a GameJournal for this game is open, in this process or another one, eg eval_agents."
+    if fcntl is None:
+        return False
+    try:
+        f = open(journal_path(game_id))
+    except FileNotFoundError:
+        return False
+    with f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        return False
+
+def read_records(game_id: str) -> list[dict]:
+    "Read all complete records. A torn last line from a crash mid write is ignored."
+    lines = journal_path(game_id).read_text().split("\n")
+    records = []
+    for i, line in enumerate(lines):
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            if i < len(lines) - 1 and any(lines[i + 1:]):
+                raise
+    return records
+
+class JournalLocked(Exception):
+    "Raised when opening a journal another GameJournal has open, so two processes never play the same game."
+
+class GameJournal:
+    """Append-only log of one game, one json record per line. Holds an exclusive lock on the file while open, so only one
+    process writes a game. Readers like read_records don't need the lock."""
+
+    def __init__(self, game_id: str):
+        self.path = journal_path(game_id)
+        self.file = open(self.path, "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.file.close()
+                raise JournalLocked(f"Game {game_id} is already being played") from None
+        # only once the lock is held, a torn record might still be in the middle of being written otherwise
+        self._truncate_torn_record()
+        self.records_since_sync = 0
+        self.last_sync_time = time.monotonic()
+
+    def _truncate_torn_record(self):
+        if not self.path.exists():
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def append(self, record: dict):
+        "Write `record` and flush it to the OS. Call sync once sync_due."
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        self.records_since_sync += 1
+
+    @property
+    def sync_due(self) -> bool:
+        return self.records_since_sync > 0 and (self.records_since_sync >= fsync_every_records or time.monotonic() - self.last_sync_time >= fsync_interval_seconds)
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.records_since_sync = 0
+        self.last_sync_time = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+def finish(game_id: str, game_data: dict, game_journal: Optional[GameJournal] = None):
+    "Write the final game once as a single json file and remove its journal."
+    if game_journal is not None:
+        game_journal.close()
+    tmp_path = finished_path(game_id).with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(game_data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, finished_path(game_id))
+    journal_path(game_id).unlink(missing_ok=True)
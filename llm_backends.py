@@ -0,0 +1,284 @@
+"""Backends that answer llm_generate requests. Pick one with the MTG_LLM_BACKEND environment variable (anthropic, replay or
+scripted) or by setting log.backend. Replay and scripted backends need no network, so games, evals and deck building can run
+offline as a deterministic performance benchmark."""
+import abc
+import anthropic
+import anyio
+import gzip
+import json
+import os
+import random
+import re
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Union
+import hedging
+import scheduler
+
+def empty_usage() -> dict:
+    return {"prompt_tokens": 0, "completion_tokens": 0, "cache_creation_tokens": 0, "cache_read_tokens": 0}
+
+def add_usage(total: dict, usage: dict):
+    for name, value in usage.items():
+        total[name] += value
+
+def response_usage(response) -> dict:
+    "Usage of an Anthropic response, in the format backends return."
+    return {
+        "prompt_tokens": response.usage.input_tokens,
+        "completion_tokens": response.usage.output_tokens,
+        "cache_creation_tokens": response.usage.cache_creation_input_tokens or 0,
+        "cache_read_tokens": response.usage.cache_read_input_tokens or 0
+    }
+
+def rate_limited_usage(response) -> tuple[int, int]:
+    "(input, output) tokens of a response that count towards rate limits. Cache reads don't."
+    return response.usage.input_tokens + (response.usage.cache_creation_input_tokens or 0), response.usage.output_tokens
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def estimate_input_tokens(kwargs: dict) -> int:
+    return estimate_tokens(json.dumps([kwargs.get("system"), kwargs.get("messages"), kwargs.get("tools")], default=str))
+
+TextCallback = Callable[[str], Awaitable[None]]
+
+tool_request_pattern = re.compile(r"Respond by calling the (\w+) tool\.")
+
+def tool_request(tool_name: str) -> str:
+    "Asks for a call to `tool_name` in a request whose tool_choice allows any tool, see requested_tool."
+    return f"Respond by calling the {tool_name} tool."
+
+def requested_tool(kwargs: dict) -> Optional[str]:
+    "The tool a request calls for: the one named by tool_choice, or with tool_choice any, the last one asked for by tool_request."
+    tool_choice = kwargs.get("tool_choice")
+    if tool_choice is None:
+        return None
+    if tool_choice.get("type") == "tool":
+        return tool_choice["name"]
+    requests = tool_request_pattern.findall(message_text(kwargs))
+    return requests[-1] if requests else kwargs["tools"][0]["name"]
+
+class LLMBackend(abc.ABC):
+    name = "base"
+    # whether responses should be read from and saved to the response cache
+    cacheable = True
+    # whether calls cost money, so a cancelled call is still charged its estimated cost
+    billed = True
+    # whether create calls on_text with text as it's generated. Otherwise llm_generate passes it the whole text at the end
+    streams_text = False
+
+    @abc.abstractmethod
+    async def create(self, kwargs: dict, cache_key: str, priority: Optional[str] = None, hedge: bool = False, on_text: Optional[TextCallback] = None) -> tuple[dict, dict]:
+        "Returns (response in Anthropic message format, usage)."
+
+class AnthropicBackend(LLMBackend):
+    name = "anthropic"
+    streams_text = True
+
+    def __init__(self):
+        self._client: Optional[anthropic.AsyncAnthropic] = None
+
+    @property
+    def client(self) -> anthropic.AsyncAnthropic:
+        if self._client is None:
+            self._client = anthropic.AsyncAnthropic(max_retries=5)
+        return self._client
+
+    async def create(self, kwargs, cache_key, priority=None, hedge=False, on_text=None):
+        model = kwargs["model"]
+        if "claude" not in model:
+            raise ValueError(f"Unsupported model: {model}")
+        if 'max_tokens' not in kwargs:
+            kwargs['max_tokens'] = 8192
+        input_estimate = estimate_input_tokens(kwargs)
+        output_estimate = min(kwargs['max_tokens'], scheduler.reserved_output_tokens)
+        # usage of hedged attempts that lost the race, they're billed too
+        losers_usage = empty_usage()
+        responses = []
+        async def send(reservation: scheduler.Reservation):
+            try:
+                response = await self.client.messages.create(**kwargs)
+            except anyio.get_cancelled_exc_class():
+                # a request cancelled in flight is still billed, assume it used what was reserved for it
+                losers_usage["prompt_tokens"] += input_estimate
+                losers_usage["completion_tokens"] += output_estimate
+                raise
+            reservation.report_usage(*rate_limited_usage(response))
+            responses.append(response)
+            return response
+        async with scheduler.default_scheduler.slot(model, priority, input_estimate, output_estimate) as reservation:
+            if on_text is not None:
+                # streamed text can't be taken back, so streamed calls aren't hedged
+                async with self.client.messages.stream(**kwargs) as stream:
+                    async for text in stream.text_stream:
+                        await on_text(text)
+                    response = await stream.get_final_message()
+                reservation.report_usage(*rate_limited_usage(response))
+            else:
+                async def attempt(is_hedge: bool):
+                    if not is_hedge:
+                        return await send(reservation)
+                    # the duplicate is a request of its own as far as rate limits go
+                    async with scheduler.default_scheduler.slot(model, priority, input_estimate, output_estimate) as hedge_reservation:
+                        return await send(hedge_reservation)
+                response = await hedging.default_policy.call(model, input_estimate, attempt, hedge)
+        usage = response_usage(response)
+        for loser in responses:
+            if loser is not response:
+                add_usage(losers_usage, response_usage(loser))
+        add_usage(usage, losers_usage)
+        return response.model_dump(), usage
+
+class ReplayMiss(KeyError):
+    pass
+
+class ReplayBackend(LLMBackend):
+    """Serves responses recorded by earlier live runs, from the response cache and from generation logs, matched by cache key.
+    Sleeps `latency_seconds` plus up to `latency_jitter_seconds` per call to simulate the API. Raises ReplayMiss for unrecorded requests."""
+    name = "replay"
+    cacheable = False
+    billed = False
+
+    def __init__(self, cache_key_function: Callable[..., str], response_cache=None, generations_dir: str = "logs/generations", latency_seconds: float = 0.0, latency_jitter_seconds: float = 0.0, seed: int = 0):
+        self.cache_key_function = cache_key_function
+        self.response_cache = response_cache
+        self.generations_dir = Path(generations_dir)
+        self.latency_seconds = latency_seconds
+        self.latency_jitter_seconds = latency_jitter_seconds
+        self.random = random.Random(seed)
+        self._recorded: Optional[dict[str, dict]] = None
+
+    def _load_generation_logs(self) -> dict[str, dict]:
+        recorded = {}
+        def add(record: dict):
+            if record.get("backend", "anthropic") != "anthropic":
+                return
+            request = dict(record["request"])
+            sample_index = record.get("sample_index", 0)
+            recorded[self.cache_key_function(request, sample_index)] = record["response"]
+            # the request was logged after max_tokens got its default, which the key was computed without
+            if request.get("max_tokens") == 8192:
+                del request["max_tokens"]
+                recorded.setdefault(self.cache_key_function(request, sample_index), record["response"])
+        for path in sorted(self.generations_dir.glob("*.jsonl.gz")):
+            try:
+                with gzip.open(path, "rt") as f:
+                    for line in f:
+                        add(json.loads(line))
+            except (OSError, EOFError, json.JSONDecodeError):
+                continue  # segment still being written or torn by a crash
+        for path in sorted(self.generations_dir.glob("*.json")):
+            try:
+                add(json.loads(path.read_text()))
+            except (OSError, json.JSONDecodeError, KeyError):
+                continue
+        return recorded
+
+    async def create(self, kwargs, cache_key, priority=None, hedge=False, on_text=None):
+        # reading logs and the response cache waits on the disk, so it runs off the event loop
+        if self._recorded is None:
+            self._recorded = await anyio.to_thread.run_sync(self._load_generation_logs)
+        response = self._recorded.get(cache_key)
+        if response is None and self.response_cache is not None:
+            response = await anyio.to_thread.run_sync(self.response_cache.get, cache_key)
+        if response is None:
+            raise ReplayMiss(f"No recorded response for request {cache_key[:8]}")
+        await anyio.sleep(self.latency_seconds + self.random.random() * self.latency_jitter_seconds)
+        return json.loads(json.dumps(response)), empty_usage()
+
+ScriptResult = Union[str, dict]
+
+class ScriptedBackend(LLMBackend):
+    """Answers every request with `script(request kwargs)`: a string becomes a text response, a dict becomes the input of a
+    call to the requested tool."""
+    name = "scripted"
+    cacheable = False
+    billed = False
+
+    def __init__(self, script: Callable[[dict], ScriptResult], latency_seconds: float = 0.0):
+        self.script = script
+        self.latency_seconds = latency_seconds
+
+    async def create(self, kwargs, cache_key, priority=None, hedge=False, on_text=None):
+        await anyio.sleep(self.latency_seconds)
+        result = self.script(kwargs)
+        if isinstance(result, str):
+            content = [{"type": "text", "text": result}]
+            stop_reason = "end_turn"
+        else:
+            content = [{"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:24]}", "name": requested_tool(kwargs), "input": result}]
+            stop_reason = "tool_use"
+        response = {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": kwargs["model"],
+            "content": content,
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": {"input_tokens": 0, "output_tokens": 0},
+        }
+        return response, empty_usage()
+
+def message_text(kwargs: dict) -> str:
+    parts = []
+    for message in kwargs.get("messages", []):
+        content = message["content"]
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block.get("text", "") for block in content)
+    return "\n".join(parts)
+
+# deck the scripted build_deck tool builds: up to nine modern legal red creatures as four-ofs, filled up to 60 cards with Mountains
+synthetic_deck_code = """creatures = [name for name, card in all_cards.items() if card.get('types') == ['Creature'] and card.get('colors') == ['R'] and 'modern' in (card.get('legalities') or [])][:9]
+decklist.mainboard = {name: 4 for name in creatures}
+decklist.mainboard['Mountain'] = 60 - sum(decklist.mainboard.values())"""
+
+def synthetic_game_script(kwargs: dict) -> ScriptResult:
+    """Script for a two player game where every player passes, every action is valid and the judge moves on to the next
+    player's first main phase each time, until GameMaster's turn limit ends the game. Deck building builds a simple red deck."""
+    tool_name = requested_tool(kwargs)
+    if tool_name is None:
+        return "Pass"
+    active_players = re.findall(r"Player (\d+)'s turn", message_text(kwargs))
+    active_player = int(active_players[-1]) if active_players else 0
+    analysis = {
+        "priority_player_revealed_information": "",
+        "priority_player_available_mana": "",
+        "priority_player_available_actions": "- Pass",
+        "winner": None,
+    }
+    advance_code = "if game_state.turn_step == TurnStep.MAIN_1:\n    game_state.advance_to_step_simple(TurnStep.END)\ngame_state.advance_to_step_simple(TurnStep.MAIN_1)"
+    if tool_name == "execute_action":
+        return {"reasoning": "", "is_action_valid": True, "python_code": "pass"}
+    if tool_name == "advance_game_state":
+        return {"reasoning": "", "priority_player": 1 - active_player, "python_code": advance_code}
+    if tool_name == "advance_and_analyze":
+        return {"reasoning": "", "priority_player": 1 - active_player, "python_code": advance_code, **analysis}
+    if tool_name == "extract_state_info":
+        return {"reasoning": "", "priority_player": active_player, **analysis}
+    if tool_name == "build_deck":
+        # build_deck shows the decklist after each run of the code, the deck is finished once it has been built
+        return {"reasoning": "", "is_finished": "Decklist: " in message_text(kwargs), "python_code": synthetic_deck_code}
+    # other tools, eg deck building: fill required fields with empty values of the right type
+    tool = next(tool for tool in kwargs["tools"] if tool["name"] == tool_name)
+    empty_values = {"string": "", "integer": 0, "number": 0, "boolean": False, "array": [], "object": {}}
+    properties = tool["input_schema"].get("properties", {})
+    return {name: empty_values.get(properties.get(name, {}).get("type"), None) for name in tool["input_schema"].get("required", [])}
+
+def backend_from_env(cache_key_function: Callable[..., str], response_cache=None) -> LLMBackend:
+    name = os.environ.get("MTG_LLM_BACKEND", "anthropic")
+    if name == "anthropic":
+        return AnthropicBackend()
+    if name == "replay":
+        return ReplayBackend(
+            cache_key_function,
+            response_cache,
+            latency_seconds=float(os.environ.get("MTG_LLM_REPLAY_LATENCY", "0")),
+            latency_jitter_seconds=float(os.environ.get("MTG_LLM_REPLAY_LATENCY_JITTER", "0")),
+        )
+    if name == "scripted":
+        return ScriptedBackend(synthetic_game_script, latency_seconds=float(os.environ.get("MTG_LLM_SCRIPTED_LATENCY", "0")))
+    raise ValueError(f"Unknown MTG_LLM_BACKEND: {name}")
@@ -0,0 +1,114 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+class ResponseCache:
+    """LLM responses stored zlib compressed in one SQLite database in WAL mode, so many games and processes can share it.
+    Least recently used entries are evicted once the database grows past `max_bytes`, and recently used responses are
+    also kept in memory as json text, so callers never share one mutable response. Responses from the old one-json-file-per-key cache directory are moved in when first looked up."""
+
+    def __init__(self, path: str, max_bytes: int = 2 * 1024**3, hot_entries: int = 256, legacy_dir: Optional[str] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hot_entries = hot_entries
+        self.legacy_dir = legacy_dir
+        self._hot: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._writes_since_eviction_check = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            self._connection = connection
+        return self._connection
+
+    def _remember(self, key: str, text: str):
+        self._hot[key] = text
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.hot_entries:
+            self._hot.popitem(last=False)
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            if key in self._hot:
+                self._hot.move_to_end(key)
+                return json.loads(self._hot[key])
+            connection = self._connect()
+            row = connection.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                value = self._load_legacy(key)
+                if value is None:
+                    return None
+                self._put(key, value)
+                self._remove_legacy(key)
+                return value
+            try:
+                text = zlib.decompress(row[0]).decode()
+                value = json.loads(text)
+            except (zlib.error, UnicodeDecodeError, json.JSONDecodeError):
+                return None
+            connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._remember(key, text)
+            return value
+
+    def put(self, key: str, value: dict):
+        with self._lock:
+            self._put(key, value)
+
+    def _put(self, key: str, value: dict):
+        text = json.dumps(value)
+        data = zlib.compress(text.encode())
+        connection = self._connect()
+        connection.execute("INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)", (key, data, len(data), time.time()))
+        self._remember(key, text)
+        self._writes_since_eviction_check += 1
+        if self._writes_since_eviction_check >= 100:
+            self._writes_since_eviction_check = 0
+            self._evict()
+
+    def _evict(self):
+        connection = self._connect()
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # remove the least recently used entries down to 90% of the limit, so this doesn't run again right away
+        excess = total - int(self.max_bytes * 0.9)
+        removed = 0
+        keys = []
+        for key, size in connection.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            keys.append(key)
+            removed += size
+            if removed >= excess:
+                break
+        connection.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key in keys])
+        for key in keys:
+            self._hot.pop(key, None)
+
+    def _load_legacy(self, key: str) -> Optional[dict]:
+        if self.legacy_dir is None:
+            return None
+        legacy_file = os.path.join(self.legacy_dir, f"{key}.json")
+        if not os.path.exists(legacy_file):
+            return None
+        try:
+            with open(legacy_file) as f:
+                value = json.load(f)
+        except (json.JSONDecodeError, IOError):
+            return None
+        return value
+
+    def _remove_legacy(self, key: str):
+        try:
+            os.remove(os.path.join(self.legacy_dir, f"{key}.json"))
+        except OSError:
+            pass
@@ -0,0 +1,282 @@
+"""Deterministic handling of routine actions, so they don't need an LLM judge call.
+Everything here is deliberately conservative: whenever a board has anything the rules below don't fully understand,
+functions return None and the LLM judge handles the action as usual."""
+import game_state
+import prompting
+from game_state import TurnStep
+from pydantic import BaseModel
+from typing import Optional
+import re
+
+keyword_abilities = {"flying", "haste", "vigilance", "trample", "first strike", "double strike", "reach", "deathtouch", "lifelink", "menace", "defender", "indestructible", "hexproof"}
+basic_land_colors = {"Plains": "W", "Island": "U", "Swamp": "B", "Mountain": "R", "Forest": "G", "Wastes": "C"}
+
+pass_pattern = re.compile(r"^(pass|pass priority|i pass|do nothing|no action|continue)$", re.IGNORECASE)
+end_turn_pattern = re.compile(r"^(end turn|end my turn|pass turn|pass the turn)$", re.IGNORECASE)
+play_land_pattern = re.compile(r"^play (?:a |an )?(?P<card>.+)$", re.IGNORECASE)
+cast_pattern = re.compile(r"^cast (?:a |an )?(?P<card>.+)$", re.IGNORECASE)
+
+class LocalResolution(BaseModel):
+    "Judge code that performs an action and advances to the next priority, plus who gets priority then."
+    code: str
+    priority_player: int
+
+def normalize_action(action: str) -> str:
+    return action.strip().strip('"\'').strip().rstrip(".!").strip()
+
+def is_pass_action(action: str) -> bool:
+    action = normalize_action(action)
+    return bool(pass_pattern.match(action) or end_turn_pattern.match(action))
+
+def likely_to_pass(state: game_state.GameState, player_index: int) -> bool:
+    "Guess for speculation: it's not the player's turn and they have no untapped lands, so they can hardly do anything."
+    if player_index == state.active_player_index:
+        return False
+    return sum(prompting.calculate_available_mana(state.player_boards[player_index]).values()) == 0
+
+def rules_text(card_info: game_state.CardInfo) -> str:
+    return re.sub(r'\([^)]*\)', '', card_info.get('text') or '').strip()
+
+def is_vanilla(card_info: game_state.CardInfo) -> bool:
+    "No rules text besides simple keyword abilities."
+    abilities = [a.strip().lower() for a in re.split(r"[\n,]", rules_text(card_info)) if a.strip()]
+    return all(ability in keyword_abilities for ability in abilities)
+
+def is_basic_land(card_info: game_state.CardInfo) -> bool:
+    return "Land" in card_info.get("types", []) and "Basic" in card_info.get("supertypes", [])
+
+def has_triggered_ability(card_info: game_state.CardInfo) -> bool:
+    return bool(re.search(r"\b(When|Whenever|At the beginning|At end|Landfall)\b", rules_text(card_info), re.IGNORECASE))
+
+def has_activated_ability(card_info: game_state.CardInfo) -> bool:
+    "Activated abilities other than mana abilities."
+    return any(":" in line and not re.match(r"^\{T\}: Add ", line) for line in rules_text(card_info).split("\n"))
+
+def has_instant_speed_option(card_info: game_state.CardInfo) -> bool:
+    return "Instant" in card_info.get("types", []) or bool(re.search(r"\bFlash\b", rules_text(card_info)))
+
+# keyword abilities that are used from a hand, graveyard or exile, eg cycling, channel and flashback
+zone_ability_pattern = re.compile(r"\b(\w*cycling|channel|flashback|ninjutsu|retrace|jump-start|escape|unearth|embalm|eternalize|disturb|aftermath|encore|scavenge|dredge|madness|forecast|transmute|bloodrush|reinforce|evoke|suspend|foretell|plot|craft)\b", re.IGNORECASE)
+# wordings of other abilities that work outside the battlefield, eg "Discard this card:" or "return Bloodghast from your graveyard"
+outside_battlefield_pattern = re.compile(r"\bthis card\b|\b(?:from|in) (?:your|a|their|its owner's|any) (?:hand|graveyard)\b|\bfrom exile\b", re.IGNORECASE)
+
+def can_act_outside_battlefield(card_info: game_state.CardInfo) -> bool:
+    "The card may have an ability that works from a hand, graveyard or exile."
+    text = rules_text(card_info)
+    return bool(zone_ability_pattern.search(text) or outside_battlefield_pattern.search(text))
+
+def parse_mana_cost(mana_cost: str) -> Optional[tuple[int, dict[str, int]]]:
+    "(generic, colored pips) for simple mana costs. None for X, hybrid, phyrexian and other symbols."
+    generic = 0
+    colored: dict[str, int] = {}
+    for symbol in re.findall(r"\{([^}]*)\}", mana_cost):
+        if symbol.isdigit():
+            generic += int(symbol)
+        elif symbol in ("W", "U", "B", "R", "G", "C"):
+            colored[symbol] = colored.get(symbol, 0) + 1
+        else:
+            return None
+    return generic, colored
+
+def basic_land_color(card_info: game_state.CardInfo) -> Optional[str]:
+    if not is_basic_land(card_info):
+        return None
+    return next((color for subtype, color in basic_land_colors.items() if subtype in card_info.get("subtypes", [])), None)
+
+def board_is_quiet(state: game_state.GameState) -> bool:
+    """No player can do anything at instant speed and nothing can trigger, so passing priority just moves the game forward.
+    Mana abilities of lands don't count. Cards in hands, graveyards and exile count if they may have an ability that works
+    from there, eg cycling, channel or flashback."""
+    for board in state.player_boards:
+        for battlefield_card in board.battlefield.values():
+            card_info = game_state.get_card_info(battlefield_card.card)
+            if battlefield_card.effects or battlefield_card.counters or battlefield_card.attached_to is not None:
+                return False
+            if has_triggered_ability(card_info) or has_activated_ability(card_info):
+                return False
+        for card in board.hand:
+            card_info = game_state.get_card_info(card)
+            if has_instant_speed_option(card_info) or can_act_outside_battlefield(card_info):
+                return False
+        for card in set(board.graveyard) | set(board.exile):
+            if can_act_outside_battlefield(game_state.get_card_info(card)):
+                return False
+    return not state.stack and not state.lasting_effects
+
+def pay_with_basic_lands(board: game_state.PlayerBoard, mana_cost: str) -> Optional[list[int]]:
+    "Battlefield ids of untapped basic lands that pay `mana_cost`, keeping the most common colors for generic costs. None if it can't be paid that way."
+    cost = parse_mana_cost(mana_cost)
+    if cost is None:
+        return None
+    generic, colored = cost
+    lands_by_color: dict[str, list[int]] = {}
+    for battlefield_card in board.untapped_lands():
+        color = basic_land_color(game_state.get_card_info(battlefield_card.card))
+        if color is not None:
+            lands_by_color.setdefault(color, []).append(battlefield_card.battlefield_id)
+    payment = []
+    for color, count in colored.items():
+        lands = lands_by_color.get(color, [])
+        if len(lands) < count:
+            return None
+        payment.extend(lands[:count])
+        lands_by_color[color] = lands[count:]
+    for _ in range(generic):
+        color = max(lands_by_color, key=lambda c: len(lands_by_color[c]), default=None)
+        if color is None or not lands_by_color[color]:
+            return None
+        payment.append(lands_by_color[color].pop())
+    return payment
+
+def played_land_this_turn(board: game_state.PlayerBoard) -> bool:
+    return any(battlefield_card.entered_battlefield_this_turn for battlefield_card in board.permanents_of_type(game_state.CardType.LAND))
+
+def find_in_hand(board: game_state.PlayerBoard, name: str) -> Optional[game_state.Card]:
+    return next((card for card in board.hand if card.lower() == name.lower()), None)
+
+def next_decision_point(state: game_state.GameState, at_step_start: bool) -> Optional[TurnStep]:
+    """The next step of this turn where the active player will have something to do after everyone passes with an empty stack.
+    `at_step_start` means nothing has happened in the current step yet, in particular no attackers have been declared."""
+    step = state.turn_step
+    if step in (TurnStep.UNTAP, TurnStep.UPKEEP, TurnStep.DRAW):
+        return TurnStep.MAIN_1
+    if step in (TurnStep.MAIN_1, TurnStep.BEGIN_COMBAT):
+        active_board = state.player_boards[state.active_player_index]
+        if active_board.creatures_able_to_attack():
+            return TurnStep.DECLARE_ATTACKERS
+        return TurnStep.MAIN_2
+    if step == TurnStep.DECLARE_ATTACKERS and at_step_start:
+        # passing before declaring attackers means not attacking. Once attackers are declared, blocks and damage are up to the judge
+        return TurnStep.MAIN_2
+    return None
+
+def resolve_pass(state: game_state.GameState, player_index: int, end_turn: bool, at_step_start: bool = False) -> Optional[LocalResolution]:
+    if player_index != state.active_player_index or not board_is_quiet(state):
+        return None
+    active_board = state.player_boards[state.active_player_index]
+    # before the draw step, the active player still draws this turn
+    draws_this_turn = 1 if state.turn_step in (TurnStep.UNTAP, TurnStep.UPKEEP) else 0
+    if draws_this_turn and not active_board.library:
+        return None  # drawing from an empty library loses the game
+    next_turn = end_turn or state.turn_step in (TurnStep.MAIN_2, TurnStep.END, TurnStep.CLEANUP)
+    if not next_turn:
+        target_step = next_decision_point(state, at_step_start)
+        if target_step is None:
+            return None
+        return LocalResolution(code=f"game_state.advance_to_step_simple(TurnStep.{target_step.name})", priority_player=state.active_player_index)
+    next_active_player = (state.active_player_index + 1) % len(state.player_boards)
+    if len(active_board.hand) + draws_this_turn > 7:
+        return None  # discarding to hand size needs a choice
+    if not state.player_boards[next_active_player].library:
+        return None  # drawing from an empty library loses the game
+    # going through cleanup first, because advance_to_step_simple(MAIN_1) from this turn's first main phase or earlier would stop in this turn
+    return LocalResolution(code="game_state.advance_to_step_simple(TurnStep.CLEANUP)\ngame_state.advance_to_step_simple(TurnStep.MAIN_1)", priority_player=next_active_player)
+
+def resolve_play_land(state: game_state.GameState, player_index: int, name: str) -> Optional[LocalResolution]:
+    board = state.player_boards[player_index]
+    card = find_in_hand(board, name)
+    if card is None or not is_basic_land(game_state.get_card_info(card)) or played_land_this_turn(board):
+        return None
+    return LocalResolution(
+        code=f"game_state.player_boards[{player_index}].remove_card_from_hand({card!r})\ngame_state.add_card_to_battlefield({player_index}, {card!r})",
+        priority_player=player_index,
+    )
+
+def resolve_cast_creature(state: game_state.GameState, player_index: int, name: str) -> Optional[LocalResolution]:
+    board = state.player_boards[player_index]
+    card = find_in_hand(board, name)
+    if card is None:
+        return None
+    card_info = game_state.get_card_info(card)
+    if card_info.get("types") != ["Creature"] or not is_vanilla(card_info):
+        return None
+    payment = pay_with_basic_lands(board, card_info.get("manaCost", ""))
+    if payment is None:
+        return None
+    return LocalResolution(
+        code=f"game_state.player_boards[{player_index}].tap_permanents({payment!r})\ngame_state.player_boards[{player_index}].remove_card_from_hand({card!r})\ngame_state.add_card_to_battlefield({player_index}, {card!r})",
+        priority_player=player_index,
+    )
+
+def resolve_action(state: game_state.GameState, player_index: int, action: str, at_step_start: bool = False) -> Optional[LocalResolution]:
+    """Handle "Pass", "End turn", "Play <basic land>" and "Cast <vanilla creature>" when they are clearly legal and
+    nothing on the board could react to them. Returns None for anything else, including actions that may be illegal.
+    `player_index` is the player with priority. Pass at_step_start=True only if no action has been taken in the current step yet."""
+    action = normalize_action(action)
+    if pass_pattern.match(action):
+        return resolve_pass(state, player_index, end_turn=False, at_step_start=at_step_start)
+    if end_turn_pattern.match(action):
+        return resolve_pass(state, player_index, end_turn=True, at_step_start=at_step_start)
+    sorcery_speed = (not state.stack and player_index == state.active_player_index
+                     and state.turn_step in (TurnStep.MAIN_1, TurnStep.MAIN_2) and board_is_quiet(state))
+    if not sorcery_speed:
+        return None
+    if match := play_land_pattern.match(action):
+        return resolve_play_land(state, player_index, match.group("card"))
+    if match := cast_pattern.match(action):
+        return resolve_cast_creature(state, player_index, match.group("card"))
+    return None
+
+def is_supported_card(card_info: game_state.CardInfo) -> bool:
+    "Cards analyze_state understands completely: basic lands and vanilla creatures with simple mana costs."
+    if is_basic_land(card_info):
+        return True
+    return card_info.get("types") == ["Creature"] and is_vanilla(card_info) and parse_mana_cost(card_info.get("manaCost", "")) is not None
+
+def format_mana(mana: dict[str, int]) -> str:
+    symbols = "".join(f"{{{color}}}" * count for color, count in mana.items())
+    return f"{symbols} ({sum(mana.values())} total)" if symbols else "None"
+
+def analyze_state(state: game_state.GameState, priority_player: int, at_step_start: bool = False) -> Optional[dict]:
+    """Enumerate the legal actions of `priority_player` in a main phase, or at the start of the declare attackers step, in
+    the same form as the judge's extract_state_info tool. Pass at_step_start=True only if no action has been taken in the
+    current step yet. Returns None if anyone but the active player has priority, attackers may have been declared already,
+    or anything on the board or in hand is unsupported, so the judge should analyze instead."""
+    if state.stack or state.lasting_effects or state.turn_step not in (TurnStep.MAIN_1, TurnStep.MAIN_2, TurnStep.DECLARE_ATTACKERS):
+        return None
+    if priority_player != state.active_player_index:
+        return None
+    if state.turn_step == TurnStep.DECLARE_ATTACKERS and not at_step_start:
+        return None
+    if any(board.life <= 0 or board.counters for board in state.player_boards):
+        return None
+    if not board_is_quiet(state):
+        return None
+    for board in state.player_boards:
+        if not all(is_supported_card(game_state.get_card_info(battlefield_card.card)) for battlefield_card in board.battlefield.values()):
+            return None
+    player_index = priority_player
+    board = state.player_boards[player_index]
+    if not all(is_supported_card(game_state.get_card_info(card)) for card in board.hand):
+        return None
+
+    attackers = [battlefield_card for battlefield_card in board.battlefield_sorted if battlefield_card.can_attack()]
+    attacker_list = ", ".join(f"{battlefield_card.card} (battlefield id {battlefield_card.battlefield_id})" for battlefield_card in attackers)
+    actions = []
+    if state.turn_step == TurnStep.DECLARE_ATTACKERS:
+        if attackers:
+            actions.append(f"Attack with any combination of: {attacker_list}")
+        actions.append("Pass (don't attack)")
+    else:
+        if not played_land_this_turn(board):
+            actions.extend(f"Play {card}" for card in sorted(set(card for card in board.hand if is_basic_land(game_state.get_card_info(card)))))
+        for card in sorted(set(board.hand), key=game_state.sort_key):
+            card_info = game_state.get_card_info(card)
+            if not is_basic_land(card_info) and pay_with_basic_lands(board, card_info.get("manaCost", "")) is not None:
+                actions.append(f"Cast {card} ({card_info.get('manaCost', '')})")
+        if state.turn_step == TurnStep.MAIN_2:
+            actions.append("Pass (end turn)")
+        elif attackers:
+            actions.append(f"Pass (move to combat, where you can attack with: {attacker_list})")
+            actions.append("End turn")
+        else:
+            actions.append("Pass (no creatures can attack, so this moves to your second main phase)")
+            actions.append("End turn")
+    return {
+        "reasoning": "Enumerated locally: the board only has basic lands and vanilla creatures.",
+        "priority_player": player_index,
+        "priority_player_revealed_information": "",
+        "priority_player_available_mana": format_mana(prompting.calculate_available_mana(board)),
+        "priority_player_available_actions": "\n".join(f"- {action}" for action in actions),
+        "winner": None,
+    }
@@ -1,11 +1,19 @@
-import anthropic
 import os
 import json
+import copy
 from datetime import datetime
 import trio
 import random
 import hashlib
+import sqlite3
 import anyio
+import contextvars
+import llm_cache
+import log_writer
+import hedging
+import llm_backends
+import metrics
+import scheduler
 
 logging_dir = 'logs'
 cache_dir = 'cache'
@@ -14,79 +22,173 @@ os.makedirs(f"{logging_dir}/generations", exist_ok=True)
 os.makedirs(f"{logging_dir}/games", exist_ok=True)
 os.makedirs(cache_dir, exist_ok=True)
 
-os.makedirs("database", exist_ok=True)
-os.makedirs("database/finished_games", exist_ok=True)
-os.makedirs("database/ongoing_games", exist_ok=True)
-
-anthropic_client = anthropic.AsyncAnthropic(max_retries=5)
+cache_max_bytes = 2 * 1024**3
+response_cache = llm_cache.ResponseCache(os.path.join(cache_dir, "responses.sqlite"), max_bytes=cache_max_bytes, legacy_dir=cache_dir)
 
 prices = {
     "claude-sonnet-4-20250514": {"input": 3/1_000_000, "output": 15/1_000_000},
-    "claude-opus-4-20250514": {"input": 15/1_000_000, "output": 75/1_000_000}
+    "claude-opus-4-20250514": {"input": 15/1_000_000, "output": 75/1_000_000},
+    "claude-3-5-haiku-20241022": {"input": 0.8/1_000_000, "output": 4/1_000_000}
 }
 
+# prompt cache writes cost 25% more than normal input tokens, reads cost 10% of normal input tokens
+cache_write_price_multiplier = 1.25
+cache_read_price_multiplier = 0.1
+
+def usage_cost(model: str, usage: dict) -> float:
+    price = prices.get(model, {"input": 0, "output": 0})
+    return (usage["prompt_tokens"] * price["input"]
+            + usage.get("cache_creation_tokens", 0) * price["input"] * cache_write_price_multiplier
+            + usage.get("cache_read_tokens", 0) * price["input"] * cache_read_price_multiplier
+            + usage["completion_tokens"] * price["output"])
+
+def estimate_call_cost(kwargs: dict) -> float:
+    "Cost of a call before it's made, assuming no prompt cache hits and a typical response length."
+    price = prices.get(kwargs["model"], {"input": 0, "output": 0})
+    output_tokens = min(kwargs.get("max_tokens", scheduler.reserved_output_tokens), scheduler.reserved_output_tokens)
+    return llm_backends.estimate_input_tokens(kwargs) * price["input"] + output_tokens * price["output"]
+
+def charge_cost_meters(cost: float):
+    meter = current_cost_meter.get()
+    while meter is not None:
+        meter.cost += cost
+        meter = meter.parent
+
+class CostMeter:
+    "Accumulates the cost of the LLM calls made while it's set as current_cost_meter, and adds it to `parent` too."
+    def __init__(self, parent: "CostMeter | None" = None):
+        self.cost = 0.0
+        self.parent = parent
+
+# context local, so setting it inside a task only meters that task's calls
+current_cost_meter: contextvars.ContextVar[CostMeter | None] = contextvars.ContextVar("current_cost_meter", default=None)
+# set by GameMaster, so usage can be attributed to games
+current_game_id: contextvars.ContextVar[str | None] = contextvars.ContextVar("current_game_id", default=None)
+
+# scheduler priority class of calls made in this context, see scheduler.priority_classes. Calls can also pass priority=
+current_priority: contextvars.ContextVar[str | None] = contextvars.ContextVar("current_priority", default=None)
+
+writer = log_writer.LogWriter(f"{logging_dir}/generations", f"{logging_dir}/total_usage.json", f"{logging_dir}/game_usage.json")
+
 total_input_tokens = 0
 total_output_tokens = 0
 
+class InFlightRequest:
+    def __init__(self):
+        self.done = anyio.Event()
+        self.response = None
+
+# requests currently being sent, by cache key, so identical concurrent requests share one call
+in_flight_requests: dict[str, InFlightRequest] = {}
+
 async def llm_generate(**kwargs):
-    global total_input_tokens, total_output_tokens
-    model = kwargs["model"]
     no_cache = kwargs.pop("no_cache", False)
+    # called with each piece of response text as it's generated
+    on_text = kwargs.pop("on_text", None)
+    priority = kwargs.pop("priority", None) or current_priority.get()
+    hedge = kwargs.pop("hedge", hedging.hedging_enabled)
+    # Independent samples of the same request are cached separately
+    sample_index = kwargs.pop("sample_index", 0)
+    # Concurrent requests with the same cache key share one call, sampled ones included, since independent samples have
+    # their own sample_index and so their own key. Pass coalesce=False to make a separate call anyway
+    coalesce = kwargs.pop("coalesce", True)
     # Check cache first
-    cache_key = _get_cache_key(kwargs)
+    cache_key = _get_cache_key(kwargs, sample_index)
+    no_cache = no_cache or not get_backend().cacheable
     if not no_cache:
-        cached_response = _load_from_cache(cache_key)
+        cached_response = await _load_from_cache(cache_key)
         if cached_response:
             print(f"Cache hit for request {cache_key[:8]}...")
+            metrics.add(cache_hits=1)
+            await emit_response_text(on_text, cached_response)
             return cached_response
+    if not coalesce:
+        return await _generate(kwargs, cache_key, sample_index, priority, hedge, on_text)
     
-    if "claude" in model:
-        if 'max_tokens' not in kwargs:
-            kwargs['max_tokens'] = 8192
-
-        response = await anthropic_client.messages.create(**kwargs)
-        usage = {
-            "prompt_tokens": response.usage.input_tokens,
-            "completion_tokens": response.usage.output_tokens
-        }
-        response_data = response.model_dump()
-    else:
-        raise ValueError(f"Unsupported model: {model}")
+    while (in_flight := in_flight_requests.get(cache_key)) is not None:
+        await in_flight.done.wait()
+        if in_flight.response is not None:
+            print(f"Shared in flight response for request {cache_key[:8]}...")
+            metrics.add(cache_hits=1)
+            await emit_response_text(on_text, in_flight.response)
+            return copy.deepcopy(in_flight.response)
+        # the shared call failed or was cancelled, so make our own
+    in_flight = InFlightRequest()
+    in_flight_requests[cache_key] = in_flight
+    try:
+        in_flight.response = await _generate(kwargs, cache_key, sample_index, priority, hedge, on_text)
+        return in_flight.response
+    finally:
+        del in_flight_requests[cache_key]
+        in_flight.done.set()
+
+# answers requests that aren't cached, see llm_backends. Chosen from MTG_LLM_BACKEND on first use unless set
+backend: llm_backends.LLMBackend | None = None
+
+def get_backend() -> llm_backends.LLMBackend:
+    global backend
+    if backend is None:
+        backend = llm_backends.backend_from_env(_get_cache_key, response_cache)
+    return backend
+
+async def emit_response_text(on_text, response_data):
+    "Pass the text of a response that wasn't streamed to on_text in one piece."
+    if on_text is None:
+        return
+    text = "".join(block.get("text", "") for block in response_data.get("content", []) if block.get("type") == "text")
+    if text:
+        await on_text(text)
+
+async def _generate(kwargs, cache_key, sample_index=0, priority=None, hedge=False, on_text=None):
+    global total_input_tokens, total_output_tokens
+    model = kwargs["model"]
+    current_backend = get_backend()
+    # cost meters are charged an estimate up front and settled when the call finishes, so a call that gets cancelled,
+    # eg by a speculation that's thrown away, still counts
+    estimated_cost = estimate_call_cost(kwargs) if current_backend.billed and current_cost_meter.get() is not None else 0.0
+    charge_cost_meters(estimated_cost)
+    try:
+        response_data, usage = await current_backend.create(kwargs, cache_key, priority, hedge, on_text)
+    except Exception:
+        charge_cost_meters(-estimated_cost)
+        raise
+    if not current_backend.streams_text:
+        await emit_response_text(on_text, response_data)
 
     # Save to cache
-    _save_to_cache(cache_key, response_data)
+    if current_backend.cacheable:
+        _save_to_cache(cache_key, response_data)
 
-    # Success - log and return
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    log_data = {
+    writer.log_generation({
+        "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S_%f"),
+        "game_id": current_game_id.get(),
+        "backend": current_backend.name,
+        "sample_index": sample_index,
         "request": kwargs,
         "response": response_data
-    }
-    
-    with open(f"{logging_dir}/generations/{timestamp}.json", "w") as f:
-        json.dump(log_data, f, indent=4)
+    })
 
     total_input_tokens += usage["prompt_tokens"]
     total_output_tokens += usage["completion_tokens"]
+    if usage["cache_creation_tokens"] or usage["cache_read_tokens"]:
+        print(f"Prompt cache: {usage['cache_read_tokens']} tokens read, {usage['cache_creation_tokens']} tokens written, {usage['prompt_tokens']} uncached")
     
-    usage_path = f"{logging_dir}/total_usage.json"
-    try:
-        with open(usage_path) as f:
-            usage_data = json.load(f)
-    except FileNotFoundError:
-        usage_data = {"input": 0, "output": 0, "total": 0, "cost": 0}
-        
-    usage_data["input"] += usage["prompt_tokens"]
-    usage_data["output"] += usage["completion_tokens"]
-    usage_data["total"] = usage_data["input"] + usage_data["output"]
-    usage_data["cost"] += usage["prompt_tokens"] * prices[model]["input"] + usage["completion_tokens"] * prices[model]["output"]
-    
-    with open(usage_path, "w") as f:
-        json.dump(usage_data, f)
+    cost = usage_cost(model, usage)
+    metrics.record_llm_call(usage, cost)
+    charge_cost_meters(cost - estimated_cost)
+    writer.record_usage(model, current_game_id.get(), {
+        "input": usage["prompt_tokens"],
+        "output": usage["completion_tokens"],
+        "cache_creation_input": usage["cache_creation_tokens"],
+        "cache_read_input": usage["cache_read_tokens"],
+        "total": usage["prompt_tokens"] + usage["completion_tokens"],
+        "cost": cost,
+        "requests": 1,
+    })
     
     return response_data
 
-def _get_cache_key(kwargs):
+def _get_cache_key(kwargs, sample_index=0):
     """Generate a cache key from the request parameters."""
     # Create a deterministic hash of the request
     cache_data = {
@@ -98,34 +200,23 @@ def _get_cache_key(kwargs):
         'tools': kwargs.get('tools'),
         'tool_choice': kwargs.get('tool_choice')
     }
+    if sample_index:
+        cache_data['sample_index'] = sample_index
     cache_str = json.dumps(cache_data, sort_keys=True)
     return hashlib.sha256(cache_str.encode()).hexdigest()
 
-def _load_from_cache(cache_key):
-    """Load response from disk cache if it exists."""
-    cache_file = os.path.join(cache_dir, f"{cache_key}.json")
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            return None
-    return None
+async def _load_from_cache(cache_key):
+    """Load response from the response cache if it exists. The SQLite read, and moving in a legacy json file, run in a worker thread."""
+    try:
+        return await anyio.to_thread.run_sync(response_cache.get, cache_key)
+    except sqlite3.Error:
+        return None
 
 def _save_to_cache(cache_key, response_data):
-    """Save response to disk cache."""
-    cache_file = os.path.join(cache_dir, f"{cache_key}.json")
-    try:
-        with open(cache_file, 'w') as f:
-            json.dump(response_data, f, indent=2)
-    except IOError:
-        pass  # Silently fail if we can't write to cache
-
-def save_game(id:str, game_state):
-    with open(f"database/ongoing_games/{id}.json", "w") as f:
-        json.dump(game_state.model_dump(), f)
-
-def finish_game(id:str):
-    src_path = f"database/ongoing_games/{id}.json"
-    dst_path = f"database/finished_games/{id}.json"
-    os.rename(src_path, dst_path)
\ No newline at end of file
+    """Save response to the response cache from the log writer thread."""
+    def save():
+        try:
+            response_cache.put(cache_key, response_data)
+        except sqlite3.Error:
+            pass  # Silently fail if we can't write to cache
+    writer.call_soon(save)
@@ -0,0 +1,160 @@
+import atexit
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+def empty_usage() -> dict[str, float]:
+    return {"input": 0, "output": 0, "cache_creation_input": 0, "cache_read_input": 0, "total": 0, "cost": 0, "requests": 0}
+
+def add_usage(total: dict[str, float], usage: dict[str, float]):
+    for name, value in usage.items():
+        total[name] = total.get(name, 0) + value
+
+class LogWriter:
+    """Writes generation logs and usage totals on a background thread, so the event loop only ever puts on a queue.
+    Generation logs go to gzipped jsonl segments in `generations_dir`, a new segment every `segment_max_records` records.
+    Usage is added up in memory per model and per game and merged into `usage_path` and `game_usage_path` every
+    `flush_interval_seconds`. Merging is done under a file lock, so concurrent processes don't lose each other's updates."""
+
+    def __init__(self, generations_dir: str, usage_path: str, game_usage_path: str, segment_max_records: int = 1000, flush_interval_seconds: float = 5.0):
+        self.generations_dir = generations_dir
+        self.usage_path = usage_path
+        self.game_usage_path = game_usage_path
+        self.segment_max_records = segment_max_records
+        self.flush_interval_seconds = flush_interval_seconds
+        # usage since the process started, for reporting
+        self.usage_by_model: dict[str, dict[str, float]] = {}
+        self.usage_by_game: dict[str, dict[str, float]] = {}
+        # usage not yet merged into the usage files
+        self._unflushed_by_model: dict[str, dict[str, float]] = {}
+        self._unflushed_by_game: dict[str, dict[str, float]] = {}
+        self._usage_lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._segment = None
+        self._segment_records = 0
+        self._segment_index = 0
+        self._segment_prefix = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def log_generation(self, record: dict[str, Any]):
+        self._ensure_started()
+        self._queue.put(("generation", record))
+
+    def call_soon(self, function: Callable[[], None]):
+        "Run `function` on the writer thread, eg to store a cache entry."
+        self._ensure_started()
+        self._queue.put(("call", function))
+
+    def record_usage(self, model: str, game_id: Optional[str], usage: dict[str, float]):
+        self._ensure_started()
+        with self._usage_lock:
+            for totals, key in ((self.usage_by_model, model), (self._unflushed_by_model, model)):
+                add_usage(totals.setdefault(key, empty_usage()), usage)
+            if game_id is not None:
+                for totals in (self.usage_by_game, self._unflushed_by_game):
+                    add_usage(totals.setdefault(game_id, empty_usage()), usage)
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval_seconds
+        running = True
+        while running:
+            items = []
+            try:
+                items.append(self._queue.get(timeout=max(0.0, next_flush - time.monotonic())))
+                while True:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            for item in items:
+                if item is None:
+                    running = False
+                elif item[0] == "generation":
+                    self._write_generation(item[1])
+                else:
+                    try:
+                        item[1]()
+                    except Exception as e:
+                        print(f"log writer: {e}")
+            if self._segment is not None:
+                self._segment.flush()
+            if not running or time.monotonic() >= next_flush:
+                self._flush_usage()
+                next_flush = time.monotonic() + self.flush_interval_seconds
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    def _write_generation(self, record: dict[str, Any]):
+        if self._segment is None or self._segment_records >= self.segment_max_records:
+            if self._segment is not None:
+                self._segment.close()
+            path = os.path.join(self.generations_dir, f"{self._segment_prefix}_{self._segment_index:04d}.jsonl.gz")
+            self._segment = gzip.open(path, "at")
+            self._segment_index += 1
+            self._segment_records = 0
+        self._segment.write(json.dumps(record, default=str) + "\n")
+        self._segment_records += 1
+
+    def _flush_usage(self):
+        with self._usage_lock:
+            by_model, self._unflushed_by_model = self._unflushed_by_model, {}
+            by_game, self._unflushed_by_game = self._unflushed_by_game, {}
+        try:
+            if by_model:
+                def merge_totals(data):
+                    data.setdefault("by_model", {})
+                    for model, usage in by_model.items():
+                        add_usage(data, {name: value for name, value in usage.items() if name != "requests"})
+                        add_usage(data["by_model"].setdefault(model, empty_usage()), usage)
+                self._merge_into(self.usage_path, merge_totals)
+            if by_game:
+                def merge_games(data):
+                    for game_id, usage in by_game.items():
+                        add_usage(data.setdefault(game_id, empty_usage()), usage)
+                self._merge_into(self.game_usage_path, merge_games)
+        except OSError as e:
+            print(f"log writer: failed to save usage: {e}")
+
+    def _merge_into(self, path: str, merge: Callable[[dict], None]):
+        with open(path, "a+") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            text = f.read()
+            try:
+                data = json.loads(text) if text else {}
+            except json.JSONDecodeError as e:
+                # keep the corrupt totals for inspection instead of silently starting over. They're copied rather than
+                # renamed, so processes already waiting on this file's lock don't end up merging into the moved one
+                corrupt_path = f"{path}.corrupt-{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+                with open(corrupt_path, "w") as corrupt_file:
+                    corrupt_file.write(text)
+                print(f"log writer: {path} is not valid json ({e}), moved its contents to {corrupt_path} and started new totals")
+                data = {}
+            merge(data)
+            f.seek(0)
+            f.truncate()
+            json.dump(data, f)
+            f.flush()
+
+    def close(self):
+        "Write everything still queued. Called automatically at exit."
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
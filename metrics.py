@@ -0,0 +1,174 @@
+"""Spans around game steps, judge phases, agent actions and code execution. A span records its duration plus the tokens,
+cost, cache hits and retries of everything inside it. Finished spans are aggregated into histograms served in Prometheus
+format (see render_prometheus) and kept per game for a Chrome trace (see write_chrome_trace)."""
+import anyio
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Optional
+
+traces_dir = "logs/traces"
+os.makedirs(traces_dir, exist_ok=True)
+
+# seconds
+duration_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+counter_names = ("llm_calls", "input_tokens", "output_tokens", "cache_read_tokens", "cache_creation_tokens", "cost_dollars", "cache_hits", "retries", "errors")
+# trace events kept per game before the oldest are dropped
+max_trace_events = 100_000
+
+class Span:
+    def __init__(self, name: str, game_id: Optional[str], parent: Optional["Span"], attributes: dict[str, Any]):
+        self.name = name
+        self.game_id = game_id
+        self.parent = parent
+        self.attributes = attributes
+        self.counters: dict[str, float] = {}
+        self.start = time.time()
+        self.duration = 0.0
+
+    def add(self, **counters: float):
+        "Add to this span's counters and its ancestors'."
+        span = self
+        while span is not None:
+            for name, value in counters.items():
+                span.counters[name] = span.counters.get(name, 0) + value
+            span = span.parent
+
+current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+class Histogram:
+    def __init__(self):
+        self.bucket_counts = [0] * len(duration_buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(duration_buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+
+class SpanAggregate:
+    def __init__(self):
+        self.duration = Histogram()
+        self.counters: dict[str, float] = {}
+
+aggregates: dict[str, SpanAggregate] = {}
+traces: dict[str, list[dict]] = {}
+_lock = threading.Lock()
+
+def _thread_id() -> int:
+    "Chrome trace thread of the current task, so spans of concurrent tasks don't have to nest."
+    try:
+        return anyio.get_current_task().id
+    except Exception:
+        return threading.get_ident()
+
+@contextmanager
+def span(name: str, game_id: Optional[str] = None, **attributes: Any):
+    "Time the block as a child of the current span. `game_id` defaults to the parent's."
+    parent = current_span.get()
+    if game_id is None and parent is not None:
+        game_id = parent.game_id
+    new_span = Span(name, game_id, parent, attributes)
+    token = current_span.set(new_span)
+    start = time.monotonic()
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        new_span.duration = time.monotonic() - start
+        current_span.reset(token)
+        _finish(new_span)
+
+def traced(name: str):
+    "Decorator that runs an async function in a span called `name`."
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _finish(finished: Span):
+    with _lock:
+        aggregate = aggregates.setdefault(finished.name, SpanAggregate())
+        aggregate.duration.observe(finished.duration)
+        for name, value in finished.counters.items():
+            aggregate.counters[name] = aggregate.counters.get(name, 0) + value
+        if finished.game_id is not None:
+            events = traces.setdefault(finished.game_id, [])
+            if len(events) >= max_trace_events:
+                del events[:len(events) // 10]
+            events.append({
+                "name": finished.name,
+                "ph": "X",
+                "ts": finished.start * 1_000_000,
+                "dur": finished.duration * 1_000_000,
+                "pid": 0,
+                "tid": _thread_id(),
+                "args": {**finished.attributes, **finished.counters},
+            })
+
+def add(**counters: float):
+    "Add to the counters of the current span and its ancestors. Does nothing outside a span."
+    current = current_span.get()
+    if current is not None:
+        current.add(**counters)
+
+def record_llm_call(usage: dict, cost: float):
+    add(
+        llm_calls=1,
+        input_tokens=usage["prompt_tokens"],
+        output_tokens=usage["completion_tokens"],
+        cache_read_tokens=usage["cache_read_tokens"],
+        cache_creation_tokens=usage["cache_creation_tokens"],
+        cost_dollars=cost,
+    )
+
+def chrome_trace(game_id: str) -> dict:
+    with _lock:
+        events = list(traces.get(game_id, []))
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+def write_chrome_trace(game_id: str) -> Optional[str]:
+    "Save the game's spans to traces_dir for chrome://tracing or Perfetto and stop keeping them in memory."
+    if game_id not in traces:
+        return None
+    path = os.path.join(traces_dir, f"{game_id}.json")
+    with open(path, "w") as f:
+        json.dump(chrome_trace(game_id), f)
+    with _lock:
+        traces.pop(game_id, None)
+    return path
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+def render_prometheus() -> str:
+    "Span duration histograms and counters in the Prometheus text format."
+    with _lock:
+        snapshot = [(name, aggregate.duration.bucket_counts[:], aggregate.duration.count, aggregate.duration.sum, dict(aggregate.counters))
+                    for name, aggregate in sorted(aggregates.items())]
+    lines = ["# HELP mtg_llm_span_duration_seconds Wall clock time of spans.", "# TYPE mtg_llm_span_duration_seconds histogram"]
+    for name, bucket_counts, count, total, _ in snapshot:
+        for bound, bucket_count in zip(duration_buckets, bucket_counts):
+            lines.append(f'mtg_llm_span_duration_seconds_bucket{{span="{_label(name)}",le="{bound}"}} {bucket_count}')
+        lines.append(f'mtg_llm_span_duration_seconds_bucket{{span="{_label(name)}",le="+Inf"}} {count}')
+        lines.append(f'mtg_llm_span_duration_seconds_sum{{span="{_label(name)}"}} {total}')
+        lines.append(f'mtg_llm_span_duration_seconds_count{{span="{_label(name)}"}} {count}')
+    for counter in counter_names:
+        metric = f"mtg_llm_span_{counter}_total"
+        lines.append(f"# HELP {metric} {counter.replace('_', ' ').capitalize()} inside spans, including nested spans.")
+        lines.append(f"# TYPE {metric} counter")
+        for name, _, _, _, counters in snapshot:
+            lines.append(f'{metric}{{span="{_label(name)}"}} {counters.get(counter, 0)}')
+    return "\n".join(lines) + "\n"
@@ -1,6 +1,6 @@
 import styled from '@emotion/styled';
 import { PlayerBoard } from './components/PlayerBoard';
-import { GameMaster } from './types';
+import { GameMaster, GameEvent, EventFrame } from './types';
 import { useState, useEffect, useRef } from 'react';
 import { GameHistory } from './components/GameHistory';
 import { CodeHistory } from './components/CodeHistory';
@@ -21,6 +21,43 @@ const GamePanel = styled.div`
   overflow-y: auto;
 `;
 
+const LiveActivityBox = styled.div`
+  margin: 10px;
+  padding: 8px;
+  border: 1px solid #ccc;
+  border-radius: 4px;
+  font-size: 0.9em;
+`;
+
+const LiveText = styled.pre`
+  max-height: 150px;
+  overflow-y: auto;
+  white-space: pre-wrap;
+  margin: 4px 0 0 0;
+`;
+
+interface LiveActivity {
+  status: string;
+  text: string;
+}
+
+const judgePhaseLabels: Record<string, string> = {
+  validating_action: 'Judge is validating the action',
+  advancing_to_priority: 'Judge is advancing to the next priority',
+  analyzing_state: 'Judge is analyzing the game state',
+};
+
+const applyGameEvent = (activity: LiveActivity, event: GameEvent): LiveActivity => {
+  switch (event.type) {
+    case 'judge_phase':
+      return { status: judgePhaseLabels[event.phase] ?? event.phase, text: event.action ?? '' };
+    case 'agent_thinking':
+      return { status: `Player ${event.player_index} is thinking`, text: '' };
+    case 'agent_text':
+      return { status: `Player ${event.player_index} is thinking`, text: activity.text + event.text };
+  }
+};
+
 
 const HomePage = () => {
   const navigate = useNavigate();
@@ -68,6 +105,7 @@ const GameView = ({ viewOnly }: { viewOnly: boolean }) => {
   const { gameId } = useParams();
   // ... existing game state logic ...
   const [gameMaster, setGameMaster] = useState<GameMaster | null>(null);
+  const [liveActivity, setLiveActivity] = useState<LiveActivity>({ status: '', text: '' });
   const wsRef = useRef<WebSocket | null>(null);
 
   useEffect(() => {
@@ -82,8 +120,14 @@ const GameView = ({ viewOnly }: { viewOnly: boolean }) => {
 
     ws.onmessage = (event) => {
       if (wsRef.current === ws) {
-        const newGameMaster = JSON.parse(event.data);
-        setGameMaster(newGameMaster);
+        const data = JSON.parse(event.data);
+        if (data.type === 'event') {
+          const gameEvent = (data as EventFrame).event;
+          setLiveActivity(activity => applyGameEvent(activity, gameEvent));
+        } else {
+          setGameMaster(data as GameMaster);
+          setLiveActivity({ status: '', text: '' });
+        }
       } else {
         ws.close();
         }
@@ -104,6 +148,12 @@ const GameView = ({ viewOnly }: { viewOnly: boolean }) => {
       <CodeHistory codeHistory={gameMaster.used_python_code} errorHistory={gameMaster.error_messages} />
 
       <GamePanel>
+        {liveActivity.status && (
+          <LiveActivityBox>
+            <strong>{liveActivity.status}</strong>
+            {liveActivity.text && <LiveText>{liveActivity.text}</LiveText>}
+          </LiveActivityBox>
+        )}
         <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', gap: '20px', marginBottom: '10px', marginLeft: '10px', marginRight: '10px' }}>
           <div>
             <p>Library: {gameMaster.game_state.player_boards[0].library.length}</p>
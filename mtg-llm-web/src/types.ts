@@ -69,12 +69,22 @@ export interface GameState {
   turn_number: number;
 }
 
+// past game states of a saved game: only every keyframe_interval-th state, and states the judge code can't
+// reproduce, are stored in full. The others are rebuilt on the server by replaying used_python_code
+export interface GameHistory {
+  keyframe_interval: number;
+  keyframes: Record<number, GameState>;
+  code_indices: number[];
+  fingerprints: string[];
+}
+
 export interface GameMaster {
   game_state: GameState;
   agents: AgentInterface[];
   generation_settings: Record<string, any>;
   step_callback?: () => void;
-  past_game_states: GameState[];
+  // the websocket sends the last few states as a list, /get_game sends the stored history
+  past_game_states: GameState[] | GameHistory;
   player_observation_histories: HistoryStep[][];
   priority_player: number;
   player_action: string;
@@ -93,4 +103,13 @@ export interface AgentInterface {
     available_actions: string,
     rules_violation_feedback?: string
   ) => Promise<string>;
-}
\ No newline at end of file
+}
+export type GameEvent =
+  | { type: "judge_phase"; phase: "validating_action" | "advancing_to_priority" | "analyzing_state"; player_index?: number; action?: string }
+  | { type: "agent_thinking"; player_index: number }
+  | { type: "agent_text"; player_index: number; text: string };
+
+export interface EventFrame {
+  type: "event";
+  event: GameEvent;
+}
@@ -2,6 +2,7 @@ import json
 import os
 from pathlib import Path
 import re
+import card_store
 
     
 os.makedirs("assets/example_decks", exist_ok=True)
@@ -31,6 +32,7 @@ print(f"Pioneer legal cards: {pioneer_legal}")
 
 with open("assets/AtomicCardsGameplay.json", "w") as f:
     json.dump(atomic_cards, f, indent=4)
+card_store.write_card_store(atomic_cards['data'], "assets/AtomicCardsGameplay.cards")
 
     
 decks_dir = Path("assets/example_decks_raw")
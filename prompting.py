@@ -1,6 +1,9 @@
+import card_zones
 import game_state
 import prompts
 import re
+import os
+import json
 
 def simplify_mana_cost_fn(mana_cost:str):
     return re.sub(r'[{}]', '', mana_cost)
@@ -9,14 +12,7 @@ def calculate_available_mana(player_board: game_state.PlayerBoard) -> dict[str,
     """Calculate available mana from untapped lands on the battlefield."""
     mana = {"W": 0, "U": 0, "B": 0, "R": 0, "G": 0, "C": 0}
     
-    for battlefield_card in player_board.battlefield.values():
-        if battlefield_card.tapped:
-            continue
-            
-        card_info = game_state.get_card_info(battlefield_card.card)
-        if "Land" not in card_info.get("types", []):
-            continue
-            
+    for battlefield_card in player_board.untapped_lands():
         # Map basic land names to mana colors
         land_to_mana = {
             "Plains": "W", "Island": "U", "Swamp": "B", 
@@ -29,8 +25,70 @@ def calculate_available_mana(player_board: game_state.PlayerBoard) -> dict[str,
     
     return mana
 
+# rendered card text by (card registry id, formatting flags), along with the CardRecord it was rendered from
+card_text_cache: dict[tuple[int, bool, bool, bool], tuple[card_zones.CardRecord, str]] = {}
+# rendered text of database cards loaded from card_text_cache_path, by persisted_card_text_key
+persisted_card_texts: dict[str, str] = {}
+card_text_cache_path = "cache/card_text.json"
+# version of render_card_full's output. Bump it when the rendering changes, so text saved by older code isn't loaded
+card_text_format_version = 1
+
+def persisted_card_text_key(card_name: game_state.Card, flags: tuple[bool, bool, bool]) -> str:
+    return "".join("1" if flag else "0" for flag in flags) + card_name
+
 def format_card_full(card_name:game_state.Card, simplify_basic_lands:bool=False, simplify_mana_cost:bool=True, omit_all_reminder_text:bool=True):
-    card = game_state.get_card_info(card_name)
+    card_id = game_state.card_registry.id_of(card_name)
+    record = game_state.card_registry.record(card_id)
+    flags = (simplify_basic_lands, simplify_mana_cost, omit_all_reminder_text)
+    cached = card_text_cache.get((card_id, *flags))
+    if cached is not None and cached[0] is record:
+        return cached[1]
+    text = None if record.token_info is not None else persisted_card_texts.get(persisted_card_text_key(card_name, flags))
+    if text is None:
+        text = render_card_full(record.info, *flags)
+    card_text_cache[(card_id, *flags)] = (record, text)
+    return text
+
+def prewarm_card_text(decklists: list[game_state.DeckList]):
+    "Render every card in the decklists with the flags the game views use, so rendering views only joins cached text."
+    for decklist in decklists:
+        for card_name in [*decklist.mainboard, *decklist.sideboard]:
+            try:
+                format_card_full(card_name, simplify_basic_lands=True)
+                format_card_full(card_name)
+            except KeyError:
+                continue  # misspelled cards fail later, where the game can report them
+
+def card_database_version() -> float:
+    return max((os.path.getmtime(path) for path in (card_zones.card_database_json_path, card_zones.card_store_path) if os.path.exists(path)), default=0.0)
+
+def load_card_text_cache(path: str = card_text_cache_path) -> int:
+    "Load text rendered by an earlier process, unless the card database or the rendering changed since. Returns the number of cards loaded."
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return 0
+    if data.get("card_database_version") != card_database_version() or data.get("format_version") != card_text_format_version:
+        return 0
+    persisted_card_texts.update(data["texts"])
+    return len(data["texts"])
+
+def save_card_text_cache(path: str = card_text_cache_path):
+    "Save the rendered text of database cards, tokens are left out."
+    texts = dict(persisted_card_texts)
+    for (card_id, *flags), (record, text) in card_text_cache.items():
+        if record.token_info is None:
+            texts[persisted_card_text_key(record.name, tuple(flags))] = text
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as f:
+        json.dump({"card_database_version": card_database_version(), "format_version": card_text_format_version, "texts": texts}, f)
+    os.replace(temporary_path, path)
+
+reminder_text_pattern = re.compile(r'\([^)]*\)')
+
+def render_card_full(card: game_state.CardInfo, simplify_basic_lands:bool=False, simplify_mana_cost:bool=True, omit_all_reminder_text:bool=True) -> str:
     parts = []
     parts.append(f"Name: {card['name']}")
     if simplify_basic_lands and 'supertypes' in card and 'Basic' in card['supertypes']:
@@ -55,7 +113,7 @@ def format_card_full(card_name:game_state.Card, simplify_basic_lands:bool=False,
     if 'text' in card:
         text = card['text']
         if omit_all_reminder_text:
-            text = re.sub(r'\([^)]*\)', '', text)
+            text = reminder_text_pattern.sub('', text)
         parts.append(f"Text: {text}")
         
     stats = []
@@ -81,7 +139,7 @@ def format_battlefield_card(card:game_state.BattlefieldCard, simplify_basic_land
         battlefield_parts.append(f"Counters: {', '.join(counters)}")
     if card.tapped:
         battlefield_parts.append("Card is tapped")
-    if 'Creature' in game_state.get_card_info(card.card).get('types', []) and card.entered_battlefield_this_turn:
+    if card.entered_battlefield_this_turn and game_state.CardType.CREATURE in game_state.card_type_flags(card.card):
         battlefield_parts.append("Entered battlefield this turn")
     if judge_notes and card.judge_notes:
         battlefield_parts.append(f"Notes: {card.judge_notes}")
@@ -112,6 +170,8 @@ def format_omniscient_view(game_state:game_state.GameState, simplify_basic_lands
         parts.append(f"Graveyard ({len(player_board.graveyard)}) cards: {', '.join(player_board.graveyard)}")
         if player_board.exile:
             parts.append(f"Exile ({len(player_board.exile)}) cards: {', '.join(player_board.exile)}")
+    if game_state.lasting_effects:
+        parts.append(f"Lasting effects: {'; '.join(game_state.lasting_effects)}")
     parts.append(f"Starting player: {game_state.starting_player_index}")
     return '\n'.join(parts)
     
@@ -153,6 +213,8 @@ def format_player_view(game_state:game_state.GameState, player_index:int, reveal
         parts.append(f"Graveyard ({len(player_board.graveyard)}) cards: {', '.join(player_board.graveyard)}")
         if player_board.exile:
             parts.append(f"Exile ({len(player_board.exile)}) cards: {', '.join(player_board.exile)}")
+    if game_state.lasting_effects:
+        parts.append(f"Lasting effects: {'; '.join(game_state.lasting_effects)}")
     if revealed_information:
         parts.append(f"Revealed information: {revealed_information}")
     parts.append(f"Starting player: {game_state.starting_player_index}")
@@ -23,6 +23,6 @@ if __name__ == "__main__":
         NaiveAgent(generation_settings=generation_settings)
     ]
     game_id = str(uuid.uuid4())
-    game_master = GameMaster(game_id=game_id, game_state=game_state, agents=agents, generation_settings=generation_settings)
+    game_master = GameMaster(game_id=game_id, game_state=game_state, agents=agents, generation_settings=generation_settings, verbose=True)
     winner = anyio.run(game_master.game_loop)
     print(f"Player {winner} wins!")
\ No newline at end of file
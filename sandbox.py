@@ -0,0 +1,243 @@
+import game_state
+import anyio
+import ast
+import multiprocessing
+import io
+import os
+import pickle
+import signal
+import time
+import traceback
+from contextlib import redirect_stdout
+from typing import Any, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+cpu_timeout_seconds = 10
+wall_timeout_seconds = 20
+memory_limit_bytes = 2 * 1024**3
+# extra time the parent waits on top of the worker's own wall clock timeout before killing the worker
+hard_timeout_grace_seconds = 5
+
+class CodeTimeout(BaseException):
+    "Raised inside a worker when judge code runs out of time. BaseException so judge code's `except Exception` can't swallow it."
+
+def _raise_timeout(signum, frame):
+    kind = "CPU" if signum == signal.SIGVTALRM else "wall clock"
+    raise CodeTimeout(f"Code exceeded its {kind} time limit")
+
+def judge_globals() -> dict[str, Any]:
+    "Names judge code can use without defining them, besides builtins and `game_state`."
+    return {name: getattr(game_state, name) for name in dir(game_state) if not name.startswith('_')}
+
+def declared_globals(code: str) -> set[str]:
+    "Names `code` declares `global`, which judge code does to keep a variable for later code."
+    return {name for node in ast.walk(ast.parse(code)) if isinstance(node, ast.Global) for name in node.names}
+
+def run_code(code: str, state: game_state.GameState, persistent_vars: dict[str, Any]) -> tuple[bool, str]:
+    """Execute judge code against `state` in the current process. `state` and `persistent_vars` are modified in place.
+    Variables the code defines are discarded afterwards, except those it declares `global`, which are kept in `persistent_vars` along with the ones it already held."""
+    f = io.StringIO()
+    namespace = {**judge_globals(), **persistent_vars, 'game_state': state}
+    try:
+        kept = set(persistent_vars) | declared_globals(code)
+        with redirect_stdout(f):
+            exec(code, namespace)
+    except Exception:
+        return False, traceback.format_exc()
+    persistent_vars.clear()
+    persistent_vars.update({name: namespace[name] for name in kept if name in namespace})
+    return True, f.getvalue()
+
+def picklable_vars(persistent_vars: dict[str, Any]) -> dict[str, Any]:
+    "Variables judge code kept that can be carried over to the next execution. Functions, modules etc are dropped."
+    result = {}
+    for name, value in persistent_vars.items():
+        try:
+            pickle.dumps(value)
+        except Exception:
+            continue
+        result[name] = value
+    return result
+
+def sync_token_card_infos(tokens: dict[str, game_state.CardInfo]):
+    "Make this process's registered tokens exactly `tokens`, so tokens from other games or discarded candidates don't leak between calls."
+    for name in list(game_state.registered_tokens):
+        if name not in tokens:
+            del game_state.registered_tokens[name]
+            game_state.card_database['data'].pop(name, None)
+    for name, info in tokens.items():
+        game_state.registered_tokens[name] = info
+        game_state.card_database['data'][name] = info
+
+def _init_worker(memory_limit: int):
+    if resource is not None:
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        except (ValueError, OSError):
+            print("sandbox: could not set memory limit for worker")
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.signal(signal.SIGVTALRM, _raise_timeout)
+
+def _worker_run(code: str, state_json: str, persistent_vars: dict[str, Any], tokens: dict[str, game_state.CardInfo], cpu_timeout: float, wall_timeout: float):
+    sync_token_card_infos(tokens)
+    state = game_state.GameState.model_validate_json(state_json)
+    signal.setitimer(signal.ITIMER_VIRTUAL, cpu_timeout)
+    signal.setitimer(signal.ITIMER_REAL, wall_timeout)
+    try:
+        success, output = run_code(code, state, persistent_vars)
+    except CodeTimeout as e:
+        success, output = False, f"{traceback.format_exc()}\n{e}. Make sure your code doesn't loop forever."
+    finally:
+        signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    new_tokens = {name: info for name, info in game_state.registered_tokens.items() if name not in tokens}
+    if not success:
+        return False, output, None, {}, {}
+    return True, output, state.model_dump_json(), picklable_vars(persistent_vars), new_tokens
+
+def _worker_main(connection, memory_limit: int):
+    "Run calls sent over `connection` one at a time until the parent closes it."
+    _init_worker(memory_limit)
+    while True:
+        try:
+            call = connection.recv()
+        except EOFError:
+            return
+        try:
+            result = _worker_run(*call)
+        except Exception:
+            result = (False, traceback.format_exc(), None, {}, {})
+        connection.send(result)
+
+class _Worker:
+    "A worker process and the parent's end of its pipe. Runs one call at a time."
+
+    def __init__(self, context, memory_limit: int):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_connection, memory_limit), daemon=True)
+        self.process.start()
+        child_connection.close()
+        # monotonic time the running call has to finish by, None while idle
+        self.deadline: Optional[float] = None
+
+    def kill(self):
+        self.process.kill()
+        self.connection.close()
+
+
+class CodeSandbox:
+    """Pool of pre-warmed worker processes that run judge code with a CPU, wall clock and memory limit.
+    Game states are sent to workers as json and returned as json, so many candidates from many games run in parallel without blocking the event loop.
+    Each call has a worker to itself, so its timeout only counts time spent running, and a call that hangs or crashes only takes down its own worker."""
+
+    def __init__(self, n_workers: Optional[int] = None, cpu_timeout: float = cpu_timeout_seconds, wall_timeout: float = wall_timeout_seconds, memory_limit: int = memory_limit_bytes):
+        self.n_workers = n_workers or os.cpu_count() or 4
+        self.cpu_timeout = cpu_timeout
+        self.wall_timeout = wall_timeout
+        self.memory_limit = memory_limit
+        self._context = None
+        self._workers: set[_Worker] = set()
+        self._idle: list[_Worker] = []
+        # workers still running a call whose caller was cancelled, eg by an early majority. They're reused once they finish
+        self._abandoned: list[_Worker] = []
+
+    def _spawn(self) -> _Worker:
+        if self._context is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                # workers fork from a server that has already imported game_state, so they start warm
+                self._context = multiprocessing.get_context("forkserver")
+                self._context.set_forkserver_preload(["game_state", "sandbox"])
+            else:
+                self._context = multiprocessing.get_context("spawn")
+        worker = _Worker(self._context, self.memory_limit)
+        self._workers.add(worker)
+        return worker
+
+    def _discard(self, worker: _Worker):
+        worker.kill()
+        self._workers.discard(worker)
+
+    def _reclaim_abandoned(self):
+        for worker in list(self._abandoned):
+            if worker.connection.poll():
+                self._abandoned.remove(worker)
+                try:
+                    worker.connection.recv()
+                except (EOFError, OSError):
+                    self._discard(worker)
+                    continue
+                worker.deadline = None
+                self._idle.append(worker)
+            elif time.monotonic() > worker.deadline:
+                self._abandoned.remove(worker)
+                self._discard(worker)
+
+    async def _acquire(self) -> _Worker:
+        poll_interval = 0.001
+        while True:
+            self._reclaim_abandoned()
+            if self._idle:
+                return self._idle.pop()
+            if len(self._workers) < self.n_workers:
+                return self._spawn()
+            await anyio.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, 0.02)
+
+    async def start(self):
+        "Start all workers ahead of time so the first judge calls don't pay process startup."
+        while len(self._workers) < self.n_workers:
+            self._idle.append(self._spawn())
+
+    def shutdown(self):
+        for worker in list(self._workers):
+            self._discard(worker)
+        self._idle.clear()
+        self._abandoned.clear()
+
+    async def run(self, code: str, state: game_state.GameState, persistent_vars: dict[str, Any], state_json: Optional[str] = None) -> tuple[bool, str, Optional[game_state.GameState], dict[str, Any]]:
+        """Run `code` against a copy of `state` and `persistent_vars` in a worker, see run_code.
+        Returns (success, printed output or traceback, new state, new persistent vars).
+        Tokens registered by the code are registered in this process too. Pass `state_json` to reuse an already serialized state."""
+        if state_json is None:
+            state_json = state.model_dump_json()
+        worker = await self._acquire()
+        # the worker was idle, so the call starts running now. Time spent waiting for a free worker doesn't count
+        worker.deadline = time.monotonic() + self.wall_timeout + hard_timeout_grace_seconds
+        finished = False
+        try:
+            try:
+                worker.connection.send((code, state_json, picklable_vars(persistent_vars), dict(game_state.registered_tokens), self.cpu_timeout, self.wall_timeout))
+            except OSError:
+                self._discard(worker)
+                return False, "The worker for this code had crashed, please try again.", None, {}
+            poll_interval = 0.001
+            while not worker.connection.poll():
+                if time.monotonic() > worker.deadline:
+                    self._discard(worker)
+                    return False, f"Code execution did not finish within {self.wall_timeout} seconds and was killed.", None, {}
+                await anyio.sleep(poll_interval)
+                poll_interval = min(poll_interval * 2, 0.02)
+            try:
+                success, output, new_state_json, new_persistent_vars, new_tokens = worker.connection.recv()
+            except (EOFError, OSError):
+                self._discard(worker)
+                return False, "The worker running this code crashed, likely from using too much memory.", None, {}
+            finished = True
+        finally:
+            if finished:
+                worker.deadline = None
+                self._idle.append(worker)
+            elif worker in self._workers:
+                self._abandoned.append(worker)
+        if not success:
+            return False, output, None, {}
+        for name, info in new_tokens.items():
+            game_state.registered_tokens.setdefault(name, info)
+            game_state.card_database['data'].setdefault(name, info)
+        return True, output, game_state.GameState.model_validate_json(new_state_json), new_persistent_vars
+
+default_sandbox = CodeSandbox()
@@ -0,0 +1,144 @@
+import anyio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from pydantic import BaseModel
+from typing import Optional
+
+# lower runs first
+priority_classes = {"interactive": 0, "eval": 1, "deckbuild": 2}
+default_priority = "eval"
+
+class ModelLimits(BaseModel):
+    requests_per_minute: float
+    input_tokens_per_minute: float
+    output_tokens_per_minute: float
+
+# Anthropic rate limits depend on the account's tier, set these to match yours
+rate_limits = {
+    "claude-sonnet-4-20250514": ModelLimits(requests_per_minute=4_000, input_tokens_per_minute=2_000_000, output_tokens_per_minute=400_000),
+    "claude-opus-4-20250514": ModelLimits(requests_per_minute=4_000, input_tokens_per_minute=2_000_000, output_tokens_per_minute=400_000),
+}
+default_limits = ModelLimits(requests_per_minute=1_000, input_tokens_per_minute=400_000, output_tokens_per_minute=80_000)
+
+# output tokens reserved per request before the real number is known
+reserved_output_tokens = 1_000
+
+class TokenBucket:
+    "Refills at `rate_per_second` up to `capacity`. Can go negative when more was used than reserved, delaying later requests."
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_second)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        "Seconds until `amount` tokens are available."
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.tokens) / self.rate_per_second)
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+class ModelQueue:
+    "Waiting requests and rate limits of one model."
+
+    def __init__(self, limits: ModelLimits):
+        self.requests = TokenBucket(limits.requests_per_minute / 60, limits.requests_per_minute / 60 * 10)
+        self.input_tokens = TokenBucket(limits.input_tokens_per_minute / 60, limits.input_tokens_per_minute)
+        self.output_tokens = TokenBucket(limits.output_tokens_per_minute / 60, limits.output_tokens_per_minute)
+        # heap of [priority rank, arrival order, wakeup event]
+        self.waiting: list[list] = []
+
+    def delay(self, input_tokens: float, output_tokens: float) -> float:
+        return max(self.requests.delay(1), self.input_tokens.delay(input_tokens), self.output_tokens.delay(output_tokens))
+
+    def wake_first(self):
+        if self.waiting:
+            self.waiting[0][2].set()
+
+class PriorityStats(BaseModel):
+    requests: int = 0
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+class Scheduler:
+    """Admits LLM requests per model in priority order, as fast as token buckets for requests, input tokens and output
+    tokens allow. Requests of the same priority are admitted in arrival order."""
+
+    def __init__(self):
+        self.queues: dict[str, ModelQueue] = {}
+        self.stats: dict[tuple[str, str], PriorityStats] = {}
+        self._arrivals = itertools.count()
+
+    def _queue(self, model: str) -> ModelQueue:
+        if model not in self.queues:
+            self.queues[model] = ModelQueue(rate_limits.get(model, default_limits))
+        return self.queues[model]
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: Optional[str], input_tokens: int, output_tokens: int = reserved_output_tokens):
+        "Wait for this request's turn. Use `report_usage` inside the block once real token counts are known."
+        priority = priority or default_priority
+        queue = self._queue(model)
+        entry = [priority_classes.get(priority, priority_classes[default_priority]), next(self._arrivals), anyio.Event()]
+        heapq.heappush(queue.waiting, entry)
+        start = time.monotonic()
+        try:
+            while True:
+                if queue.waiting[0] is entry:
+                    delay = queue.delay(input_tokens, output_tokens)
+                    if delay <= 0:
+                        break
+                    # a higher priority request may arrive meanwhile and take over the front of the queue
+                    with anyio.move_on_after(delay):
+                        await entry[2].wait()
+                else:
+                    await entry[2].wait()
+                entry[2] = anyio.Event()
+        except BaseException:
+            queue.waiting.remove(entry)
+            heapq.heapify(queue.waiting)
+            queue.wake_first()
+            raise
+        heapq.heappop(queue.waiting)
+        queue.requests.take(1)
+        queue.input_tokens.take(input_tokens)
+        queue.output_tokens.take(output_tokens)
+        queue.wake_first()
+        waited = time.monotonic() - start
+        stats = self.stats.setdefault((model, priority), PriorityStats())
+        stats.requests += 1
+        stats.total_wait_seconds += waited
+        stats.max_wait_seconds = max(stats.max_wait_seconds, waited)
+        yield Reservation(queue, input_tokens, output_tokens)
+
+    def metrics(self) -> dict:
+        "Queue depth per model and wait times per model and priority."
+        return {
+            "queue_depth": {model: len(queue.waiting) for model, queue in self.queues.items()},
+            "wait": {f"{model}/{priority}": {**stats.model_dump(), "mean_wait_seconds": stats.total_wait_seconds / max(stats.requests, 1)}
+                     for (model, priority), stats in self.stats.items()},
+        }
+
+class Reservation:
+    def __init__(self, queue: ModelQueue, input_tokens: int, output_tokens: int):
+        self.queue = queue
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+    def report_usage(self, input_tokens: int, output_tokens: int):
+        "Correct the buckets by the difference between the reserved and the real token counts."
+        self.queue.input_tokens.take(input_tokens - self.input_tokens)
+        self.queue.output_tokens.take(output_tokens - self.output_tokens)
+
+default_scheduler = Scheduler()
@@ -1,13 +1,18 @@
 from fastapi import FastAPI, WebSocket, Request, HTTPException
-from fastapi.responses import JSONResponse, Response, RedirectResponse
+from fastapi.responses import JSONResponse, Response, RedirectResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
-from typing import Set
+from typing import Set, Optional
 import trio
 from contextlib import asynccontextmanager
 from game_master import GameMaster
 import game_state
 import agents
 import image_generation
+import sandbox
+import journal
+import scheduler
+import hedging
+import metrics
 import random
 import os
 import uuid
@@ -17,21 +22,38 @@ import anyio
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await sandbox.default_sandbox.start()
     async with anyio.create_task_group() as task_group:
         app.state.task_group = task_group
         yield
+    sandbox.default_sandbox.shutdown()
 
 app = FastAPI(lifespan=lifespan)
 
 # Mount static files for cached images
 app.mount("/cached-images", StaticFiles(directory="cache_images"), name="cached-images")
 
+# how often a game another process is playing is checked for new steps, see watch_game
+watch_interval_seconds = 2.0
+
+# progress events waiting to be sent per game. When clients can't keep up, newer events are dropped, the next state broadcast catches them up
+event_buffer_size = 64
+
 class GameStateWebSocket:
-    def __init__(self, game_id: str):
+    def __init__(self, game_id: str, game_master: Optional[GameMaster] = None):
+        self.active_connections: Set[WebSocket] = set()
+        self.game_master = game_master if game_master is not None else self.new_game_master(game_id)
+        self.game_master.set_event_handler(self.broadcast_event)
+        self.event_sender, self.event_receiver = anyio.create_memory_object_stream(max_buffer_size=event_buffer_size)
+        
+        self.n_steps_since_last_broadcast = 0
+        self.is_killed = False
+        
+    @staticmethod
+    def new_game_master(game_id: str) -> GameMaster:
         print("\n" + "="*50)
         print("       STARTING NEW MAGIC GAME")
         print("="*50 + "\n")
-        self.active_connections: Set[WebSocket] = set()
         generation_settings = {
             "model": "claude-sonnet-4-20250514",
             "temperature": 1,
@@ -49,24 +71,26 @@ class GameStateWebSocket:
             agents.NaiveAgent(generation_settings=generation_settings), 
             agents.NaiveAgent(generation_settings=generation_settings)
         ]
-        self.game_master = GameMaster(game_id=game_id, game_state=new_state, agents=new_agents, generation_settings=generation_settings)
-        
-        self.n_steps_since_last_broadcast = 0
-        self.is_killed = False
+        return GameMaster(game_id=game_id, game_state=new_state, agents=new_agents, generation_settings=generation_settings, llm_priority="interactive")
         
     async def game_loop(self):
-        while self.game_master.winner is None:
-            if self.is_killed:
-                return
-            await self.broadcast_state()
-            await self.game_master.step()
+        async with anyio.create_task_group() as task_group:
+            # events are sent from their own task, so a slow client never holds up the game
+            task_group.start_soon(self.send_events)
+            while self.game_master.winner is None and not self.is_killed:
+                await self.broadcast_state()
+                await self.game_master.step()
+            task_group.cancel_scope.cancel()
+        # a finished game has saved its trace and closed its journal already, an abandoned one still holds them
+        metrics.write_chrome_trace(self.game_master.game_id)
+        self.game_master.close_journal()
         return self.game_master.winner
     
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         self.active_connections.add(websocket)
         if self.game_master:
-            await websocket.send_text(self.game_master.truncated_json())
+            await websocket.send_text(await self.game_master.truncated_json())
     
     async def disconnect(self, websocket: WebSocket):
         self.active_connections.remove(websocket)
@@ -84,7 +108,7 @@ class GameStateWebSocket:
         else:
             self.n_steps_since_last_broadcast = 0
             
-        state_json = self.game_master.truncated_json()
+        state_json = await self.game_master.truncated_json()
         disconnected = set()
         for connection in self.active_connections:
             try:
@@ -93,6 +117,23 @@ class GameStateWebSocket:
                 disconnected.add(connection)
         self.active_connections -= disconnected
         
+    async def broadcast_event(self, event: dict):
+        "Queue a small progress frame, eg a piece of agent text, to send between full state broadcasts. Dropped if the queue is full."
+        try:
+            self.event_sender.send_nowait(json.dumps({"type": "event", "event": event}))
+        except anyio.WouldBlock:
+            pass
+
+    async def send_events(self):
+        async for event_json in self.event_receiver:
+            disconnected = set()
+            for connection in list(self.active_connections):
+                try:
+                    await connection.send_text(event_json)
+                except:
+                    disconnected.add(connection)
+            self.active_connections -= disconnected
+        
     def is_abandoned(self) -> bool:
         return not self.active_connections
 
@@ -100,13 +141,10 @@ games:dict[str, GameStateWebSocket] = {}
 
 
 def get_game_data(game_id: str):
-    ongoing_path = Path("database/ongoing_games") / f"{game_id}.json"
-    finished_path = Path("database/finished_games") / f"{game_id}.json"
-    
-    if ongoing_path.exists():
-        return GameMaster.model_validate_json(ongoing_path.read_text())
-    elif finished_path.exists():
-        return GameMaster.model_validate_json(finished_path.read_text())
+    if journal.journal_path(game_id).exists():
+        return GameMaster.from_journal(game_id)
+    elif journal.finished_path(game_id).exists():
+        return GameMaster.model_validate_json(journal.finished_path(game_id).read_text())
 
 @app.get("/get_game/{game_id}")
 async def get_game(game_id: str):
@@ -119,8 +157,8 @@ async def get_game(game_id: str):
     
 @app.get("/games")
 async def get_games():
-    ongoing_games = [f.stem for f in Path("database/ongoing_games").glob("*.json")]
-    finished_games = [f.stem for f in Path("database/finished_games").glob("*.json")]
+    ongoing_games = journal.ongoing_game_ids()
+    finished_games = [f.stem for f in journal.finished_games_dir.glob("*.json")]
     
     response = JSONResponse(content={
         "ongoing_games": ongoing_games,
@@ -129,13 +167,69 @@ async def get_games():
     response.headers["Access-Control-Allow-Origin"] = "*"
     return response
 
+@app.get("/llm_scheduler")
+async def get_llm_scheduler_metrics():
+    response = JSONResponse(content={**scheduler.default_scheduler.metrics(), "hedging": hedging.default_policy.metrics()})
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
 
+@app.get("/trace/{game_id}")
+async def get_trace(game_id: str):
+    "Chrome trace of a game, open it in chrome://tracing or Perfetto."
+    trace_path = Path(metrics.traces_dir) / f"{game_id}.json"
+    if game_id in metrics.traces:
+        content = metrics.chrome_trace(game_id)
+    elif trace_path.exists():
+        content = json.loads(trace_path.read_text())
+    else:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    response = JSONResponse(content=content)
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+async def watch_game(websocket: WebSocket, game_id: str):
+    "Show a game another process is playing without resuming it, sending its state whenever its journal grows."
+    await websocket.accept()
+    async def send_updates():
+        last_size = None
+        while journal.journal_path(game_id).exists():
+            size = journal.journal_path(game_id).stat().st_size
+            if size != last_size:
+                last_size = size
+                game_master = await anyio.to_thread.run_sync(GameMaster.from_journal, game_id)
+                await websocket.send_text(await game_master.truncated_json())
+            await anyio.sleep(watch_interval_seconds)
+        game_master = get_game_data(game_id)
+        if game_master is not None:
+            await websocket.send_text(await game_master.truncated_json())
+    async with anyio.create_task_group() as task_group:
+        task_group.start_soon(send_updates)
+        try:
+            while True:
+                await websocket.receive_text()  # Keep connection alive
+        except:
+            pass
+        task_group.cancel_scope.cancel()
 
 @app.websocket("/ws/{game_id}")
 async def websocket_endpoint(websocket: WebSocket, game_id: str):
     if game_id not in games:
-        await websocket.close(code=1000, reason="Game not found")
-        return
+        if not journal.journal_path(game_id).exists():
+            await websocket.close(code=1000, reason="Game not found")
+            return
+        # game was interrupted by a server restart, pick it up from its journal unless another process is playing it
+        game_master = GameMaster.from_journal(game_id)
+        try:
+            game_master.get_journal()
+        except journal.JournalLocked:
+            await watch_game(websocket, game_id)
+            return
+        games[game_id] = GameStateWebSocket(game_id=game_id, game_master=game_master)
+        websocket.app.state.task_group.start_soon(games[game_id].game_loop)
         
     game = games[game_id]
     await game.connect(websocket)
@@ -0,0 +1,81 @@
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+import pytest
+
+# the modules live at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+def fixture_card(name: str, types: list[str], mana_cost: str = "", mana_value: float = 0.0, colors: list[str] = (), subtypes: list[str] = (),
+                 supertypes: list[str] = (), power: str = None, toughness: str = None, text: str = "") -> dict:
+    card = {"name": name, "manaCost": mana_cost, "manaValue": mana_value, "colors": list(colors), "colorIdentity": list(colors), "types": types,
+            "subtypes": list(subtypes), "supertypes": list(supertypes), "text": text, "legalities": ["standard", "modern"]}
+    if power is not None:
+        card.update(power=power, toughness=toughness)
+    return card
+
+# the cards the tests play with, in the shape of assets/AtomicCardsGameplay.json
+fixture_cards = {card["name"]: card for card in [
+    fixture_card("Mountain", ["Land"], subtypes=["Mountain"], supertypes=["Basic"], text="({T}: Add {R}.)"),
+    fixture_card("Plains", ["Land"], subtypes=["Plains"], supertypes=["Basic"], text="({T}: Add {W}.)"),
+    fixture_card("Raging Goblin", ["Creature"], "{R}", 1.0, ["R"], ["Goblin", "Berserker"], power="1", toughness="1", text="Haste (This creature can attack and block the turn it comes under your control.)"),
+    fixture_card("Savannah Lions", ["Creature"], "{W}", 1.0, ["W"], ["Cat"], power="2", toughness="1"),
+    fixture_card("Hill Giant", ["Creature"], "{3}{R}", 4.0, ["R"], ["Giant"], power="3", toughness="3"),
+    fixture_card("Lightning Bolt", ["Instant"], "{R}", 1.0, ["R"], text="Lightning Bolt deals 3 damage to any target."),
+]}
+
+# Modules read assets/ and create logs/, cache/ and database/ in the working directory when they're imported, so the
+# tests run in a scratch directory with the fixture card database instead of in the repository
+scratch_dir = Path(tempfile.mkdtemp(prefix="mtg-llm-tests-"))
+(scratch_dir / "assets").mkdir()
+(scratch_dir / "assets" / "AtomicCardsGameplay.json").write_text(json.dumps({"meta": {}, "data": fixture_cards}))
+(scratch_dir / "assets" / "MagicCompRules.txt").write_text("")
+os.chdir(scratch_dir)
+atexit.register(shutil.rmtree, scratch_dir, ignore_errors=True)
+
+import game_master
+import game_state
+import journal
+import log
+import log_writer
+import metrics
+
+@pytest.fixture(autouse=True)
+def output_dirs(tmp_path, monkeypatch):
+    "Journals, finished games, traces, generation logs and usage totals of each test go to its own tmp_path."
+    for name in ("ongoing_games", "finished_games", "traces", "generations"):
+        (tmp_path / name).mkdir()
+    monkeypatch.setattr(journal, "ongoing_games_dir", tmp_path / "ongoing_games")
+    monkeypatch.setattr(journal, "finished_games_dir", tmp_path / "finished_games")
+    monkeypatch.setattr(metrics, "traces_dir", str(tmp_path / "traces"))
+    writer = log_writer.LogWriter(str(tmp_path / "generations"), str(tmp_path / "total_usage.json"), str(tmp_path / "game_usage.json"))
+    monkeypatch.setattr(log, "writer", writer)
+    yield tmp_path
+    writer.close()
+
+@pytest.fixture
+def model() -> str:
+    return "claude-sonnet-4-20250514"
+
+@pytest.fixture
+def mainboard() -> dict[str, int]:
+    "Both players' mainboard in `state`. Parametrize it for a test that needs other cards."
+    return {"Mountain": 10, "Savannah Lions": 10, "Lightning Bolt": 10}
+
+@pytest.fixture
+def state(mainboard):
+    decklist = game_state.DeckList(mainboard=mainboard, sideboard={})
+    return game_state.GameState.init_from_decklists([decklist, decklist])
+
+@pytest.fixture
+def agents() -> list:
+    "The players of `game`. Parametrize it for a test that asks them for actions."
+    return []
+
+@pytest.fixture
+def game(state, agents, model):
+    return game_master.GameMaster(game_state=state, agents=agents, generation_settings={"model": model})
@@ -0,0 +1,35 @@
+import fingerprint
+import game_master
+import pytest
+
+@pytest.fixture
+def state(state):
+    "The shared state with a Savannah Lions and a Mountain on player 0's battlefield."
+    state.add_card_to_battlefield(0, "Savannah Lions")
+    state.add_card_to_battlefield(0, "Mountain")
+    return state
+
+def test_states_equal_in_game_terms_share_a_fingerprint(state):
+    reordered = state.model_copy(deep=True)
+    board = reordered.player_boards[0]
+    board.hand.reverse()
+    board.battlefield.cards = dict(reversed(board.battlefield.cards.items()))
+    reordered.random_state = "another draw"
+    assert fingerprint.state_fingerprint(reordered) != fingerprint.state_fingerprint(state)
+    assert game_master.state_vote_key(reordered) == game_master.state_vote_key(state)
+    board.library.reverse()
+    assert game_master.state_vote_key(reordered) != game_master.state_vote_key(state)
+
+def test_judge_notes_are_part_of_the_vote(state):
+    noted = state.model_copy(deep=True)
+    next(iter(noted.player_boards[0].battlefield.values())).judge_private_notes = "Exiled face down: Lightning Bolt"
+    assert fingerprint.state_fingerprint(noted, ignore_judge_notes=True) == fingerprint.state_fingerprint(state, ignore_judge_notes=True)
+    assert game_master.state_vote_key(noted) != game_master.state_vote_key(state)
+    chosen, index = game_master.game_state_consistency([noted, state, state.model_copy(deep=True)])
+    assert chosen is state and index == 1
+
+def test_consistency_votes_by_fingerprint(state):
+    other = state.model_copy(deep=True)
+    other.player_boards[1].life = 17
+    assert game_master.consistency([other, state, state.model_copy(deep=True)]) == (state, 1)
+    assert game_master.consistency(["Pass", "Attack", "Attack"]) == ("Attack", 1)
@@ -0,0 +1,23 @@
+import pytest
+import game_history
+
+@pytest.mark.parametrize("code, replayable", [
+    ("board = game_state.player_boards[0]\nfor card in board.hand: print(card)\nboard.life -= 1", True),
+    ("def damage(board, amount):\n    board.life -= amount\ndamage(game_state.player_boards[1], 3)", True),
+    ("global lifelink\nlifelink = [CardType.CREATURE]", True),
+    ("game_state.player_boards[0].life -= lifelink", False),
+    ("counter += 1", False),
+    ("import random\nrandom.shuffle(game_state.player_boards[0].library)", False),
+])
+def test_replayability_is_decided_from_the_code(code, replayable):
+    assert game_history.is_replayable(code) == replayable
+
+def test_only_steps_after_unreplayable_code_are_keyframes(state):
+    codes = []
+    history = game_history.GameHistory(keyframe_interval=100)
+    history.bind_code(codes)
+    for code in ["x = 1", "game_state.player_boards[0].life -= 1", "global y\ny = 2", "game_state.player_boards[0].life -= y", "z = 3"]:
+        history.append(state, len(codes))
+        codes.append(code)
+    history.append(state, len(codes))
+    assert set(history.keyframes) == {0, 4}
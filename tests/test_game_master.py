@@ -0,0 +1,49 @@
+import anyio
+import json
+import os
+import pytest
+import game_master
+import metrics
+
+class LegacyAgent(game_master.AgentInterface):
+    async def take_action(self, history, visible_information, available_actions, rules_violation_feedback=None):
+        return "Pass"
+
+class StreamingAgent(game_master.AgentInterface):
+    async def take_action(self, history, visible_information, available_actions, rules_violation_feedback=None, on_text=None):
+        await on_text("Pass")
+        return "Pass"
+
+@pytest.mark.parametrize("agents", [[LegacyAgent(), StreamingAgent()]])
+def test_on_text_is_only_passed_to_agents_that_take_it(game):
+    events = []
+    async def record(event):
+        events.append(event)
+    game.set_event_handler(record)
+    async def main():
+        return [await game.get_player_action(player_index, "- Pass", "") for player_index in (0, 1)]
+    assert anyio.run(main) == ["Pass", "Pass"]
+    assert [event["player_index"] for event in events if event["type"] == "agent_text"] == [1]
+
+@pytest.mark.parametrize("agents", [[LegacyAgent(), LegacyAgent()]])
+def test_a_won_game_saves_its_trace_and_drops_it_from_memory(monkeypatch, game):
+    async def win(self, action):
+        self.winner = 0
+    monkeypatch.setattr(game_master.GameMaster, "game_master_step", win)
+    assert anyio.run(game.step) == 0
+    assert game.game_id not in metrics.traces
+    with open(os.path.join(metrics.traces_dir, f"{game.game_id}.json")) as f:
+        assert any(event["name"] == "step" for event in json.load(f)["traceEvents"])
+
+@pytest.mark.parametrize("agents", [[LegacyAgent(), LegacyAgent()]])
+def test_steps_are_recorded_on_the_trace_and_only_printed_when_verbose(monkeypatch, capsys, game):
+    async def no_change(self, action):
+        pass
+    monkeypatch.setattr(game_master.GameMaster, "game_master_step", no_change)
+    anyio.run(game.step)
+    assert capsys.readouterr().out == ""
+    step_events = [event for event in metrics.chrome_trace(game.game_id)["traceEvents"] if event["name"] == "step"]
+    assert step_events[-1]["args"]["action"] == "Pass" and step_events[-1]["args"]["priority_player"] == 0
+    game.verbose = True
+    anyio.run(game.step)
+    assert "Player 0 action: Pass" in capsys.readouterr().out
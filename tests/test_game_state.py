@@ -0,0 +1,107 @@
+import copy
+import json
+import pickle
+import random
+from game_state import Battlefield, CardType, CardZone, card_type_flags, register_token_card_info
+
+def scanned_ids_of_type(battlefield: Battlefield, card_type: CardType) -> set[int]:
+    return {battlefield_id for battlefield_id, battlefield_card in battlefield.items() if card_type in card_type_flags(battlefield_card.card)}
+
+def assert_indexes_match(battlefield: Battlefield):
+    for card_type in (CardType.LAND, CardType.CREATURE, CardType.LAND | CardType.BASIC):
+        assert battlefield.ids_of_type(card_type) == scanned_ids_of_type(battlefield, card_type)
+    assert battlefield.tapped_ids() == {battlefield_id for battlefield_id, battlefield_card in battlefield.items() if battlefield_card.tapped}
+    for owner in (0, 1):
+        assert battlefield.ids_owned_by(owner) == {battlefield_id for battlefield_id, battlefield_card in battlefield.items() if battlefield_card.owner == owner}
+
+def test_board_methods_keep_indexes_up_to_date(state):
+    board = state.player_boards[0]
+    assert_indexes_match(board.battlefield)
+    land_id, creature_id = state.next_battlefield_id, state.next_battlefield_id + 1
+    state.add_card_to_battlefield(0, "Mountain")
+    state.add_card_to_battlefield(0, "Savannah Lions")
+    assert board.battlefield.ids_of_type(CardType.LAND) == {land_id}
+    board.tap_permanents([land_id, creature_id])
+    assert board.battlefield._indexed
+    assert_indexes_match(board.battlefield)
+    board.untap_all()
+    assert board.battlefield.tapped_ids() == set()
+    board.battlefield_to_graveyard([creature_id])
+    assert_indexes_match(board.battlefield)
+    assert board.battlefield.ids_of_type(CardType(0)) == {land_id}
+
+def test_setting_a_card_field_only_invalidates_its_own_battlefield(state):
+    state.add_card_to_battlefield(0, "Mountain")
+    state.add_card_to_battlefield(1, "Mountain")
+    battlefields = [board.battlefield for board in state.player_boards]
+    for battlefield in battlefields:
+        battlefield.tapped_ids()
+    next(iter(battlefields[0].values())).tapped = True
+    assert not battlefields[0]._indexed and battlefields[1]._indexed
+    for battlefield in battlefields:
+        assert_indexes_match(battlefield)
+
+def test_battlefields_sharing_cards_stay_correct(state):
+    state.add_card_to_battlefield(0, "Savannah Lions")
+    battlefield = state.player_boards[0].battlefield
+    shallow_copy = copy.copy(battlefield)
+    assert_indexes_match(battlefield)
+    assert_indexes_match(shallow_copy)
+    battlefield_card = next(iter(battlefield.values()))
+    battlefield_card.card = "Mountain"
+    battlefield_card.tapped = True
+    assert_indexes_match(battlefield)
+    assert_indexes_match(shallow_copy)
+    # copies made without the battlefield don't tell it about their changes
+    for card_copy in (battlefield_card.model_copy(), copy.deepcopy(battlefield_card), pickle.loads(pickle.dumps(battlefield_card))):
+        assert card_copy == battlefield_card
+        card_copy.tapped = False
+        assert battlefield._indexed
+
+def test_zone_type_counts_follow_draws(state):
+    board = state.player_boards[0]
+    for zone in (board.hand, board.library):
+        zone.count_of_type(CardType.LAND)
+    board.draw_cards(5)
+    board.hand.remove(board.hand[0])
+    board.library.insert(0, "Mountain")
+    for zone in (board.hand, board.library):
+        assert zone._type_counts is not None
+        for card_type in (CardType.LAND, CardType.CREATURE, CardType.INSTANT, CardType(0)):
+            assert zone.count_of_type(card_type) == CardZone(list(zone)).count_of_type(card_type) == sum(card_type in card_type_flags(card) for card in zone)
+
+def test_zones_work_with_list_idioms(state):
+    board = state.player_boards[0]
+    hand = list(board.hand)
+    assert ["Mountain"] + board.hand == ["Mountain"] + hand
+    assert board.hand + ["Mountain"] == hand + ["Mountain"]
+    assert board.hand * 2 == 2 * board.hand == hand * 2
+    assert type(board.hand * 2) is list and type(["Mountain"] + board.hand) is list
+    assert json.loads(json.dumps(board.hand)) == hand
+    assert json.loads(json.dumps({"hand": board.hand, "exile": board.exile})) == {"hand": hand, "exile": []}
+    board.hand = ["Mountain"] + board.hand
+    assert isinstance(board.hand, CardZone) and board.hand.count_of_type(CardType.LAND) == sum(CardType.LAND in card_type_flags(card) for card in board.hand)
+
+def test_zone_type_counts_follow_list_changes(state):
+    zone = state.player_boards[0].library
+    zone.count_of_type(CardType.LAND)
+    random.shuffle(zone)
+    zone += ["Mountain", "Savannah Lions"]
+    zone[0] = "Lightning Bolt"
+    zone[1:3] = ["Mountain"]
+    del zone[-1]
+    zone *= 2
+    for card_type in (CardType.LAND, CardType.CREATURE, CardType.INSTANT, CardType(0)):
+        assert zone.count_of_type(card_type) == sum(card_type in card_type_flags(card) for card in zone)
+    assert list(zone.ids) == [CardZone([card]).ids[0] for card in zone]
+
+def test_attackers_ignore_keywords_in_reminder_text(state):
+    register_token_card_info("Test Dasher", ["Creature"], [], 2, 2, text="Dash {R} (You may cast this spell for its dash cost. If you do, it gains haste, and it's returned from the battlefield to its owner's hand at the beginning of the next end step.)")
+    register_token_card_info("Test Wall", ["Creature"], [], 0, 4, text="Defender")
+    board = state.player_boards[0]
+    for card in ("Test Dasher", "Raging Goblin", "Test Wall", "Savannah Lions"):
+        state.add_card_to_battlefield(0, card)
+    assert [battlefield_card.card for battlefield_card in board.creatures_able_to_attack()] == ["Raging Goblin"]
+    state.reset_entered_battlefield_this_turn()
+    board.tap_permanents([1])
+    assert [battlefield_card.card for battlefield_card in board.creatures_able_to_attack()] == ["Test Dasher", "Savannah Lions"]
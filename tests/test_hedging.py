@@ -0,0 +1,50 @@
+import anyio
+import pytest
+from types import SimpleNamespace
+import hedging
+import llm_backends
+import scheduler
+
+def test_censored_latencies_raise_percentiles():
+    histogram = hedging.LatencyHistogram()
+    for seconds in (1, 2, 3, 4):
+        histogram.record(seconds)
+    assert histogram.percentile(0.5) == 2
+    # calls that were still running after 5 seconds when they were cancelled
+    for _ in range(4):
+        histogram.record(5, censored=True)
+    assert histogram.percentile(0.5) == 4
+    assert histogram.percentile(0.95) == 5
+
+class FakeMessages:
+    "Answers the first request after `first_latency` seconds and later ones immediately."
+    def __init__(self, first_latency: float):
+        self.first_latency = first_latency
+        self.requests = 0
+
+    async def create(self, **kwargs):
+        self.requests += 1
+        if self.requests == 1:
+            await anyio.sleep(self.first_latency)
+        usage = SimpleNamespace(input_tokens=100, output_tokens=10, cache_creation_input_tokens=0, cache_read_input_tokens=0)
+        return SimpleNamespace(usage=usage, model_dump=lambda: {"content": []})
+
+def test_hedged_calls_meter_both_attempts_and_reserve_capacity(monkeypatch, model):
+    policy = hedging.HedgePolicy(min_samples=1, budget_fraction=1)
+    policy.histogram(model, 0).record(0.01)
+    monkeypatch.setattr(hedging, "default_policy", policy)
+    monkeypatch.setattr(scheduler, "default_scheduler", scheduler.Scheduler())
+    backend = llm_backends.AnthropicBackend()
+    messages = FakeMessages(first_latency=10)
+    backend._client = SimpleNamespace(messages=messages)
+    kwargs = {"model": model, "messages": [{"role": "user", "content": "Pass?"}], "max_tokens": 100}
+
+    _, usage = anyio.run(backend.create, kwargs, "key", None, True)
+
+    assert messages.requests == 2
+    assert policy.hedges == 1 and policy.hedge_wins == 1
+    # the winner's real usage plus the cancelled first attempt's estimate
+    assert usage["prompt_tokens"] == 100 + llm_backends.estimate_input_tokens(kwargs)
+    assert usage["completion_tokens"] == 10 + 100
+    assert scheduler.default_scheduler.stats[(model, scheduler.default_priority)].requests == 2
+    assert sum(censored for _, censored in policy.histogram(model, 0).samples) == 1
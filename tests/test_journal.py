@@ -0,0 +1,32 @@
+import anyio
+import pytest
+import threading
+import journal
+
+def test_a_journal_has_one_writer(game):
+    game_journal = game.get_journal()
+    assert journal.is_locked(game.game_id)
+    with pytest.raises(journal.JournalLocked):
+        journal.GameJournal(game.game_id)
+    game.close_journal()
+    assert not journal.is_locked(game.game_id)
+    journal.GameJournal(game.game_id).close()
+    assert game_journal.file.closed
+
+def test_steps_sync_the_journal_in_a_worker_thread(game, monkeypatch):
+    synced_from = []
+    def sync(self):
+        synced_from.append(threading.current_thread())
+        self.records_since_sync = 0
+    monkeypatch.setattr(journal.GameJournal, "sync", sync)
+    monkeypatch.setattr(journal, "fsync_every_records", 2)
+    async def step(self, action=None):
+        pass
+    monkeypatch.setattr(type(game), "game_master_step", step)
+    monkeypatch.setattr(type(game), "take_player_action_speculatively", step)
+    async def main():
+        await game.step()
+        await game.step()
+    anyio.run(main)
+    # the start record and two steps make 3 records, synced once 2 are written
+    assert len(synced_from) == 1 and synced_from[0] is not threading.main_thread()
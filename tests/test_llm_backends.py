@@ -0,0 +1,26 @@
+import anyio
+import pytest
+import build_deck
+import llm_backends
+import log
+import prompting
+
+def test_backends_must_implement_create():
+    with pytest.raises(TypeError):
+        llm_backends.LLMBackend()
+
+@pytest.mark.parametrize("active_player", [0, 1])
+def test_synthetic_script_reads_the_active_player_from_the_omniscient_view(state, active_player):
+    state.active_player_index = active_player
+    kwargs = {
+        "tools": [{"name": "advance_game_state", "input_schema": {}}],
+        "tool_choice": {"type": "any"},
+        "messages": [{"role": "user", "content": prompting.format_omniscient_view(state) + "\n" + llm_backends.tool_request("advance_game_state")}],
+    }
+    assert llm_backends.synthetic_game_script(kwargs)["priority_player"] == 1 - active_player
+
+def test_deck_building_finishes_under_the_scripted_backend(monkeypatch):
+    monkeypatch.setattr(log, "backend", llm_backends.ScriptedBackend(llm_backends.synthetic_game_script))
+    decklist = anyio.run(build_deck.generate_deck_from_request, "A red creature deck for Modern", 1)
+    assert decklist.mainboard == {"Raging Goblin": 4, "Hill Giant": 4, "Mountain": 52}
+    assert build_deck.compute_decklist_stats(decklist)["mainboard_count"] == 60
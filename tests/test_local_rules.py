@@ -0,0 +1,101 @@
+import pytest
+import game_state
+import local_rules
+import sandbox
+from game_state import TurnStep
+
+@pytest.fixture
+def turn_step() -> TurnStep:
+    return TurnStep.MAIN_1
+
+@pytest.fixture
+def hand() -> list[str]:
+    return []
+
+@pytest.fixture
+def state(state, turn_step, hand):
+    "The shared state at `turn_step` of player 0's turn, with `hand` in both hands and ten Mountains in both libraries."
+    state.turn_step = turn_step
+    for board in state.player_boards:
+        board.hand = list(hand)
+        board.library = ["Mountain"] * 10
+    return state
+
+def run(state: game_state.GameState, resolution: local_rules.LocalResolution) -> game_state.GameState:
+    success, output = sandbox.run_code(resolution.code, state, {})
+    assert success, output
+    return state
+
+@pytest.mark.parametrize("turn_step", [TurnStep.UPKEEP])
+def test_pass_in_upkeep_stays_in_the_turn(state):
+    resolution = local_rules.resolve_action(state, 0, "Pass")
+    assert resolution.priority_player == 0
+    run(state, resolution)
+    assert (state.active_player_index, state.turn_step, state.turn_number) == (0, TurnStep.MAIN_1, 1)
+    assert len(state.player_boards[0].hand) == 1
+
+@pytest.mark.parametrize("turn_step", [TurnStep.UPKEEP])
+@pytest.mark.parametrize("empty_library, resolved", [(0, False), (1, True)])
+def test_pass_in_upkeep_checks_the_active_players_library(state, empty_library, resolved):
+    # the opponent's library doesn't matter this turn
+    state.player_boards[empty_library].library = []
+    assert (local_rules.resolve_action(state, 0, "Pass") is not None) == resolved
+
+@pytest.mark.parametrize("turn_step, hand", [(TurnStep.UPKEEP, ["Mountain"] * 8)])
+def test_pass_in_upkeep_ignores_hand_size(state):
+    assert local_rules.resolve_action(state, 0, "Pass") is not None
+
+@pytest.mark.parametrize("turn_step", [TurnStep.UPKEEP, TurnStep.MAIN_1, TurnStep.MAIN_2])
+def test_end_turn_goes_to_the_next_players_turn(state):
+    resolution = local_rules.resolve_action(state, 0, "End turn")
+    assert resolution.priority_player == 1
+    run(state, resolution)
+    assert (state.active_player_index, state.turn_step) == (1, TurnStep.MAIN_1)
+
+# drawing in this turn's draw step makes 8 cards from 7 when passing in upkeep
+@pytest.mark.parametrize("turn_step, hand", [(TurnStep.MAIN_2, ["Mountain"] * 8), (TurnStep.UPKEEP, ["Mountain"] * 7)])
+def test_end_turn_checks_hand_size(state):
+    assert local_rules.resolve_action(state, 0, "End turn") is None
+
+@pytest.mark.parametrize("turn_step", [TurnStep.MAIN_2])
+def test_passing_into_the_next_turn_checks_the_next_players_library(state):
+    state.player_boards[1].library = []
+    assert local_rules.resolve_action(state, 0, "Pass") is None
+
+@pytest.mark.parametrize("turn_step", [TurnStep.DECLARE_ATTACKERS])
+def test_pass_after_declaring_attackers_goes_to_the_judge(state):
+    assert local_rules.resolve_action(state, 0, "Pass", at_step_start=False) is None
+    resolution = local_rules.resolve_action(state, 0, "Pass", at_step_start=True)
+    run(state, resolution)
+    assert state.turn_step == TurnStep.MAIN_2
+
+def test_only_the_active_player_passes_locally(state):
+    assert local_rules.resolve_action(state, 1, "Pass") is None
+
+@pytest.mark.parametrize("hand", [["Mountain", "Hill Giant"]])
+def test_a_board_of_vanilla_cards_is_quiet(state):
+    assert local_rules.board_is_quiet(state)
+
+def test_abilities_outside_the_battlefield_make_the_board_loud(state):
+    game_state.register_token_card_info("Test Cycler", ["Creature"], [], 1, 1, text="Cycling {2} ({2}, Discard this card: Draw a card.)")
+    game_state.register_token_card_info("Test Flashback", ["Sorcery"], [], text="Draw a card.\nFlashback {3}{U}")
+    state.player_boards[0].hand.append("Test Cycler")
+    assert not local_rules.board_is_quiet(state)
+    state.player_boards[0].hand.remove("Test Cycler")
+    state.player_boards[1].graveyard.append("Test Flashback")
+    assert not local_rules.board_is_quiet(state)
+
+@pytest.mark.parametrize("hand", [["Mountain"]])
+def test_analysis_is_for_the_real_priority_holder(state):
+    assert local_rules.analyze_state(state, 1) is None
+    analysis = local_rules.analyze_state(state, 0)
+    assert analysis["priority_player"] == 0
+    assert "- Play Mountain" in analysis["priority_player_available_actions"]
+
+@pytest.mark.parametrize("turn_step", [TurnStep.DECLARE_ATTACKERS])
+def test_attack_options_only_before_attackers_are_declared(state):
+    state.add_card_to_battlefield(0, "Hill Giant")
+    state.player_boards[0].battlefield[0].entered_battlefield_this_turn = False
+    assert local_rules.analyze_state(state, 0, at_step_start=False) is None
+    analysis = local_rules.analyze_state(state, 0, at_step_start=True)
+    assert "Attack with any combination of: Hill Giant" in analysis["priority_player_available_actions"]
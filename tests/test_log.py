@@ -0,0 +1,40 @@
+import anyio
+import pytest
+import llm_backends
+import llm_cache
+import log
+import threading
+
+@pytest.mark.parametrize("options, calls", [({}, 1), ({"coalesce": False}, 2)])
+def test_concurrent_identical_requests_share_a_call(monkeypatch, model, options, calls):
+    requests = []
+    def script(kwargs):
+        requests.append(kwargs)
+        return "Pass"
+    monkeypatch.setattr(log, "backend", llm_backends.ScriptedBackend(script, latency_seconds=0.05))
+    responses = []
+    async def generate():
+        responses.append(await log.llm_generate(model=model, messages=[{"role": "user", "content": "Pass?"}], temperature=1, **options))
+    async def main():
+        async with anyio.create_task_group() as task_group:
+            for _ in range(2):
+                task_group.start_soon(generate)
+    anyio.run(main)
+    assert len(requests) == calls and [response["content"][0]["text"] for response in responses] == ["Pass", "Pass"]
+
+def test_cache_lookups_run_in_a_worker_thread(monkeypatch, tmp_path, model):
+    class CachedScriptedBackend(llm_backends.ScriptedBackend):
+        cacheable = True
+    monkeypatch.setattr(log, "backend", CachedScriptedBackend(lambda kwargs: "Pass"))
+    cache = llm_cache.ResponseCache(str(tmp_path / "responses.sqlite"))
+    looked_up_from = []
+    def get(key):
+        looked_up_from.append(threading.current_thread())
+        return llm_cache.ResponseCache.get(cache, key)
+    monkeypatch.setattr(cache, "get", get)
+    monkeypatch.setattr(log, "response_cache", cache)
+    kwargs = {"model": model, "messages": [{"role": "user", "content": "Pass?"}]}
+    cache.put(log._get_cache_key(kwargs), {"content": [{"type": "text", "text": "Cached"}]})
+    response = anyio.run(lambda: log.llm_generate(**kwargs))
+    assert response["content"][0]["text"] == "Cached"
+    assert looked_up_from and threading.main_thread() not in looked_up_from
@@ -0,0 +1,15 @@
+import sandbox
+
+def test_only_global_variables_are_kept(state):
+    persistent_vars = {}
+    success, output = sandbox.run_code("global life_lost\nboard = game_state.player_boards[0]\nlife_lost = 20 - board.life\nfor card in board.hand: pass", state, persistent_vars)
+    assert success, output
+    assert persistent_vars == {"life_lost": 0}
+    success, output = sandbox.run_code("print(life_lost)\nlife_lost += 1\nextra = [life_lost for _ in range(2)]", state, persistent_vars)
+    assert success, output
+    assert output == "0\n" and persistent_vars == {"life_lost": 1}
+
+def test_failed_code_keeps_the_previous_variables(state):
+    persistent_vars = {"count": 1}
+    success, _ = sandbox.run_code("global count, other\ncount = 2\nother = 3\nraise ValueError", state, persistent_vars)
+    assert not success and persistent_vars == {"count": 1}
@@ -0,0 +1,41 @@
+import anyio
+import pytest
+import game_master
+import llm_backends
+import log
+
+class BilledScriptedBackend(llm_backends.ScriptedBackend):
+    billed = True
+
+def metered_call(model: str, latency_seconds: float, timeout: float) -> log.CostMeter:
+    previous_backend = log.backend
+    log.backend = BilledScriptedBackend(lambda kwargs: "Pass", latency_seconds=latency_seconds)
+    meter = log.CostMeter()
+    async def main():
+        log.current_cost_meter.set(meter)
+        with anyio.move_on_after(timeout):
+            await log.llm_generate(model=model, messages=[{"role": "user", "content": "Pass?"}], no_cache=True)
+    try:
+        anyio.run(main)
+    finally:
+        log.backend = previous_backend
+    return meter
+
+def test_cancelled_calls_are_charged_their_estimate(model):
+    meter = metered_call(model, latency_seconds=10, timeout=0.05)
+    assert meter.cost == pytest.approx(log.estimate_call_cost({"model": model, "messages": [{"role": "user", "content": "Pass?"}]}))
+    assert meter.cost > 0
+
+def test_finished_calls_are_charged_their_usage(model):
+    # the scripted backend reports no usage, so the estimate is refunded when the call finishes
+    assert metered_call(model, latency_seconds=0, timeout=10).cost == pytest.approx(0)
+
+def test_fork_does_not_write_the_game(game):
+    game.past_game_states.append(game.game_state, 0)
+    fork = game.fork()
+    fork.used_python_code.append("game_state.player_boards[0].life -= 1")
+    fork.past_game_states.append(fork.game_state, 1)
+    fork.error_messages.append("error")
+    assert len(game.past_game_states) == 1 and game.used_python_code == [] and game.error_messages == []
+    with pytest.raises(AssertionError):
+        fork.get_journal()